@@ -1,52 +1,184 @@
-import bpy, bmesh
-import json
+"""
+This Blender script creates an armature from the OpenSim model for each SKEL body morphology, skins the SKEL skin mesh to it, transfers the SMPL UV map to the mesh, and exports the result as "human_<variant>.glb".
+Basic usage: "blender --background --python Blender_skin_and_rig.py -- --variants female_zero,male_zero"
+Arguments after "--" are read by this script:
+    "--variants A,B,..." sets the body morphologies to rig (the ten morphologies generated by generate_meshes.py by default)
+    "--matlab-outputs PATH/TO/FOLDER" sets the folder with hierarchy.json and the bone_endpoints_*, bone_rotations_* and generalized_coordinates_* files of each morphology
+    "--skel-outputs PATH/TO/FOLDER" sets the folder with the outputs of generate_meshes.py
+    "--smpl-uv PATH/TO/FILE" sets the SMPL mesh with a UV map
+    "--output PATH/TO/FOLDER" sets the folder where the .glb files are saved
+    "--reference VARIANT" reuses the skinning weights of one morphology for all others (see reference_variant)
+    "--force" rigs all morphologies; otherwise, morphologies whose .glb file was built from the same inputs and settings are skipped (see rig_manifest.py)
+Use rig_morphologies.py to run many Blender instances in parallel.
+"""
+
+import bpy
+import bmesh
+import sys, getopt, json, os, itertools
+import numpy
 import mathutils
 import math
+# Blender does not add the folder of the script to the module search path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from rig_manifest import get_rig_inputs, hash_inputs, is_up_to_date, write_manifest
 
 
-def get_connector_bone_name(parent_name, bone_name):
-    return 'connector_from_' + parent_name + '_to_' + bone_name
+# SETTINGS
+# whether to create bones that connect bodies that are not automatically connected (e.g., femur_r and pelvis, where femur_r begins in a different place than pelvis ends)
+create_connecting_bones = True
+connecting_bones_can_deform = True
 
+# whether to create a Godot-compliant armature
+upwards_bones_only = True
 
+# deforming bones: bones that are allowed to deform the skin mesh
+# Gait2354
+#deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'calcn_r', 'calcn_l', 'pelvis', 'torso']
+# BSM
+#deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'calcn_r', 'calcn_l', 'pelvis', 'lumbar_body', 'thorax', 'head', 'scapula_r', 'scapula_l', 'humerus_r', 'humerus_l', 'radius_r', 'radius_l', 'hand_r', 'hand_l']
+# Hamner-Godosim
+deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'talus_r', 'talus_l', 'calcn_r', 'calcn_l', 'pelvis', 'torso', 'humerus_r', 'humerus_l', 'radius_r', 'radius_l', 'ulna_r', 'ulna_l', 'hand_r', 'hand_l']
 
+# the settings that are recorded in the manifest of each rigged morphology (see rig_manifest.py)
+def get_rig_settings():
+    return {'create_connecting_bones': create_connecting_bones, 'connecting_bones_can_deform': connecting_bones_can_deform, 'upwards_bones_only': upwards_bones_only, 'deforming_bones': deforming_bones}
 
 
-def run(skel_variant):
+def get_connector_bone_name(parent_name, bone_name):
+    return 'connector_from_' + parent_name + '_to_' + bone_name
 
-    # 1: LOAD DATA AND DEFINE SETTINGS
-    # whether to create bones that connect bodies that are not automatically connected (e.g., femur_r and pelvis, where femur_r begins in a different place than pelvis ends)
-    create_connecting_bones = True
-    connecting_bones_can_deform = True
+# the file where the skinning weights of a reference morphology are saved (see reference_variant)
+def get_weights_path(skel_variant):
+    return os.path.join(path_skel_outputs, 'skinning_weights_' + skel_variant + '.npz')
+
+# get the weights of all vertex groups of a mesh as (vertex, group, weight) arrays
+# the weights are read from the deform layer of a BMesh, which gives all weights of a vertex in one call, instead of one RNA lookup per weight through mesh.vertices[i].groups
+def get_vertex_group_weights(mesh):
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    layer = bm.verts.layers.deform.active
+    if layer is None:
+        bm.free()
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)
+    items = [v[layer].items() for v in bm.verts]
+    bm.free()
+    counts = numpy.fromiter(map(len, items), dtype=int, count=len(items))
+    pairs = numpy.array(list(itertools.chain.from_iterable(items)), dtype=float).reshape(-1, 2)
+    return numpy.repeat(numpy.arange(len(items)), counts), pairs[:,0].astype(int), pairs[:,1]
+
+# set the weights of vertex groups of a mesh from (vertex, group, weight) arrays, replacing the weights that the vertices already have in these groups
+# all weights are written into the deform layer of a BMesh, which is written to the mesh at once, instead of calling vertex_group.add for each weight
+def set_vertex_group_weights(mesh, vertex_indices, group_indices, weights):
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    layer = bm.verts.layers.deform.verify()
+    bm.verts.ensure_lookup_table()
+    verts = bm.verts
+    for v, g, w in zip(vertex_indices.tolist(), group_indices.tolist(), weights.tolist()):
+        verts[v][layer][g] = w
+    bm.to_mesh(mesh)
+    bm.free()
+
+# save skinning weights as (vertex, group, weight) triples together with the names of the groups and the number of vertices of the mesh
+def save_skinning_weights(path, n_verts, group_names, vertex_indices, group_indices, weights):
+    numpy.savez(path, n_verts=n_verts, group_names=numpy.array(group_names), vertex_indices=vertex_indices, group_indices=group_indices, weights=weights)
+
+# load skinning weights saved with save_skinning_weights; returns None if there are none or if they were saved for a mesh with a different number of vertices
+def load_skinning_weights(path, n_verts):
+    if not os.path.exists(path):
+        return None
+    skinning_weights = numpy.load(path)
+    if int(skinning_weights['n_verts']) != n_verts:
+        print('Skinning weights in ' + path + ' are for ' + str(int(skinning_weights['n_verts'])) + ' vertices instead of ' + str(n_verts) + ', so they are not used')
+        return None
+    return skinning_weights
+
+# get the UV coordinates of every face corner (loop) of the SMPL mesh as a flat array; they are read from the OBJ file once and cached in a binary file next to it, which is rebuilt if the OBJ file changes
+def get_smpl_uvs(smpl_file):
+    cache_file = os.path.splitext(smpl_file)[0] + '_loop_uvs.npy'
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(smpl_file):
+        return numpy.load(cache_file)
+    bpy.ops.wm.obj_import(filepath=smpl_file)
+    smpl_mesh = bpy.context.selected_objects[0]
+    uvs = numpy.zeros(2*len(smpl_mesh.data.loops), dtype=numpy.float32)
+    smpl_mesh.data.uv_layers.active.data.foreach_get('uv', uvs)
+    # delete the SMPL mesh as we no longer need it
+    bpy.data.meshes.remove(smpl_mesh.data)
+    # parallel Blender instances (see rig_morphologies.py) can build the cache at the same time, so each writes its own temporary file and replaces the cache in one step, which is never seen half-written
+    temp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_file, 'wb') as f:
+        numpy.save(f, uvs)
+    os.replace(temp_file, cache_file)
+    print('Cached the UVs of ' + smpl_file + ' to ' + cache_file)
+    return uvs
+
+# the file where the rig of a morphology is saved for posing it outside Blender with lbs.py
+def get_rig_path(skel_variant):
+    return os.path.join(path_glb_output, 'human_' + skel_variant + '_rig.npz')
+
+# save the rest pose of the skin mesh, the bones and the skinning weights as arrays that lbs.py can load without Blender
+# the default transforms of the OpenSim bodies (rotations from bone_rotations and translations from the heads in bone_endpoints) and the matrix that rotates the OpenSim frame to the Blender frame are saved too, so that the mesh can be posed with the transforms of the bodies in an OpenSim simulation
+def save_rig(path, skin_mesh, arm_obj, body_names, default_body_matrices, axis_matrix):
+    mesh = skin_mesh.data
+    n_verts = len(mesh.vertices)
+    co = numpy.zeros(3*n_verts, dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', co)
+    # vertices in the world frame, i.e., with the rotation of the mesh object applied
+    mat_world = numpy.array(skin_mesh.matrix_world)
+    rest_vertices = co.reshape(-1, 3) @ mat_world[:3,:3].T + mat_world[:3,3]
+    mesh.calc_loop_triangles()
+    faces = numpy.zeros(3*len(mesh.loop_triangles), dtype=numpy.int32)
+    mesh.loop_triangles.foreach_get('vertices', faces)
+
+    bones = arm_obj.data.bones
+    bone_names = [bone.name for bone in bones]
+    bone_indices = {name: i for i, name in enumerate(bone_names)}
+    bone_parents = [bone_indices[bone.parent.name] if bone.parent is not None else -1 for bone in bones]
+    rest_matrices = numpy.array([numpy.array(bone.matrix_local) for bone in bones])
+    # each bone follows the OpenSim body it is named after, e.g., "femur_r_segment" follows "femur_r"
+    bone_bodies = [body_names.index(name[:-len('_segment')] if name.endswith('_segment') else name) for name in bone_names]
+
+    # the weights of the vertex groups of bones as sparse (vertex, bone, weight) triples
+    group_bones = numpy.array([bone_indices.get(g.name, -1) for g in skin_mesh.vertex_groups], dtype=int)
+    vertex_indices, group_indices, weights = get_vertex_group_weights(mesh)
+    weight_bones = group_bones[group_indices]
+    is_bone = weight_bones >= 0
+
+    numpy.savez(path, rest_vertices=rest_vertices.astype(numpy.float32), faces=faces.reshape(-1, 3),
+                bone_names=numpy.array(bone_names), bone_parents=numpy.array(bone_parents, dtype=numpy.int32), rest_matrices=rest_matrices.astype(numpy.float32), bone_bodies=numpy.array(bone_bodies, dtype=numpy.int32),
+                weight_vertices=vertex_indices[is_bone].astype(numpy.int32), weight_bones=weight_bones[is_bone].astype(numpy.int32), weight_values=weights[is_bone].astype(numpy.float32),
+                body_names=numpy.array(body_names), default_body_matrices=default_body_matrices, axis_matrix=axis_matrix)
+
+# create the vertex groups of a mesh from loaded skinning weights, matching the vertices by index
+def assign_skinning_weights(mesh_obj, skinning_weights):
+    # the groups are numbered as they were saved, after the groups that the mesh already has
+    groups = numpy.array([mesh_obj.vertex_groups.new(name=str(group_name)).index for group_name in skinning_weights['group_names']], dtype=int)
+    set_vertex_group_weights(mesh_obj.data, skinning_weights['vertex_indices'], groups[skinning_weights['group_indices']], skinning_weights['weights'])
 
-    # whether to create a Godot-compliant armature
-    upwards_bones_only = True
 
-    # deforming bones: bones that are allowed to deform the skin mesh
-    # Gait2354
-    #deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'calcn_r', 'calcn_l', 'pelvis', 'torso']
-    # BSM
-    #deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'calcn_r', 'calcn_l', 'pelvis', 'lumbar_body', 'thorax', 'head', 'scapula_r', 'scapula_l', 'humerus_r', 'humerus_l', 'radius_r', 'radius_l', 'hand_r', 'hand_l']
-    # Hamner-Godosim
-    deforming_bones = ['femur_r', 'femur_l', 'tibia_r', 'tibia_l', 'talus_r', 'talus_l', 'calcn_r', 'calcn_l', 'pelvis', 'torso', 'humerus_r', 'humerus_l', 'radius_r', 'radius_l', 'ulna_r', 'ulna_l', 'hand_r', 'hand_l']
 
 
+
+def run(skel_variant):
+
+    # 1: LOAD DATA (the settings are defined at module level)
     # open the files for hierarchy and bone endpoints in the global coordinate frame
-    f = open(r'C:\Users\JohnDoe\Documents\Godosim-assets\matlab_outputs\hierarchy.json', 'r')
+    f = open(os.path.join(path_matlab_outputs, 'hierarchy.json'), 'r')
     # get the json object as a dict 
     hierarchy = json.load(f)
     f.close()
 
-    f = open(r'C:\Users\JohnDoe\Documents\Godosim-assets\matlab_outputs\bone_endpoints_' + skel_variant + '.json', 'r')
+    f = open(os.path.join(path_matlab_outputs, 'bone_endpoints_' + skel_variant + '.json'), 'r')
     # get the json object as a dict 
     bone_endpoints = json.load(f)
     f.close()
 
-    f = open(r'C:\Users\JohnDoe\Documents\Godosim-assets\matlab_outputs\bone_rotations_' + skel_variant + '.json', 'r')
+    f = open(os.path.join(path_matlab_outputs, 'bone_rotations_' + skel_variant + '.json'), 'r')
     # get the json object as a dict 
     bone_rotations = json.load(f)
     f.close()
 
-    f = open(r'C:\Users\JohnDoe\Documents\Godosim-assets\matlab_outputs\generalized_coordinates_' + skel_variant + '.json', 'r')
+    f = open(os.path.join(path_matlab_outputs, 'generalized_coordinates_' + skel_variant + '.json'), 'r')
     # get the json object as a dict 
     generalized_coordinates = json.load(f)
     f.close()
@@ -68,25 +200,22 @@ def run(skel_variant):
 
     # 2: CREATE ARMATURE
 
-    my_armature = bpy.ops.object.armature_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-
-    arm_obj = bpy.data.objects['Armature']
-    # must be in edit mode to add bones
+    # create the armature through the data API, which does not need the context of a 3D viewport unlike bpy.ops.object.armature_add, and does not create a default bone
+    arm_obj = bpy.data.objects.new('Armature', bpy.data.armatures.new('Armature'))
+    bpy.context.collection.objects.link(arm_obj)
+    # must be in edit mode to add bones; all bones are created in this single edit session
     bpy.context.view_layer.objects.active = arm_obj
     bpy.ops.object.mode_set(mode='EDIT', toggle=False)
     edit_bones = arm_obj.data.edit_bones
-
-    # remove Blender's default-constructed bones, if Blender created any
-    for bone in edit_bones:
-        arm_obj.data.edit_bones.remove(bone)
+    # keep the created bones by name so that they don't need to be looked up from edit_bones again
+    bones = dict()
 
 
     tail_offset = [0, 0.2, 0]
     #print('tail offset: ', tail_offset)
 
     # loop through bones to set their head and tail coordinates
-    for i in range(len(bone_names)):
-        bone_name = bone_names[i]
+    for bone_name in bone_names:
         
         # get the head and tail of the body
         body_head = bone_endpoints[bone_name]['head']
@@ -94,6 +223,7 @@ def run(skel_variant):
         
         # create the base upwards bone
         b = edit_bones.new(bone_name)
+        bones[bone_name] = b
         b.head = body_head
         # If bone isn't for Ground, we rotate Blender armature bones that are used in Godosim to apply transforms from the OpenSim model. This is done because the OpenSim model's default pose has the bodies in non-zero rotations, so we must apply the appropriate rotations in the Blender armature as well.
         if bone_name != 'ground':
@@ -112,13 +242,14 @@ def run(skel_variant):
         
         #rotated_tail = tail_offset
         b.tail = [body_head[0]+tail_final[0], body_head[1]+tail_final[1], body_head[2]+tail_final[2]]
-        arm_obj.data.edit_bones[bone_name].use_deform = False
-        arm_obj.data.edit_bones[bone_name].use_inherit_rotation = False
-        arm_obj.data.edit_bones[bone_name].roll = 0
+        b.use_deform = False
+        b.use_inherit_rotation = False
+        b.roll = 0
         
         # create the segment bone that is used for attachment to mesh
         segment_bone_name = bone_name + '_segment'
         b_segment = edit_bones.new(segment_bone_name)
+        bones[segment_bone_name] = b_segment
         b_segment.head = body_head
         # if bone has children, we assign its tail normally; if it doesn't have children (e.g., hand), its tail has been set manually to a nonsensical value in the text file, so we want to instead make it reach towards the opposite end of the segment for weight painting to be created accurately
         if bone_name in hierarchy.values():
@@ -126,20 +257,19 @@ def run(skel_variant):
         else:
             b_segment.tail = [body_head[0]-tail_final[0], body_head[1]-tail_final[1], body_head[2]-tail_final[2]]
         # parent the segment bone to the base bone so we can move the segment indirectly by moving the base bone
-        arm_obj.data.edit_bones[segment_bone_name].parent = arm_obj.data.edit_bones[bone_name]
-        arm_obj.data.edit_bones[segment_bone_name].use_inherit_rotation = True
+        b_segment.parent = b
+        b_segment.use_inherit_rotation = True
         
         print('Created bone', bone_name, 'at', b.head, b.tail)
         # if bone has been named in deforming bones, we set a property to allow it to deform the skin mesh
         if bone_name in deforming_bones:
-            arm_obj.data.edit_bones[segment_bone_name].use_deform = True
+            b_segment.use_deform = True
             print(bone_name, 'is allowed to deform')
         else:
-            arm_obj.data.edit_bones[segment_bone_name].use_deform = False
+            b_segment.use_deform = False
 
     # loop through bones to set their parent bones and connect them to their parents, and possibly to create connecting bones between them
-    for i in range(len(bone_names)):
-        bone_name = bone_names[i]
+    for bone_name in bone_names:
         # we skip ground because it has no parent in the OpenSim model
         if bone_name != 'ground':
             # get the head and tail coordinates in Blender coordinate system
@@ -150,36 +280,36 @@ def run(skel_variant):
             # if the parent bone ends where the child bone begins, we apply parent-child relationship normally
             if parent_tail == child_head:
                 print('tail and head match for', parent_name, 'and', bone_name)
-                arm_obj.data.edit_bones[bone_name].parent = arm_obj.data.edit_bones[parent_name + '_segment']
-                #arm_obj.data.edit_bones[bone_name].use_connect = True
+                bones[bone_name].parent = bones[parent_name + '_segment']
+                #bones[bone_name].use_connect = True
             # otherwise, if the tail of the parent is not located at the head of the child, we can create connecting bones between them
             elif create_connecting_bones:
                 print('tail and head mismatch between', parent_name, 'and', bone_name)
-                connector_bone_name = get_connector_bone_name(parent_name, bone_name)
-                b = edit_bones.new(connector_bone_name)
+                b = edit_bones.new(get_connector_bone_name(parent_name, bone_name))
                 b.head = parent_tail
                 b.tail = child_head
-                arm_obj.data.edit_bones[connector_bone_name].parent = arm_obj.data.edit_bones[parent_name + '_segment']
+                b.parent = bones[parent_name + '_segment']
                 # when use_connect is true, the bone's head is stuck to the parent's tail
-                arm_obj.data.edit_bones[connector_bone_name].use_connect = True
-                arm_obj.data.edit_bones[connector_bone_name].use_deform = connecting_bones_can_deform
-                arm_obj.data.edit_bones[bone_name].parent = arm_obj.data.edit_bones[connector_bone_name]
-                arm_obj.data.edit_bones[bone_name].use_connect = True
+                b.use_connect = True
+                b.use_deform = connecting_bones_can_deform
+                bones[bone_name].parent = b
+                bones[bone_name].use_connect = True
                 
             
     # we must rotate the armature such that OpenSim coordinate system is rotated to match that of Blender
     # first rotate such that the vertical axis is z instead of y
     mat_rot_x = mathutils.Matrix.Rotation(math.radians(90), 4, 'X')
-    arm_obj.data.transform(mat_rot_x)
     # then rotate 90 degrees clockwise along the vertical axis
     mat_rot_z = mathutils.Matrix.Rotation(math.radians(-90), 4, 'Z')
-    arm_obj.data.transform(mat_rot_z)
+    # both rotations are applied to all bones at once
+    arm_obj.data.transform(mat_rot_z @ mat_rot_x)
     # now the armature shows upright in Blender and we can do, e.g., x-axis mirroring when moving bones or symmetric weight painting
 
 
     #bpy.context.object.rotation_euler[0] = 1.5708
     #bpy.context.object.rotation_euler[2] = -1.5708
         
+    # exit edit mode to save bones so they can be used in pose mode; the edit bones in bones are no longer valid after this
     bpy.ops.object.mode_set(mode='OBJECT')
 
     arm_obj.show_in_front = True
@@ -189,19 +319,27 @@ def run(skel_variant):
     arm_obj.data.bones['ground'].hide = True
 
 
-    # exit edit mode to save bones so they can be used in pose mode
-    bpy.ops.object.mode_set(mode='OBJECT')
-
-
 
 
     # 3: IMPORT THE SKIN MESH AND ASSOCIATE IT WITH THE ARMATURE
 
     # 3.1: IMPORT AND TRANSLATE THE MESH TO MATCH WITH THE ARMATURE
 
-    # import the SKEL skin mesh
-    skel_file = 'C:/Users/JohnDoe/Documents/Godosim-assets/skel_outputs/skin_mesh_' + skel_variant + '.obj'
-    bpy.ops.wm.obj_import(filepath=skel_file)
+    # if generate_meshes.py saved a binary archive of the variant (--format archive), we build the skin mesh from its arrays; otherwise, we import the SKEL skin mesh from the OBJ file
+    archive_file = os.path.join(path_skel_outputs, 'mesh_' + skel_variant + '.npz')
+    if os.path.exists(archive_file):
+        archive = numpy.load(archive_file)
+        mesh = bpy.data.meshes.new('skin_mesh_' + skel_variant)
+        mesh.from_pydata(archive['skin_vertices'].tolist(), [], archive['skin_faces'].tolist())
+        mesh.update()
+        skin_mesh_obj = bpy.data.objects.new('skin_mesh_' + skel_variant, mesh)
+        # SKEL is y-up, so we rotate the object to Blender's z-up the same way as the OBJ importer does
+        skin_mesh_obj.rotation_euler[0] = math.radians(90)
+        bpy.context.collection.objects.link(skin_mesh_obj)
+    else:
+        archive = None
+        skel_file = os.path.join(path_skel_outputs, 'skin_mesh_' + skel_variant + '.obj')
+        bpy.ops.wm.obj_import(filepath=skel_file)
 
     # set the scale of the mesh so that the OpenSim model and the mesh are of equal height
     skin_mesh = bpy.data.objects['skin_mesh_' + skel_variant]
@@ -212,16 +350,20 @@ def run(skel_variant):
     # read pelvis location from SKEL output file
     #pelvis_skel = [0.0025912, -0.20103,  0.099523]
 
-    bone_names_file = open('C:/Users/JohnDoe/Documents/Godosim-assets/skel_outputs/bone_names.txt', 'r')
-    bnames = bone_names_file.readlines()
-    bone_names_file.close()
+    if archive is not None:
+        bnames = archive['bone_names'].tolist()
+        pelvis_translation = archive['joints'][0].tolist()
+    else:
+        bone_names_file = open(os.path.join(path_skel_outputs, 'bone_names.txt'), 'r')
+        bnames = bone_names_file.readlines()
+        bone_names_file.close()
 
-    joint_translations_file = open('C:/Users/JohnDoe/Documents/Godosim-assets/skel_outputs/joint_translations_' + skel_variant + '.txt', 'r')
-    lines = joint_translations_file.readlines()
-    joint_translations_file.close()
+        joint_translations_file = open(os.path.join(path_skel_outputs, 'joint_translations_' + skel_variant + '.txt'), 'r')
+        lines = joint_translations_file.readlines()
+        joint_translations_file.close()
 
-    print(lines[0])
-    pelvis_translation = lines[0].split(',')
+        print(lines[0])
+        pelvis_translation = lines[0].split(',')
     print(pelvis_translation)
 
     pelvis_skel = []
@@ -248,6 +390,11 @@ def run(skel_variant):
 
     # 3.2: USE AUTOMATIC SKINNING TO GENERATE THE VERTEX GROUPS AND WEIGHTS
 
+    # all SKEL skin meshes share the same vertices, so other morphologies than the reference reuse the weights of the reference morphology by vertex index if they have been saved
+    reference_weights = None
+    if reference_variant is not None and skel_variant != reference_variant:
+        reference_weights = load_skinning_weights(get_weights_path(reference_variant), len(skin_mesh.data.vertices))
+
     # parent the mesh to the armature with automatic weights
     bpy.ops.object.select_all(action='DESELECT')
     # first select mesh, then armature
@@ -255,7 +402,13 @@ def run(skel_variant):
     arm_obj.select_set(True)
     # make sure armature is the active object
     bpy.context.view_layer.objects.active = arm_obj
-    bpy.ops.object.parent_set(type='ARMATURE_AUTO')
+    if reference_weights is None:
+        bpy.ops.object.parent_set(type='ARMATURE_AUTO')
+    else:
+        # parent without weights and assign the weights of the reference instead, which have already been tuned in 3.3
+        bpy.ops.object.parent_set(type='ARMATURE')
+        assign_skinning_weights(skin_mesh, reference_weights)
+        print('Assigned the skinning weights of ' + reference_variant + ' to ' + skel_variant)
     bpy.ops.object.select_all(action='DESELECT') 
 
 
@@ -264,47 +417,52 @@ def run(skel_variant):
 
     # modify deformation weights in the vertex groups to make deformations more realistic
 
-    vertex_group_targets = dict()
-    vertex_group_name_to_idx = dict()
-    # create a mapping from vertex group names (e.g., "femur_l_segment") to its index in the vertex groups list
-    for g in skin_mesh.vertex_groups:
-        vertex_group_name_to_idx[g.name] = g.index
-    # create a mapping from a vertex group of a connector bone (e.g., "connector_from_torso_to_humerus_r") to its "parent" bone by index
-    for g in skin_mesh.vertex_groups:
-        if g.name.startswith("connector_"):
-            origin_group = g.name[15:]
-            idx = origin_group.find('_to_')
-            origin_group = origin_group[:idx]
-            origin_group += '_segment'
-            vertex_group_targets[g.index] = vertex_group_name_to_idx[origin_group]
-               
-    # modify vertex groups in a new bmesh instance and assign the results to the original mesh
-    bm = bmesh.new()
-    bm.from_mesh(skin_mesh.data)
-
-    # only ever one deform weight layer
-    dvert_layer = bm.verts.layers.deform.active
-
-    # loop through all vertices and modify their vertex group weights
-    for vert in bm.verts:
-        dvert = vert[dvert_layer]
-        for k in vertex_group_targets.keys():
-            if k in dvert:
-                target_group = vertex_group_targets[k]
-                # if the vertex has the target vertex group, we simply add to its value; otherwise we add that vertex group to the vertex
-                if vertex_group_targets[k] in dvert:
-                    dvert[target_group] += dvert[k]
-                    # finally, we zero the weight in the connector bone's vertex group                
-                else:
-                    dvert[target_group] = dvert[k]
-                # finally, we zero the weight in the connector bone's vertex group
-                dvert[k] = 0
-
-                
-
-    # Finish up, write the bmesh back to the mesh
-    bm.to_mesh(skin_mesh.data)
-    bm.free()  # free and prevent further access
+    # weights assigned from the reference morphology have already been tuned
+    if reference_weights is None:
+        vertex_group_name_to_idx = dict()
+        # create a mapping from vertex group names (e.g., "femur_l_segment") to its index in the vertex groups list
+        for g in skin_mesh.vertex_groups:
+            vertex_group_name_to_idx[g.name] = g.index
+        # pair each vertex group of a connector bone (e.g., "connector_from_torso_to_humerus_r") with the group of its "parent" bone by index
+        connector_groups = []
+        target_groups = []
+        for g in skin_mesh.vertex_groups:
+            if g.name.startswith("connector_"):
+                origin_group = g.name[15:]
+                idx = origin_group.find('_to_')
+                origin_group = origin_group[:idx]
+                origin_group += '_segment'
+                connector_groups.append(g.index)
+                target_groups.append(vertex_group_name_to_idx[origin_group])
+        connector_groups = numpy.array(connector_groups, dtype=int)
+        target_groups = numpy.array(target_groups, dtype=int)
+
+        # gather the (vertex, group, weight) triples of all vertices in a single pass into a dense (n_verts, n_groups) weight matrix, and record which vertices belong to which groups
+        n_verts = len(skin_mesh.data.vertices)
+        n_groups = len(skin_mesh.vertex_groups)
+        vertex_indices, group_indices, vertex_weights = get_vertex_group_weights(skin_mesh.data)
+        weights = numpy.zeros((n_verts, n_groups))
+        weights[vertex_indices, group_indices] = vertex_weights
+        membership = numpy.zeros((n_verts, n_groups), dtype=bool)
+        membership[vertex_indices, group_indices] = True
+
+        # add the weights of each connector bone's vertex group to the group of its parent bone; add.at accumulates when several connectors start from the same bone
+        numpy.add.at(weights, (slice(None), target_groups), weights[:, connector_groups])
+        numpy.logical_or.at(membership, (slice(None), target_groups), membership[:, connector_groups])
+
+        # write back only the weights that changed, i.e., those of the members of the connector groups in the groups of their parent bones, in a single pass
+        changed = numpy.zeros((n_verts, n_groups), dtype=bool)
+        numpy.logical_or.at(changed, (slice(None), target_groups), membership[:, connector_groups])
+        rows, columns = numpy.nonzero(changed)
+        set_vertex_group_weights(skin_mesh.data, rows, columns, weights[rows, columns])
+
+        # save the tuned weights of the reference morphology without the groups of connector bones so that other morphologies can reuse them
+        if skel_variant == reference_variant:
+            kept_groups = numpy.setdiff1d(numpy.arange(n_groups), connector_groups)
+            group_names = [skin_mesh.vertex_groups[int(i)].name for i in kept_groups]
+            rows, columns = numpy.nonzero(membership[:, kept_groups])
+            save_skinning_weights(get_weights_path(skel_variant), n_verts, group_names, rows, columns, weights[:, kept_groups][rows, columns].astype(numpy.float32))
+            print('Saved the skinning weights of ' + skel_variant + ' to ' + get_weights_path(skel_variant))
 
     # once we've refined the vertex deformation weights, we can and should remove the vertex groups of connector bones
     for g in skin_mesh.vertex_groups:
@@ -362,20 +520,13 @@ def run(skel_variant):
 
     # TRANSFER UV MAPS FROM SMPL TO SKEL
 
-    # import the SMPL mesh with a UV map
-    smpl_file = 'C:/Users/JohnDoe/Documents/Godosim-assets/smpl-uv/smpl_uv.obj'
-    bpy.ops.wm.obj_import(filepath=smpl_file)
-    smpl_mesh = bpy.data.objects['smpl_uv']
-    # transfer the UV map to skin mesh
-    bpy.ops.object.select_all(action='DESELECT')
-    skin_mesh.select_set(True)
-    smpl_mesh.select_set(True)
-    bpy.context.view_layer.objects.active = smpl_mesh
-    bpy.ops.object.join_uvs()
-    bpy.ops.object.select_all(action='DESELECT') 
-    # delete the SMPL mesh as we no longer need it
-    smpl_mesh.select_set(True)
-    bpy.ops.object.delete(use_global=False, confirm=False)
+    # get the UV map of the SMPL mesh, which has the same faces as the skin mesh
+    smpl_uvs = get_smpl_uvs(path_smpl_uv)
+    if len(smpl_uvs) != 2*len(skin_mesh.data.loops):
+        raise ValueError('The UV map in ' + path_smpl_uv + ' has ' + str(len(smpl_uvs)//2) + ' face corners but skin_mesh_' + skel_variant + ' has ' + str(len(skin_mesh.data.loops)))
+    # copy the UV map to the skin mesh corner by corner, like join_uvs would
+    uv_layer = skin_mesh.data.uv_layers.new(name='UVMap')
+    uv_layer.data.foreach_set('uv', smpl_uvs)
 
     bpy.ops.object.select_all(action='DESELECT') 
 
@@ -390,8 +541,16 @@ def run(skel_variant):
     # 5: SAVE OUTPUT MODELS
 
     # save file
-    glb_out_file = 'C:/Users/JohnDoe/Documents/Godosim-importables/SMPL_Hamner/human_' + skel_variant + '.glb'
+    glb_out_file = os.path.join(path_glb_output, 'human_' + skel_variant + '.glb')
     bpy.ops.export_scene.gltf(filepath=glb_out_file, export_materials='PLACEHOLDER')
+
+    # save the rig for posing the mesh outside Blender; the default transform of each body is its rotation and the head of its bone in the OpenSim frame
+    default_body_matrices = numpy.tile(numpy.eye(4), (len(bone_names), 1, 1))
+    for i, bone_name in enumerate(bone_names):
+        if bone_name in bone_rotations:
+            default_body_matrices[i,:3,:3] = numpy.reshape(bone_rotations[bone_name], (3, 3))
+        default_body_matrices[i,:3,3] = bone_endpoints[bone_name]['head']
+    save_rig(get_rig_path(skel_variant), skin_mesh, arm_obj, bone_names, default_body_matrices, numpy.array(mat_rot_z @ mat_rot_x))
     
     
 
@@ -403,8 +562,64 @@ def clear_data():
     bpy.ops.outliner.orphans_purge()
 
 
+# globals, which can be set with arguments after "--" on the Blender command line
+path_matlab_outputs = 'C:/Users/JohnDoe/Documents/Godosim-assets/matlab_outputs'
+path_skel_outputs = 'C:/Users/JohnDoe/Documents/Godosim-assets/skel_outputs'
+path_smpl_uv = 'C:/Users/JohnDoe/Documents/Godosim-assets/smpl-uv/smpl_uv.obj'
+path_glb_output = 'C:/Users/JohnDoe/Documents/Godosim-importables/SMPL_Hamner'
+
+# to rig many morphologies quickly, set reference_variant to one of them (e.g., 'female_zero'): it is rigged first with automatic skinning, its tuned weights are saved, and all other morphologies reuse them by vertex index, so they only need their own armature
+# None rigs every morphology with automatic skinning
+reference_variant = None
+
 body_morphologies = ['female_zero', 'female_plus1', 'female_plus2', 'female_minus1', 'female_minus2', 'male_zero', 'male_plus1', 'male_plus2', 'male_minus1', 'male_minus2']
-for body in body_morphologies:
-    clear_data()
-    run(body)
-    
\ No newline at end of file
+# whether to rig morphologies even if their inputs have not changed
+force = False
+
+# parse the arguments after "--", which Blender leaves to the script, and set globals accordingly
+def parse_arguments():
+    global path_matlab_outputs, path_skel_outputs, path_smpl_uv, path_glb_output, reference_variant, body_morphologies, force
+
+    argument_list = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    opts_short = ""
+    opts_long = ["variants=", "matlab-outputs=", "skel-outputs=", "smpl-uv=", "output=", "reference=", "force"]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg == "--variants":
+                body_morphologies = current_val.split(',')
+            elif current_arg == "--matlab-outputs":
+                path_matlab_outputs = current_val
+            elif current_arg == "--skel-outputs":
+                path_skel_outputs = current_val
+            elif current_arg == "--smpl-uv":
+                path_smpl_uv = current_val
+            elif current_arg == "--output":
+                path_glb_output = current_val
+            elif current_arg == "--reference":
+                reference_variant = current_val
+            elif current_arg == "--force":
+                force = True
+
+    except getopt.error as err:
+        print(str(err))
+
+if __name__ == '__main__':
+    parse_arguments()
+    # the reference morphology is rigged first if it is one of the morphologies to rig or if its weights have not been saved yet
+    if reference_variant is not None and (reference_variant in body_morphologies or not os.path.exists(get_weights_path(reference_variant))):
+        body_morphologies = [reference_variant] + [body for body in body_morphologies if body != reference_variant]
+    for body in body_morphologies:
+        glb_out_file = os.path.join(path_glb_output, 'human_' + body + '.glb')
+        hashes = hash_inputs(get_rig_inputs(body, path_matlab_outputs, path_skel_outputs, path_smpl_uv, reference_variant))
+        # the morphology is also rigged again if its rig for lbs.py or, for the reference, its saved weights are missing
+        outputs_missing = not os.path.exists(get_rig_path(body)) or (body == reference_variant and not os.path.exists(get_weights_path(body)))
+        if not force and not outputs_missing and is_up_to_date(glb_out_file, hashes, get_rig_settings()):
+            print('Skipping ' + body + ', whose inputs have not changed')
+            continue
+        clear_data()
+        run(body)
+        write_manifest(glb_out_file, body, hashes, get_rig_settings())
@@ -0,0 +1,37 @@
+"""
+This Python module provides the drawing helpers that annotation_viewer.py and render_overlays.py share, so that the interactive viewer and the headless renderer draw the annotations the same way.
+It only uses matplotlib artists and does not import pyplot, so it can be imported without a display, e.g., in worker processes.
+Basic usage:
+    collection = add_keypoint_collection(ax, 'joints') # persistent circles of a keypoint group, colored by GROUP_COLORS
+    update_keypoint_collection(collection, store.keypoints['joints'][idx], radius=10) # move them to the keypoints of an image
+"""
+
+import numpy as np
+from matplotlib.collections import EllipseCollection
+
+# colors of the keypoint groups and of the bounding box
+GROUP_COLORS = {'joints': 'b', 'bodies': 'g', 'markers': 'r'}
+BOX_COLOR = 'k'
+
+
+# calculate the radii of keypoint symbols such that they are greater when the keypoint is close and smaller when it's far from the camera
+def get_keypoint_radii(zs, radius):
+    # calculate the closest and furthest depth of keypoints for scaling the depth to [0,1]
+    z_min = zs.min()
+    z_max = zs.max()
+    # scale depth to [0,1] such that 0 indicates closest depth and 1 indicates furthest depth; if all keypoints are at the same depth, they are all drawn as closest
+    z_scaled = (zs-z_min)/(z_max-z_min) if z_max > z_min else np.zeros_like(zs)
+    # calculate radius that is scaled according to the keypoint's distance to the camera (depth)
+    return 0.5*radius + (1.0-z_scaled)*radius
+
+# add an empty collection of keypoint circles of a group to an axes; circle diameters are given in data units so that they scale with the image like Circle patches
+def add_keypoint_collection(ax, group, **kwargs):
+    return ax.add_collection(EllipseCollection(widths=[], heights=[], angles=[], units='xy', offsets=np.empty((0, 2)), offset_transform=ax.transData, facecolors='none', edgecolors=GROUP_COLORS[group], linestyles='--', linewidths=2, **kwargs))
+
+# move the circles of a keypoint collection to the keypoints of the current image and scale them by depth
+def update_keypoint_collection(collection, keypoints, radius):
+    diameters = 2*get_keypoint_radii(keypoints[:,2], radius) if len(keypoints) > 0 else []
+    collection.set_offsets(keypoints[:,:2])
+    collection.set_widths(diameters)
+    collection.set_heights(diameters)
+    collection.set_angles(np.zeros(len(keypoints)))
@@ -5,87 +5,100 @@ The root folder should contain the folders "annotations" and "images", as genera
 To enable visualization of annotations, add flags like "--bodies", "--joints", "--markers" (or "-b", "-j", "-m") to show origins of bodies of the musculoskeletal model, positions of joints of the musculoskeletal model, and positions of virtual markers of the musculoskeletal model.
 The size of the visualized marker represents its depth (larger circles are closer to the viewer).
 Use z and x keys to browse images.
+Images around the current image are decoded in the background; use "--prefetch N" to set how many images are decoded ahead of and behind the current image (0 disables prefetching) and "--cache-mb MB" to limit the memory used by decoded images.
+Add the flag "--blit" to create the image and annotation artists once and update them in place with blitting, which keeps redrawing fast even when all annotations are shown.
+Add the flag "--follow" (or "-f") to watch a dataset while Godosim is still generating it: rows appended to the annotations are parsed incrementally, and the viewer advances to the newest image once its file exists, unless you have browsed away from the newest image.
+The annotations are cached in binary format in "annotations/annotations_cache" when they are first read, which makes later launches faster.
+Add "--issues PATH/TO/annotation_issues.csv", as saved by validate_annotations.py, to browse only the rows that failed a check; the failed checks are shown in the title.
+To view a dataset that has been packed with pack_shards.py, use "--shards PATH/TO/SHARDS" instead of "--path"; follow mode needs the folders.
 """
 
 import sys, getopt, os
 from pathlib import Path
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle, Rectangle
 from pandas import read_csv
+import time
+from keypoint_store import load_keypoint_store, CsvTail
+from image_loading import ImagePrefetcher
+from shards import ShardReader
+from annotation_plotting import GROUP_COLORS, BOX_COLOR, get_keypoint_radii, add_keypoint_collection, update_keypoint_collection
+
+# get the path of the RGB image at an index
+def get_image_path(i):
+    return Path(path_root) / 'images/' / (store.file_names[i] + '.jpg')
+
+# decode the RGB image at an index from its file or from the shards
+def load_image(idx):
+    if shards is not None:
+        return shards.load_image(idx)
+    return plt.imread(get_image_path(idx))
+
+# get the decoded RGB image at an index
+def get_image(idx):
+    if prefetcher is None:
+        return load_image(idx)
+    return prefetcher.get(idx, direction)
 
 # plot the RGB image
-def plot_image(path):
-    img = plt.imread(path)
-    plt.gca().imshow(img)
+def plot_image(idx):
+    plt.gca().imshow(get_image(idx))
 
 # plot 2D keypoints such as the positions of body origins, joints, or virtual markers, and include depth information by making the annotation symbol greater when it's close and smaller when it's far from the camera
-def plot_keypoints(idx, annotations, pattern, color, radius):
-    cols = annotations.filter(like=pattern)
-    
-    xs = []
-    ys = []
-    zs = []
-
-    # iterate through column names in the CSV file
-    for col in cols:
-        if col.endswith('_x'):
-           xs.append(annotations[col][idx]) 
-        elif col.endswith('_y'):
-           ys.append(annotations[col][idx])
-        elif col.endswith('_z'):
-           zs.append(annotations[col][idx])
-
-    # calculate the closest and furthest depth of keypoints for scaling the depth to [0,1] in the loop that follows
-    z_min = min(zs)
-    z_max = max(zs)
-    
-    for x,y,z in zip(xs,ys,zs):
-        # scale depth to [0,1] such that 0 indicates closest depth and 1 indicates furthest depth
-        z_scaled = (z-z_min)/(z_max-z_min)
-        # calculate radius that is scaled according to the keypoint's distance to the camera (depth)
-        radius_scaled = 0.5*radius + (1.0-z_scaled)*radius
+def plot_keypoints(idx, store, group, color, radius):
+    # (n_keypoints, 3) slice of the keypoints of the group in the current image
+    keypoints = store.keypoints[group][idx]
+    if len(keypoints) == 0:
+        return
+    xs = keypoints[:,0]
+    ys = keypoints[:,1]
+    radii_scaled = get_keypoint_radii(keypoints[:,2], radius)
+
+    for x,y,radius_scaled in zip(xs,ys,radii_scaled):
         circ = Circle((x,y), radius=radius_scaled, facecolor='none', edgecolor=color, linestyle='--', linewidth=2)
         plt.gca().add_patch(circ)
 
 # plot bounding box around the person
-def plot_box(idx, annotations, color):
-    cols = annotations.filter(like='bb_')
-    
-    xs = []
-    ys = []
-    ws = []
-    hs = []
-    
-    for col in cols:
-        if col.endswith('_x'):
-           xs.append(annotations[col][idx]) 
-        elif col.endswith('_y'):
-           ys.append(annotations[col][idx])
-        elif col.endswith('_w'):
-           ws.append(annotations[col][idx])
-        elif col.endswith('_h'):
-           hs.append(annotations[col][idx])
-   
-    for x,y,w,h in zip(xs,ys,ws,hs):
-        box = Rectangle(xy=(x,y), width=w, height=h, facecolor='none', edgecolor=color, linestyle='-', linewidth=2)
-        plt.gca().add_patch(box)
-
-def read_csv_table(path):
-    print('Reading ', path)
-    return read_csv(path)
+def plot_box(idx, store, color):
+    x,y,w,h = store.boxes[idx]
+    box = Rectangle(xy=(x,y), width=w, height=h, facecolor='none', edgecolor=color, linestyle='-', linewidth=2)
+    plt.gca().add_patch(box)
+
+
+# get the next index in a direction, which is the next flagged row if only rows with issues are browsed, staying in range of existing data
+def step_index(i, step):
+    if issue_rows is None:
+        return min(max(i + step, 0), len(store)-1)
+    # the flagged rows are sorted, so the next one is found by bisection
+    position = np.searchsorted(issue_rows, i, side='right' if step > 0 else 'left') + (0 if step > 0 else -1)
+    return int(issue_rows[min(max(position, 0), len(issue_rows)-1)])
+
+# get the title of an image, with the checks that its row failed if rows with issues are browsed
+def get_title(i):
+    file_name = str(store.file_names[i])
+    issues = issue_names.get(i)
+    return file_name if not issues else file_name + ' (' + ', '.join(issues) + ')'
 
+# read the rows that failed checks and the names of the checks that each failed from an issue table saved by validate_annotations.py
+def read_issues(path):
+    issues = read_csv(path)
+    checks = [column for column in issues.columns if column not in ('row', 'file_names')]
+    counts = issues[checks].to_numpy()
+    rows = issues['row'].to_numpy(dtype=np.int64)
+    names = {int(row): [check for check, count in zip(checks, row_counts) if count > 0] for row, row_counts in zip(rows, counts)}
+    return np.sort(rows), names
 
 # switch images by pressing z and x
 def on_press(event):
     # we have to declare write access to variable 'idx' to increment and decrement it
-    global idx
+    global idx, direction
     if event.key == 'x':
-        idx += 1
+        idx = step_index(idx, 1)
+        direction = 1
     elif event.key == 'z':
-        idx -= 1
-    # shorthand if statement to keep idx in range of existing data
-    idx = 0 if idx < 0 else idx
-    idx = len(annotations.index)-1 if idx == len(annotations.index) else idx
+        idx = step_index(idx, -1)
+        direction = -1
     # calls the function to redraw the image and overlaid annotations with the new idx
     redraw()
 
@@ -93,43 +106,164 @@ def on_press(event):
 def prepare_figure():
     fig,ax = plt.subplots(1)
     fig.canvas.mpl_connect('key_press_event', on_press)
+    if use_blit:
+        prepare_artists(fig, ax)
     # call redraw to show the first image
     redraw()
     return fig,ax
-    
+
+# create the persistent artists of the blitting redraw path; they are animated so that they are left out of the cached background and drawn on top of it
+def prepare_artists(fig, ax):
+    global artists
+    artists = {}
+    artists['image'] = ax.imshow(np.zeros((1, 1, 3)), animated=True)
+    artists['title'] = ax.text(0.5, 1.01, '', transform=ax.transAxes, ha='center', va='bottom', fontsize='large', animated=True)
+    # one collection per keypoint group
+    for group, enabled in [('joints', display_joints), ('bodies', display_bodies), ('markers', display_markers)]:
+        if enabled:
+            artists[group] = add_keypoint_collection(ax, group, animated=True)
+    artists['box'] = ax.add_patch(Rectangle(xy=(0,0), width=0, height=0, facecolor='none', edgecolor=BOX_COLOR, linestyle='-', linewidth=2, animated=True))
+    fig.canvas.mpl_connect('draw_event', on_draw)
+
+# cache the background whenever the whole figure is drawn (e.g., after resizing the window), then draw the animated artists on top of it
+def on_draw(event):
+    global background
+    canvas = event.canvas
+    background = canvas.copy_from_bbox(canvas.figure.bbox)
+    draw_artists(canvas.figure)
+
+def draw_artists(fig):
+    for artist in artists.values():
+        fig.draw_artist(artist)
+
+# update the data of the persistent artists in place and blit them on top of the cached background
+def blit_redraw():
+    ax = artists['image'].axes
+    fig = ax.figure
+    artists['title'].set_text(get_title(idx))
+    img = get_image(idx)
+    image_artist = artists['image']
+    image_artist.set_data(img)
+    # the axes only need to be drawn again if the image size has changed
+    extent = (-0.5, img.shape[1]-0.5, img.shape[0]-0.5, -0.5)
+    resized = tuple(image_artist.get_extent()) != extent
+    if resized:
+        image_artist.set_extent(extent)
+        ax.set_xlim(-0.5, img.shape[1]-0.5)
+        ax.set_ylim(img.shape[0]-0.5, -0.5)
+    for group in ('joints', 'bodies', 'markers'):
+        if group in artists:
+            update_keypoint_collection(artists[group], store.keypoints[group][idx], radius=10)
+    x,y,w,h = store.boxes[idx]
+    artists['box'].set_bounds(x, y, w, h)
+
+    if resized or background is None:
+        # a full draw caches a new background and draws the artists through on_draw
+        fig.canvas.draw()
+    else:
+        fig.canvas.restore_region(background)
+        draw_artists(fig)
+        fig.canvas.blit(fig.bbox)
+    fig.canvas.flush_events()
+
 def redraw():
+    if use_blit:
+        blit_redraw()
+        return
     # remove previous drawings
     plt.gca().clear()
     # get the name of the RGB image file and set it as the figure title
-    file_name = annotations['file_names'][idx]
-    plt.title(file_name)
+    plt.title(get_title(idx))
     # plot RBG image and overlaid annotations
-    plot_image(Path(path_root) / 'images/' / (file_name + '.jpg'))
+    plot_image(idx)
     if display_joints:
-        plot_keypoints(idx, annotations, pattern='jp_', color='b', radius=10)
+        plot_keypoints(idx, store, group='joints', color=GROUP_COLORS['joints'], radius=10)
     if display_bodies:
-        plot_keypoints(idx, annotations, pattern='bp_', color='g', radius=10)
+        plot_keypoints(idx, store, group='bodies', color=GROUP_COLORS['bodies'], radius=10)
     if display_markers:
-        plot_keypoints(idx, annotations, pattern='vm_', color='r', radius=10)
-    plot_box(idx, annotations, color='k')
+        plot_keypoints(idx, store, group='markers', color=GROUP_COLORS['markers'], radius=10)
+    plot_box(idx, store, color=BOX_COLOR)
+
+# parse the rows that have been appended to the annotations since the previous call; returns True if there were new rows
+def read_appended_rows():
+    global store
+    appended = False
+    part = tail.read_new_rows()
+    while part is not None:
+        if store is None:
+            store = part
+        else:
+            store.append(part)
+        appended = True
+        part = tail.read_new_rows()
+    if appended and prefetcher is not None:
+        prefetcher.n_images = len(store)
+    return appended
+
+# find the newest row whose image has been written, looking back from the last row until the row at stop
+def find_newest_image(stop=-1):
+    for i in range(len(store)-1, stop, -1):
+        if get_image_path(i).exists():
+            return i
+    return None
+
+# called periodically in follow mode to read new rows and advance to the newest image
+def poll_annotations():
+    global idx, newest_shown
+    read_appended_rows()
+    # only advance if the user is still viewing the newest image that has been shown
+    if idx != newest_shown:
+        return
+    newest = find_newest_image(stop=newest_shown)
+    if newest is None:
+        return
+    try:
+        # the image may exist but still be being written, in which case we try again on the next call
+        get_image(newest)
+    except (OSError, SyntaxError, ValueError):
+        return
+    idx = newest
+    newest_shown = newest
+    redraw()
 
 # globals
 idx = 0
+# direction of browsing, which the prefetcher uses to decide which images to decode first
+direction = 1
 path_root = None
-annotations = None
+path_shards = None
+path_issues = None
+# the sorted rows that failed checks of validate_annotations.py and the names of the failed checks of each row, if only they are browsed
+issue_rows = None
+issue_names = {}
+store = None
+shards = None
+prefetcher = None
+n_prefetch = 4
+cache_mb = 512
 display_bodies = False
 display_joints = False
 display_markers = False
+# whether to use the persistent-artist, blitting redraw path and its artists and cached background
+use_blit = False
+artists = None
+background = None
+# follow mode: the tail of the annotations file, the index of the newest image that has been shown, how often the annotations are polled, and the timer that polls them
+follow = False
+tail = None
+newest_shown = 0
+follow_interval_ms = 1000
+follow_timer = None
 
 # parse cmd line args and set globals accordingly
 def parse_arguments():
-    global path_root, display_bodies, display_joints, display_markers
+    global path_root, path_shards, path_issues, display_bodies, display_joints, display_markers, n_prefetch, cache_mb, use_blit, follow
     n = len(sys.argv)
     
     argument_list = sys.argv[1:]
-    # b for bodies, j for joints, m for markers, p for path
-    opts_short = "bjmp:"
-    opts_long = ["bodies", "joints", "markers", "path="]
+    # b for bodies, j for joints, m for markers, p for path, f for follow
+    opts_short = "bjmp:f"
+    opts_long = ["bodies", "joints", "markers", "path=", "shards=", "issues=", "prefetch=", "cache-mb=", "blit", "follow"]
     
     try:
         # parse arguments and values
@@ -145,24 +279,82 @@ def parse_arguments():
             elif current_arg in ("-p", "--path"):
                 path_root = current_val
                 print(path_root)
+            elif current_arg == "--shards":
+                path_shards = current_val
+            elif current_arg == "--issues":
+                path_issues = current_val
+            elif current_arg == "--prefetch":
+                n_prefetch = int(current_val)
+            elif current_arg == "--cache-mb":
+                cache_mb = float(current_val)
+            elif current_arg == "--blit":
+                use_blit = True
+            elif current_arg in ("-f", "--follow"):
+                follow = True
                 
     except getopt.error as err:
         print(str(err))
 
 def main():
-    global annotations
+    global store, shards, prefetcher, tail, idx, newest_shown, follow_timer, issue_rows, issue_names
     
     parse_arguments()
     
-    if path_root is None:
-        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+    if path_root is None and path_shards is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder or the folder of packed shards with --shards path/to/folder')
         return
+    if follow and (path_shards is not None or path_issues is not None):
+        print('Follow mode needs the folder with the images and annotations folder, given with --path path/to/folder, and cannot be used with --shards or --issues')
+        return
+    
+    path_csv = Path(path_root) / 'annotations/annotations.csv' if path_root is not None else None
+    if path_shards is not None:
+        # the shards hold the annotations as a memory-mapped store and the images of all rows
+        print('Reading shards ', path_shards)
+        shards = ShardReader(path_shards)
+        store = shards.store
+    elif follow:
+        # the file is still growing, so it is parsed incrementally instead of being cached; wait until the first image has been written
+        tail = CsvTail(path_csv)
+        print('Following ', path_csv)
+        while True:
+            read_appended_rows()
+            newest = find_newest_image() if store is not None else None
+            if newest is not None:
+                break
+            time.sleep(follow_interval_ms/1000)
+        idx = newest
+        newest_shown = newest
+    else:
+        # parse the annotations once into arrays (or memory-map them from the cache) so that redrawing only needs to slice them
+        store = load_keypoint_store(path_csv)
     
-    annotations = read_csv_table(Path(path_root) / 'annotations/annotations.csv')
+    if path_issues is not None:
+        issue_rows, issue_names = read_issues(path_issues)
+        issue_rows = issue_rows[issue_rows < len(store)]
+        if len(issue_rows) == 0:
+            print('No rows with issues in', path_issues)
+            return
+        print('Browsing', len(issue_rows), 'rows with issues')
+        idx = int(issue_rows[0])
+    
+    # decode images in background threads so that browsing does not wait for decoding
+    if n_prefetch > 0:
+        if shards is not None:
+            prefetcher = ImagePrefetcher(lambda idx: idx, len(store), n_ahead=n_prefetch, max_bytes=int(cache_mb*2**20), load=shards.load_image)
+        else:
+            prefetcher = ImagePrefetcher(get_image_path, len(store), n_ahead=n_prefetch, max_bytes=int(cache_mb*2**20))
     
     plt.ion()
     fig,ax = prepare_figure()
+    if follow:
+        follow_timer = fig.canvas.new_timer(interval=follow_interval_ms)
+        follow_timer.add_callback(poll_annotations)
+        follow_timer.start()
     plt.show(block=True)
+    
+    if prefetcher is not None:
+        prefetcher.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
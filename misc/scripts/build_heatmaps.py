@@ -0,0 +1,216 @@
+"""
+This Python script precomputes the Gaussian heatmaps of the keypoints in the annotations generated by Godosim, which pose estimation networks are trained to predict, so that training reads them from disk instead of computing them for every image in every epoch.
+Basic usage: "python build_heatmaps.py --path PATH/TO/ROOT/FOLDER"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim.
+Options:
+    "--groups A,B,..." sets the keypoint groups that get heatmaps ("joints" by default; the groups are "bodies", "joints" and "markers"), and "--keypoints A,B,..." keeps only the keypoints with these names
+    "--size WIDTHxHEIGHT" sets the resolution of the heatmaps (64x64 by default), which cover the whole image
+    "--sigma S" sets the standard deviation of the Gaussians in pixels of the heatmaps (2 by default)
+    "--keep-occluded" keeps the heatmaps of occluded keypoints; by default, keypoints that are occluded according to their visibility columns get an empty heatmap and a weight of 0, like keypoints that are out of the image or missing
+    "--dtype float16|float32" sets the type of the stored heatmaps (float16 by default, which halves their size)
+    "--width" and "--height" set the image size, which is otherwise read from the first image
+    "--output PATH/TO/FOLDER" sets the folder of the caches ("annotations/heatmaps" by default) and "--processes N" the number of worker processes (all CPU cores by default)
+Each set of parameters gets its own cache folder, named after a hash of the parameters and of the size and modification time of annotations.csv, so the heatmaps are only computed again when the parameters or the annotations change, and caches of different parameters can be kept side by side.
+A cache folder holds "heatmaps.npy" of shape (n_images, n_keypoints, height, width) in the order of the rows in the annotations, "weights.npy" of shape (n_images, n_keypoints) with 1 for the keypoints that are used and 0 for the others, and "params.json" with the parameters and the names of the keypoints ("group/name").
+The rows are computed in chunks, and the chunks that are done are recorded in "done.npy", so an interrupted run continues where it stopped; the cache is complete once "complete" is true in "params.json".
+In training, memory-map the arrays with numpy.load(path, mmap_mode='r'), so that only the heatmaps of the images in a batch are read from disk.
+"""
+
+import sys, getopt, os, json, hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from keypoint_store import load_keypoint_store, open_keypoint_store, get_cache_path, get_csv_signature
+from image_loading import read_image_size
+from convert_to_coco import get_visibility_flags
+
+# how many rows each task handed to a worker process computes
+CHUNK_SIZE = 64
+# increment when the layout of the cache or the computation changes so that old caches are not reused
+HEATMAPS_VERSION = 2
+
+
+# get the (group, index, name) of the keypoints that get heatmaps, in the order of the groups and then of the keypoints in the store
+def select_keypoints(schema, groups, names=None):
+    return [(group, i, name) for group in groups for i, name in enumerate(schema[group]) if names is None or name in names]
+
+# get the name of the cache folder of a set of parameters
+def get_params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+# compute the heatmaps of (n_images, n_keypoints, 2) keypoints in image pixels and (n_images, n_keypoints) weights; each Gaussian is the outer product of a Gaussian along y and one along x
+def compute_heatmaps(xy, weights, image_size, heatmap_size, sigma):
+    # pixel centers of the heatmap in the coordinates of the image scaled to the heatmap
+    scale = np.array(heatmap_size, dtype=np.float32) / np.array(image_size, dtype=np.float32)
+    # missing (NaN) coordinates are replaced before the Gaussians, as 0 times NaN would still be NaN in the outer product
+    centers = (np.nan_to_num(xy, nan=0.0, posinf=0.0, neginf=0.0) + 0.5) * scale - 0.5
+    xs = np.arange(heatmap_size[0], dtype=np.float32)
+    ys = np.arange(heatmap_size[1], dtype=np.float32)
+    gx = np.exp(-(xs - centers[...,0,None])**2 / (2*sigma**2))
+    gy = np.exp(-(ys - centers[...,1,None])**2 / (2*sigma**2))
+    # unused keypoints (including NaN coordinates) get empty heatmaps
+    used = weights[...,None] > 0
+    gx = np.where(used, gx, 0)
+    gy = np.where(used, gy, 0)
+    return np.einsum('nky,nkx->nkyx', gy, gx)
+
+# get the keypoints of a range of rows and their weights, which are 0 for keypoints that are missing, out of the image, or occluded unless they are kept
+def get_keypoints(store, keypoints, start, end, image_size, keep_occluded):
+    xy = np.zeros((end-start, len(keypoints), 2), dtype=np.float32)
+    visibility = np.zeros((end-start, len(keypoints)), dtype=np.float32)
+    for group in dict.fromkeys(group for group, _, _ in keypoints):
+        columns = [k for k, (g, _, _) in enumerate(keypoints) if g == group]
+        indices = [i for g, i, _ in keypoints if g == group]
+        xy[:,columns] = store.keypoints[group][start:end][:,indices,:2]
+        visibility[:,columns] = store.visibility[group][start:end][:,indices]
+    flags = get_visibility_flags(xy, visibility, image_size[0], image_size[1])
+    used = ~np.isnan(xy).any(axis=2) & (flags > 0) & ((flags == 2) | keep_occluded)
+    return xy, used.astype(np.float32)
+
+# the store and the cache arrays are opened once in each worker process; they are memory-mapped, so opening them is cheap
+worker_store = None
+worker_heatmaps = None
+worker_weights = None
+
+def init_worker(store_path, path_cache):
+    global worker_store, worker_heatmaps, worker_weights
+    worker_store = open_keypoint_store(store_path)
+    worker_heatmaps = np.load(Path(path_cache) / 'heatmaps.npy', mmap_mode='r+')
+    worker_weights = np.load(Path(path_cache) / 'weights.npy', mmap_mode='r+')
+
+# compute the heatmaps of a chunk of rows in a worker process and write them directly into the cache
+def compute_chunk(chunk, params, keypoints):
+    start = chunk*CHUNK_SIZE
+    end = min(start + CHUNK_SIZE, len(worker_store))
+    image_size = (params['image_width'], params['image_height'])
+    xy, weights = get_keypoints(worker_store, keypoints, start, end, image_size, params['keep_occluded'])
+    worker_heatmaps[start:end] = compute_heatmaps(xy, weights, image_size, (params['width'], params['height']), params['sigma'])
+    worker_weights[start:end] = weights
+    worker_heatmaps.flush()
+    worker_weights.flush()
+    return chunk
+
+# create the arrays of a new cache, or open an existing one; returns the chunks that are done
+def prepare_cache(path_cache, params, n_images, n_keypoints):
+    path_cache = Path(path_cache)
+    if (path_cache / 'params.json').exists():
+        return np.load(path_cache / 'done.npy', mmap_mode='r+')
+    path_cache.mkdir(parents=True, exist_ok=True)
+    np.lib.format.open_memmap(path_cache / 'heatmaps.npy', mode='w+', dtype=params['dtype'], shape=(n_images, n_keypoints, params['height'], params['width']))
+    np.lib.format.open_memmap(path_cache / 'weights.npy', mode='w+', dtype=np.float32, shape=(n_images, n_keypoints))
+    done = np.lib.format.open_memmap(path_cache / 'done.npy', mode='w+', dtype=bool, shape=(-(-n_images // CHUNK_SIZE),))
+    # the parameters are written after the arrays exist, so a cache with parameters can always be opened
+    write_params(path_cache, params, complete=False)
+    return done
+
+def write_params(path_cache, params, complete):
+    with open(Path(path_cache) / 'params.json.tmp', 'w') as f:
+        json.dump(dict(params, complete=complete), f, indent=1)
+    os.replace(Path(path_cache) / 'params.json.tmp', Path(path_cache) / 'params.json')
+
+# globals
+path_root = None
+path_output = None
+groups = ['joints']
+keypoint_names = None
+heatmap_size = (64, 64)
+sigma = 2.0
+keep_occluded = False
+dtype = 'float16'
+width = None
+height = None
+n_processes = None
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, groups, keypoint_names, heatmap_size, sigma, keep_occluded, dtype, width, height, n_processes
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "groups=", "keypoints=", "size=", "sigma=", "keep-occluded", "dtype=", "width=", "height=", "processes="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--groups":
+                groups = current_val.split(',')
+            elif current_arg == "--keypoints":
+                keypoint_names = current_val.split(',')
+            elif current_arg == "--size":
+                heatmap_size = tuple(int(x) for x in current_val.lower().split('x'))
+            elif current_arg == "--sigma":
+                sigma = float(current_val)
+            elif current_arg == "--keep-occluded":
+                keep_occluded = True
+            elif current_arg == "--dtype":
+                dtype = current_val
+            elif current_arg == "--width":
+                width = int(current_val)
+            elif current_arg == "--height":
+                height = int(current_val)
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output, width, height
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    if len(store) == 0:
+        print('No annotations in', path_csv)
+        return
+    keypoints = select_keypoints(store.schema, groups, keypoint_names)
+    if len(keypoints) == 0:
+        print('No keypoints of the groups', ','.join(groups), 'were selected')
+        return
+
+    # the image size is read from the header of the first image, as all images of a dataset have the same resolution
+    if width is None or height is None:
+        size = read_image_size(Path(path_root) / 'images' / (str(store.file_names[0]) + '.jpg'))
+        width = size[0] if width is None else width
+        height = size[1] if height is None else height
+
+    params = {'version': HEATMAPS_VERSION, 'csv': get_csv_signature(path_csv), 'image_width': width, 'image_height': height,
+              'width': heatmap_size[0], 'height': heatmap_size[1], 'sigma': sigma, 'keep_occluded': keep_occluded, 'dtype': dtype, 'chunk_size': CHUNK_SIZE,
+              'keypoints': [group + '/' + name for group, _, name in keypoints]}
+    if path_output is None:
+        path_output = Path(path_root) / 'annotations/heatmaps'
+    path_cache = Path(path_output) / get_params_hash(params)
+    done = prepare_cache(path_cache, params, len(store), len(keypoints))
+    chunks = np.flatnonzero(~done).tolist()
+    if len(chunks) == 0:
+        print('Heatmaps are up to date in', path_cache)
+        return
+
+    print('Computing heatmaps of', len(keypoints), 'keypoints in', len(chunks), 'chunks of', CHUNK_SIZE, 'images to', path_cache)
+    n_workers = n_processes if n_processes is not None else os.cpu_count()
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(get_cache_path(path_csv), path_cache)) as executor:
+        for chunk in executor.map(compute_chunk, chunks, [params]*len(chunks), [keypoints]*len(chunks)):
+            # a chunk is only marked as done after its heatmaps have been flushed to disk
+            done[chunk] = True
+            done.flush()
+            n_done += 1
+            if n_done % 100 == 0 or n_done == len(chunks):
+                print('Computed', n_done, '/', len(chunks), 'chunks')
+    write_params(path_cache, params, complete=True)
+    print('Saved heatmaps to', path_cache)
+
+if __name__ == '__main__':
+    main()
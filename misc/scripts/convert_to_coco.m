@@ -1,4 +1,5 @@
 % changes the default Godosim annotations to COCO JSON format
+% see convert_to_coco.py for a faster Python version that doesn't need MATLAB
 clc;clear;close all;
 
 % path to the folder which contains the generated data folders "annotations" and "images"
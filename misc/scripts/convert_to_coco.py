@@ -0,0 +1,197 @@
+"""
+This Python script changes the default Godosim annotations to COCO JSON format, like convert_to_coco.m, but without needing MATLAB.
+Basic usage: "python convert_to_coco.py --path PATH/TO/ROOT/FOLDER"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim. The output is saved to "annotations_coco_format.json" in the root folder, unless another file is given with "--output PATH/TO/FILE".
+The keypoints are the virtual markers of the musculoskeletal model, sorted by name.
+The image size used to check if keypoints are out of bounds is read from the first image; use "--width" and "--height" to set it manually.
+To use segmentation masks instead of the bounding box as the segmentation, first encode the masks with encode_masks.py and add "--masks PATH/TO/masks_rle.jsonl"; the area of each annotation is then the area of the silhouette mask, and the segments of segment masks are added to the annotations as "segments".
+The annotations are processed in chunks of rows with array operations and written to the JSON file as they are processed, so the whole dataset never has to be held in memory.
+"""
+
+import sys, getopt, os, json, datetime
+from pathlib import Path
+import numpy as np
+from keypoint_store import load_keypoint_store
+from image_loading import read_image_size
+from encode_masks import read_mask_encodings
+
+# how many rows are processed at a time
+CHUNK_SIZE = 10000
+# coordinates are rounded to this many decimals, which keeps the file small while staying well below pixel precision
+DECIMALS = 3
+
+
+# compute the COCO visibility flags of keypoints: 0 if the keypoint is out of image bounds, 1 if it's clearly occluded, and 2 otherwise (visible, unoccluded)
+def get_visibility_flags(xy, visibility, width, height):
+    out_of_bounds = (xy[...,0] < 0) | (xy[...,1] < 0) | (xy[...,0] > width) | (xy[...,1] > height)
+    # the visibility value is 1 for unoccluded keypoints and decreases with occlusion
+    with np.errstate(divide='ignore', invalid='ignore'):
+        occluded = np.rint(1.0/visibility) > 1
+    return np.where(out_of_bounds, 0, np.where(occluded, 1, 2)).astype(np.int8)
+
+# get the image id from the file name, which ends with the index of the image
+def get_image_id(file_name):
+    return str(file_name)[-10:]
+
+# write the annotations of all rows, one chunk of rows at a time
+def write_annotations(f, store, order, width, height, mask_encodings=None):
+    n_keypoints = len(order)
+    first = True
+    for start in range(0, len(store), CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, len(store))
+        xy = np.round(store.keypoints['markers'][start:end][:,order,:2].astype(np.float64), DECIMALS)
+        flags = get_visibility_flags(xy, store.visibility['markers'][start:end][:,order], width, height)
+        # NaN is not valid JSON, so missing keypoints are written as 0,0,0 like unlabeled keypoints in COCO
+        finite = np.isfinite(xy).all(axis=2)
+        xy = np.where(finite[...,None], xy, 0.0)
+        flags = np.where(finite, flags, 0)
+        # an object array lets the coordinates stay floats and the flags become integers in the JSON output
+        keypoints = np.empty((end-start, n_keypoints, 3), dtype=object)
+        keypoints[...,:2] = xy
+        keypoints[...,2] = flags
+        keypoints = keypoints.reshape(end-start, -1).tolist()
+        boxes = store.boxes[start:end].astype(np.float64)
+        # and missing boxes as 0,0,0,0 with an area of 0
+        boxes = np.where(np.isfinite(boxes).all(axis=1)[:,None], boxes, 0.0)
+        areas = np.round(boxes[:,2]*boxes[:,3], DECIMALS).tolist()
+        boxes = np.round(boxes, DECIMALS).tolist()
+        for i in range(end-start):
+            img_id = get_image_id(store.file_names[start+i])
+            annotation = {
+                'area': areas[i],
+                'bbox': boxes[i],
+                'category_id': 1,
+                'id': img_id,
+                'image_id': img_id,
+                'iscrowd': 0,
+                'keypoints': keypoints[i],
+                'num_keypoints': n_keypoints,
+                # without segmentation masks, the segmentation is set to the bounding box
+                'segmentation': boxes[i],
+                }
+            if mask_encodings is not None:
+                masks = next(mask_encodings, None)
+                if masks is None:
+                    raise ValueError('No masks for row ' + str(start+i) + ' (' + str(store.file_names[start+i]) + ')')
+                if 'segmentation' in masks:
+                    annotation['segmentation'] = masks['segmentation']
+                    annotation['area'] = masks['area']
+                if 'segments' in masks:
+                    annotation['segments'] = masks['segments']
+            # allow_nan=False fails instead of writing invalid JSON if a value is still not finite
+            f.write(('\n' if first else ',\n') + json.dumps(annotation, allow_nan=False))
+            first = False
+
+# write the image entries of all rows
+def write_images(f, store, width, height):
+    for i in range(len(store)):
+        file_name = str(store.file_names[i])
+        image = {
+            'file_name': '../images/' + file_name + '.jpg',
+            'id': get_image_id(file_name),
+            'height': height,
+            'width': width,
+            'license': 1,
+            }
+        f.write(('\n' if i == 0 else ',\n') + json.dumps(image))
+
+# write the whole dataset in COCO format; the lists of annotations and images are streamed to the file instead of building the whole dataset in memory first
+def write_coco(path_output, store, width, height, date_created, path_masks=None):
+    # keypoints are ordered by name, like MATLAB's unique() orders them in convert_to_coco.m
+    names = store.schema['markers']
+    order = sorted(range(len(names)), key=lambda i: names[i])
+
+    categories = [{'id': 1, 'name': 'person'}]
+    info = {
+        'contributor': 'Jere Lavikainen',
+        'date_created': date_created.strftime('%Y/%m/%d'),
+        'description': 'Godosim sample dataset',
+        'url': 'https://github.com/jerela/Godosim',
+        'version': 1,
+        'year': date_created.year,
+        }
+    licenses = [{'id': 1, 'name': 'License for non-commercial scientific research purposes', 'url': 'https://bedlam.is.tue.mpg.de/license.html'}]
+
+    # the file is written under a temporary name and only replaces the output once it is complete, so an error midway never leaves a truncated file
+    path_temp = str(path_output) + '.tmp'
+    try:
+        with open(path_temp, 'w') as f:
+            f.write('{"annotations": [')
+            mask_encodings = read_mask_encodings(path_masks, store.file_names) if path_masks is not None else None
+            write_annotations(f, store, order, width, height, mask_encodings)
+            f.write('\n],\n"images": [')
+            write_images(f, store, width, height)
+            f.write('\n],\n"categories": ' + json.dumps(categories))
+            f.write(',\n"info": ' + json.dumps(info))
+            f.write(',\n"licenses": ' + json.dumps(licenses))
+            f.write('\n}\n')
+    except BaseException:
+        os.remove(path_temp)
+        raise
+    os.replace(path_temp, path_output)
+
+# globals
+path_root = None
+path_output = None
+path_masks = None
+width = None
+height = None
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, path_masks, width, height
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "masks=", "width=", "height="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--masks":
+                path_masks = current_val
+            elif current_arg == "--width":
+                width = int(current_val)
+            elif current_arg == "--height":
+                height = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output, width, height
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    if len(store) == 0:
+        print('No annotations in', path_csv)
+        return
+
+    # the image size is read from the header of the first image, as all images of a dataset have the same resolution
+    if width is None or height is None:
+        size = read_image_size(Path(path_root) / 'images' / (str(store.file_names[0]) + '.jpg'))
+        width = size[0] if width is None else width
+        height = size[1] if height is None else height
+    print('Image size:', width, 'x', height)
+
+    if path_output is None:
+        path_output = Path(path_root) / 'annotations_coco_format.json'
+    date_created = datetime.date.fromtimestamp(path_csv.stat().st_mtime)
+    write_coco(path_output, store, width, height, date_created, path_masks)
+    print('Saved COCO annotations to', path_output)
+
+if __name__ == '__main__':
+    main()
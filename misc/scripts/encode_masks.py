@@ -0,0 +1,121 @@
+"""
+This Python script encodes the silhouette and segment mask images generated by Godosim with COCO-style run-length encoding (RLE) and computes their areas.
+Basic usage: "python encode_masks.py --path PATH/TO/ROOT/FOLDER --silhouettes PATH/TO/SILHOUETTE/MASKS --segments PATH/TO/SEGMENT/MASKS"
+The root folder should contain the folder "annotations", as generated by Godosim. The mask folders are the folders set with path_output_images_silhouette_masks and path_output_images_segment_masks in the config file; either one can be left out.
+The masks are expected to have the same file names as the RGB images; use "--extension" to set their file extension (".png" by default).
+Either mask folder can also be the folder of a dataset packed with pack_shards.py, from which the masks are then read.
+The output is saved to "annotations/masks_rle.jsonl" in the root folder, unless another file is given with "--output PATH/TO/FILE". It has one JSON object per row of the annotations, in the same order, with the fields:
+    "file_name": name of the image
+    "segmentation" and "area": RLE and area in pixels of the silhouette mask
+    "segments": list of the segments in the segment mask, each with its "color", "segmentation" and "area"
+Use "python convert_to_coco.py --masks annotations/masks_rle.jsonl" to use the masks in COCO annotations.
+Masks are decoded and encoded in parallel; use "--processes N" to set the number of worker processes (all CPU cores by default).
+"""
+
+import sys, getopt, os, json
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from keypoint_store import load_keypoint_store
+from masks import get_binary_mask, get_segment_labels, get_rle_segmentation
+from shards import read_mask
+
+# how many images each task handed to a worker process encodes
+CHUNK_SIZE = 64
+
+
+# encode the masks of one image into a JSON line
+def encode_image_masks(file_name, path_silhouettes, path_segments, extension):
+    entry = {'file_name': file_name}
+    if path_silhouettes is not None:
+        binary = get_binary_mask(read_mask(path_silhouettes, file_name, extension, 'silhouette'))
+        entry['segmentation'] = get_rle_segmentation(binary)
+        entry['area'] = int(binary.sum())
+    if path_segments is not None:
+        labels, colors, areas = get_segment_labels(read_mask(path_segments, file_name, extension, 'segments'))
+        entry['segments'] = [{'color': colors[i].tolist(), 'segmentation': get_rle_segmentation(labels == i), 'area': int(areas[i])} for i in range(len(colors))]
+    return json.dumps(entry)
+
+# encode the masks of a list of images in a worker process
+def encode_chunk(file_names, path_silhouettes, path_segments, extension):
+    return [encode_image_masks(file_name, path_silhouettes, path_segments, extension) for file_name in file_names]
+
+# read the mask encodings written by this script one row at a time, checking that they are in the same order as the annotations
+def read_mask_encodings(path, file_names):
+    with open(path, 'r') as f:
+        for row, file_name in enumerate(file_names):
+            line = f.readline()
+            if not line:
+                raise ValueError('Masks in ' + str(path) + ' end before the annotations: no masks for row ' + str(row) + ' (' + str(file_name) + ')')
+            entry = json.loads(line)
+            if entry['file_name'] != str(file_name):
+                raise ValueError('Masks in ' + str(path) + ' do not match the annotations: expected ' + str(file_name) + ' but got ' + entry['file_name'])
+            yield entry
+
+# globals
+path_root = None
+path_output = None
+path_silhouettes = None
+path_segments = None
+extension = '.png'
+n_processes = None
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, path_silhouettes, path_segments, extension, n_processes
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "silhouettes=", "segments=", "extension=", "processes="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--silhouettes":
+                path_silhouettes = current_val
+            elif current_arg == "--segments":
+                path_segments = current_val
+            elif current_arg == "--extension":
+                extension = current_val
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the annotations folder with --path path/to/folder')
+        return
+    if path_silhouettes is None and path_segments is None:
+        print('Specify the folder of silhouette masks with --silhouettes path/to/folder and/or the folder of segment masks with --segments path/to/folder')
+        return
+
+    store = load_keypoint_store(Path(path_root) / 'annotations/annotations.csv')
+    file_names = [str(file_name) for file_name in store.file_names]
+    if path_output is None:
+        path_output = Path(path_root) / 'annotations/masks_rle.jsonl'
+
+    n_workers = n_processes if n_processes is not None else os.cpu_count()
+    chunks = [file_names[start:start+CHUNK_SIZE] for start in range(0, len(file_names), CHUNK_SIZE)]
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor, open(path_output, 'w') as f:
+        # map returns the results in the order of the chunks, so the output stays in the order of the annotations
+        for lines in executor.map(encode_chunk, chunks, [path_silhouettes]*len(chunks), [path_segments]*len(chunks), [extension]*len(chunks)):
+            f.write('\n'.join(lines) + '\n')
+            n_done += len(lines)
+            print('Encoded', n_done, '/', len(file_names))
+    print('Saved mask encodings to', path_output)
+
+if __name__ == '__main__':
+    main()
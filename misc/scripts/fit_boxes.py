@@ -0,0 +1,134 @@
+"""
+This Python script computes pixel-exact bounding boxes of the visualized human avatar from the silhouette mask images generated by Godosim.
+This lets Godosim run with a large "step" and no "padding" under [bounding_box] in the config file, which makes image generation faster, while the dataset still gets exact bounding boxes.
+Basic usage: "python fit_boxes.py --path PATH/TO/ROOT/FOLDER --silhouettes PATH/TO/SILHOUETTE/MASKS"
+The root folder should contain the folder "annotations", as generated by Godosim. The silhouette folder is the folder set with path_output_images_silhouette_masks in the config file.
+The masks are expected to have the same file names as the RGB images; use "--extension" to set their file extension (".png" by default).
+The silhouette folder can also be the folder of a dataset packed with pack_shards.py, from which the masks are then read.
+By default, the boxes are added to the annotations as the columns "mask_bb_x", "mask_bb_y", "mask_bb_w" and "mask_bb_h" (NaN if the mask is empty). Add the flag "--replace" to overwrite the columns "bb_x", "bb_y", "bb_w" and "bb_h" instead (rows with empty masks keep their original box).
+The result is saved to "annotations/annotations_mask_boxes.csv" in the root folder, unless another file is given with "--output PATH/TO/FILE"; use "--in-place" to overwrite "annotations/annotations.csv".
+Masks are processed in parallel; use "--processes N" to set the number of worker processes (all CPU cores by default).
+"""
+
+import sys, getopt, os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pandas import read_csv
+from keypoint_store import load_keypoint_store, BOX_COLUMNS
+from masks import get_binary_mask, get_mask_box
+from shards import read_mask
+
+# how many masks each task handed to a worker process reads
+CHUNK_SIZE = 64
+# how many rows of the CSV file are rewritten at a time
+CSV_CHUNK_SIZE = 50000
+# columns that the boxes are written to when the original boxes are kept
+MASK_BOX_COLUMNS = ['mask_bb_x', 'mask_bb_y', 'mask_bb_w', 'mask_bb_h']
+
+
+# compute the boxes of a list of images in a worker process; empty masks give NaN boxes
+def fit_chunk(file_names, path_silhouettes, extension):
+    boxes = np.full((len(file_names), 4), np.nan)
+    for i, file_name in enumerate(file_names):
+        box = get_mask_box(get_binary_mask(read_mask(path_silhouettes, file_name, extension, 'silhouette')))
+        if box is not None:
+            boxes[i] = box
+    return boxes
+
+# compute the boxes of all images in parallel
+def fit_boxes(file_names, path_silhouettes, extension, n_workers):
+    chunks = [file_names[start:start+CHUNK_SIZE] for start in range(0, len(file_names), CHUNK_SIZE)]
+    boxes = np.full((len(file_names), 4), np.nan)
+    row = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for chunk_boxes in executor.map(fit_chunk, chunks, [path_silhouettes]*len(chunks), [extension]*len(chunks)):
+            boxes[row:row+len(chunk_boxes)] = chunk_boxes
+            row += len(chunk_boxes)
+            print('Fitted', row, '/', len(file_names))
+    return boxes
+
+# copy the CSV file one chunk of rows at a time, writing the boxes into it
+def write_boxes(path_csv, path_output, boxes, replace):
+    row = 0
+    # round_trip parsing keeps the other values exactly as they were written
+    for chunk in read_csv(path_csv, chunksize=CSV_CHUNK_SIZE, float_precision='round_trip'):
+        chunk_boxes = boxes[row:row+len(chunk.index)]
+        if replace:
+            empty = np.isnan(chunk_boxes[:,0])
+            chunk.loc[~empty, BOX_COLUMNS] = chunk_boxes[~empty]
+        else:
+            chunk[MASK_BOX_COLUMNS] = chunk_boxes
+        chunk.to_csv(path_output, mode='w' if row == 0 else 'a', header=row == 0, index=False)
+        row += len(chunk.index)
+
+# globals
+path_root = None
+path_output = None
+path_silhouettes = None
+extension = '.png'
+replace = False
+in_place = False
+n_processes = None
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, path_silhouettes, extension, replace, in_place, n_processes
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "silhouettes=", "extension=", "replace", "in-place", "processes="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--silhouettes":
+                path_silhouettes = current_val
+            elif current_arg == "--extension":
+                extension = current_val
+            elif current_arg == "--replace":
+                replace = True
+            elif current_arg == "--in-place":
+                in_place = True
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output
+
+    parse_arguments()
+
+    if path_root is None or path_silhouettes is None:
+        print('Specify path to the folder with the annotations folder with --path path/to/folder and the folder of silhouette masks with --silhouettes path/to/folder')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    file_names = [str(file_name) for file_name in store.file_names]
+    n_workers = n_processes if n_processes is not None else os.cpu_count()
+    boxes = fit_boxes(file_names, path_silhouettes, extension, n_workers)
+    print('Empty masks:', int(np.isnan(boxes[:,0]).sum()))
+
+    if in_place:
+        # write to a temporary file first so that the annotations are not lost if writing fails
+        path_output = path_csv.with_name(path_csv.name + '.tmp')
+    elif path_output is None:
+        path_output = Path(path_root) / 'annotations/annotations_mask_boxes.csv'
+    write_boxes(path_csv, path_output, boxes, replace)
+    if in_place:
+        os.replace(path_output, path_csv)
+        path_output = path_csv
+    print('Saved annotations with mask bounding boxes to', path_output)
+
+if __name__ == '__main__':
+    main()
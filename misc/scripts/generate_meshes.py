@@ -1,126 +1,468 @@
+"""
+This Python script generates SKEL skin and skeleton meshes, joint translations and bone scales for different sexes and body morphologies.
+Basic usage: "python generate_meshes.py" generates the morphologies where all 10 body morphology coefficients (betas) are -2, -1, 0, 1, or 2, named like "male_minus2".
+Sweeps over many morphologies:
+    "--samples N" generates N morphologies per sex, with each coefficient drawn independently from a normal distribution with standard deviation "--sigma S" (1.0 by default) and seed "--seed N" (0 by default)
+    "--betas PATH/TO/FILE" generates the morphologies listed in a text file with 10 comma-separated coefficients per line
+    "--processes N" spreads the sweep over N worker processes (1 by default); each worker holds at most one SKEL model at a time, so N also bounds the number of loaded models
+    "--batch-size N" sets how many morphologies are run through SKEL in one forward pass (16 by default in sweeps)
+Use "--format archive" to save each morphology as a single binary archive "mesh_<name>.npz" (see mesh_archive.py) instead of OBJ and text files, or "--format both" to save both.
+In sweeps, each morphology is named after a hash of the sex, the coefficients, the pose file and the SKEL version, like "male_3f2a9c0d41b7", and its coefficients are saved to "betas_<name>.json". Morphologies that have already been generated with the same inputs in the same formats are skipped, so reruns only generate new morphologies or the files of formats that are missing.
+Posed sequences: "--motion PATH/TO/FILE" poses a single morphology ("--gender male|female", male by default, and "--shape" with 10 comma-separated coefficients, zeros by default) with every frame of a motion instead
+    the motion file is a .npy file with an (n_frames, 46) array of pose parameters, or a text file with 46 comma-separated pose parameters per line; 3 more values per frame (49 in total) are used as the translation
+    frames are read and run through SKEL in chunks of "--batch-size N" (64 by default) and written into memory-mapped arrays "skin_vertices.npy" (n_frames, n_verts, 3) and "joints.npy" (n_frames, n_joints, 3) in the folder "motion_<name>", named after a hash of the inputs like the morphologies of sweeps
+    "progress.json" in the folder records how many frames are done, so an interrupted run continues where it stopped when it is started again with the same inputs
+"""
+
 import os
 import torch
 from skel.skel_model import SKEL
 import trimesh
-import sys
+import sys, getopt, json, hashlib
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version, PackageNotFoundError
+from mesh_archive import save_mesh_archive, get_archive_name
 
+import numpy as np
+from numpy.lib.format import open_memmap
 from numpy import array2string
 
+
+# folder where the meshes, joint translations and bone scales are saved
+path_output = 'PATH/TO/OUTPUT'
+# text file with the BSM initial pose
+bsm_pose_path = os.path.join('PATH/TO/TEXT/FILE', 'bsm_body_pose.txt')
+device = 'cpu'
+# how many body morphologies are run through SKEL in one forward pass; None runs all morphologies of a gender in a single batch
+batch_size = None
+# "text" saves OBJ meshes and text files, "archive" saves a binary archive per morphology, and "both" saves both
+export_format = 'text'
+
+# names of the body morphology coefficients in the names of the output files
+beta_strings = {-2: "minus2", -1: "minus1", 0: "zero", 1: "plus1", 2: "plus2"}
+# sweep settings set from the command line
+n_samples = None
+sigma = 1.0
+seed = 0
+betas_path = None
+n_processes = 1
+# sweep coefficients are rounded to this many decimals so that they are exactly reproducible from their JSON files
+BETA_DECIMALS = 6
+# motion settings set from the command line
+motion_path = None
+motion_gender = 'male'
+motion_betas = [0.0]*10
+# how many frames of a motion are read and run through SKEL at a time if --batch-size is not given
+MOTION_BATCH_SIZE = 64
+
+
+# read the 46 pose parameters from a text file with one value per line
+def read_pose(path):
+    f = open(path, 'r')
+    bsm_pose = f.readlines()
+    f.close()
+    pose = torch.tensor([float(value) for value in bsm_pose[:46]]).reshape(1, 46).to(device) # (1, 46)
+    for i in range(46):
+        print(str(i) + ': ' + str(pose[0][i]))
+    return pose
+
+# run SKEL forward passes for a list of (10,) body morphology coefficients in batches of batch_size, and yield the output of each batch with the indices of its morphologies
+def run_batches(skel, pose, betas_list):
+    n = len(betas_list)
+    size = n if batch_size is None else batch_size
+    for start in range(0, n, size):
+        end = min(start + size, n)
+        # stack the morphologies into a (B, 10) tensor and repeat the pose for each of them
+        betas = torch.stack(betas_list[start:end]).to(device) # (B, 10)
+        poses = pose.repeat(end - start, 1) # (B, 46)
+        trans = torch.zeros(end - start, 3).to(device) # (B, 3)
+        # gradients are not needed, so autograd bookkeeping is skipped
+        with torch.no_grad():
+            skel_output = skel(poses, betas, trans)
+        yield range(start, end), skel_output
+
+# export the meshes, joint translations and bone scales of element b of a batched SKEL output
+def export_variant(skel, skel_output, b, filename_identifier):
+    os.makedirs(path_output, exist_ok=True)
+    if export_format in ('archive', 'both'):
+        export_archive(skel, skel_output, b, filename_identifier)
+    if export_format in ('text', 'both'):
+        export_text(skel, skel_output, b, filename_identifier)
+
+# export the outputs of element b of a batched SKEL output as typed arrays in a single binary archive
+def export_archive(skel, skel_output, b, filename_identifier):
+    archive_path = os.path.join(path_output, get_archive_name(filename_identifier))
+    save_mesh_archive(archive_path,
+                      skin_vertices=skel_output.skin_verts[b].detach().cpu().numpy(),
+                      skin_faces=skel.skin_f.cpu().numpy(),
+                      skeleton_vertices=skel_output.skel_verts[b].detach().cpu().numpy(),
+                      skeleton_faces=skel.skel_f.cpu().numpy(),
+                      joints=skel_output.joints[b].detach().cpu().numpy(),
+                      bone_scales=skel_output.bone_scales[b].detach().cpu().numpy(),
+                      bone_names=list(skel_output.bone_names),
+                      joint_names=list(skel_output.joint_names))
+    print('Archive saved to: {}'.format(archive_path))
+
+# export the outputs of element b of a batched SKEL output as OBJ meshes and text files
+def export_text(skel, skel_output, b, filename_identifier):
+    # Export meshes
+
+    filename_skin_mesh = "skin_mesh_" + filename_identifier + ".obj"
+    filename_skeleton_mesh = "skeleton_mesh_" + filename_identifier + ".obj"
+
+    skin_mesh_path = os.path.join(path_output, filename_skin_mesh)
+    skeleton_mesh_path = os.path.join(path_output, filename_skeleton_mesh)
+
+    trimesh.Trimesh(vertices=skel_output.skin_verts[b].detach().cpu().numpy(),
+                    faces=skel.skin_f.cpu()).export(skin_mesh_path)
+    print('Skin mesh saved to: {}'.format(skin_mesh_path))
+
+    trimesh.Trimesh(vertices=skel_output.skel_verts[b].detach().cpu().numpy(),
+                    faces=skel.skel_f.cpu()).export(skeleton_mesh_path)
+    print('Skeleton mesh saved to: {}'.format(skeleton_mesh_path))
+
+
+    # write joint translations (positions of joints) to file
+
+    joint_translations = (skel_output.joints[b]).tolist()
+    #print(joint_translations)
+
+    filename_joint_translations = "joint_translations_" + filename_identifier + ".txt"
+    joint_path = os.path.join(path_output, filename_joint_translations)
+
+    f = open(joint_path, 'w')
+    for joint in joint_translations:
+        f.write(str(joint[0]) + "," + str(joint[1]) + "," + str(joint[2]) + "\n")
+    f.close()
+    #print("Joints:",skel_output.joints)
+
+
+    # write bone scales to file
+    bone_scales = (skel_output.bone_scales[b]).tolist()
+
+    filename_bone_scales = "bone_scales_" + filename_identifier + ".txt"
+    bone_scales_path = os.path.join(path_output, filename_bone_scales)
+
+    f = open(bone_scales_path, 'w')
+    for scale_factors in bone_scales:
+        f.write(str(scale_factors[0]) + "," + str(scale_factors[1]) + "," + str(scale_factors[2]) + "\n")
+    f.close()
+
+# write a list of names to a text file with one name per line
+def write_names(path, names):
+    f = open(path, 'w')
+    for name in names:
+        f.write(name + "\n")
+    f.close()
+
+# get the version of the installed SKEL package, which is part of the hash of each morphology because other versions may produce different meshes
+def get_skel_version():
+    try:
+        return version('skel')
+    except PackageNotFoundError:
+        return 'unknown'
+
+# hash the contents of a file
+def hash_file(path):
+    f = open(path, 'rb')
+    digest = hashlib.sha1(f.read()).hexdigest()
+    f.close()
+    return digest
+
+# get the name of a morphology from a hash of everything that determines its output
+def get_variant_name(gender, betas, pose_hash, skel_version):
+    key = json.dumps({'gender': gender, 'betas': betas, 'pose': pose_hash, 'skel': skel_version}, sort_keys=True)
+    return gender + "_" + hashlib.sha1(key.encode()).hexdigest()[:12]
+
+# get the path of the file that records the coefficients of a morphology; it is written last, so it also marks the morphology as complete
+def get_betas_path(filename_identifier):
+    return os.path.join(path_output, "betas_" + filename_identifier + ".json")
+
+# get the formats that an export format setting writes
+def get_formats(export_format):
+    return ['archive', 'text'] if export_format == 'both' else [export_format]
+
+# get the formats in which a morphology has already been generated; the betas file records them, and for betas files of older runs that do not, the formats are found from the files that were written
+def get_generated_formats(filename_identifier):
+    try:
+        f = open(get_betas_path(filename_identifier), 'r')
+        entry = json.load(f)
+        f.close()
+    except (OSError, ValueError):
+        return []
+    if 'formats' in entry:
+        return entry['formats']
+    # the bone scales are the last of the text files that are written
+    outputs = {'archive': get_archive_name(filename_identifier), 'text': "bone_scales_" + filename_identifier + ".txt"}
+    return [fmt for fmt, filename in outputs.items() if os.path.exists(os.path.join(path_output, filename))]
+
+# sample body morphologies with independent normally distributed coefficients, or read them from a text file with 10 comma-separated coefficients per line
+def get_sweep_betas():
+    if betas_path is not None:
+        f = open(betas_path, 'r')
+        betas = [[float(value) for value in line.split(',')] for line in f if line.strip()]
+        f.close()
+    else:
+        generator = torch.Generator().manual_seed(seed)
+        betas = (sigma*torch.randn(n_samples, 10, generator=generator)).tolist()
+    return [[round(value, BETA_DECIMALS) for value in row] for row in betas]
+
+# the SKEL model that is currently loaded in a worker process; only one is kept to bound memory use
+worker_skel = None
+worker_gender = None
+
+def init_worker(settings):
+    global path_output, device, batch_size, export_format
+    path_output, device, batch_size, export_format, n_threads = settings
+    # split the CPU cores between the worker processes instead of letting each of them use all cores
+    torch.set_num_threads(n_threads)
+
+# generate a batch of morphologies of one sex in a worker process; returns the bone and joint names of SKEL
+def generate_sweep_batch(gender, pose, betas, names, pose_hash, skel_version):
+    global worker_skel, worker_gender
+    if worker_gender != gender:
+        # drop the previous model before loading the next one
+        worker_skel = None
+        worker_skel = SKEL(gender=gender).to(device)
+        worker_gender = gender
+    betas_list = [torch.tensor(row) for row in betas]
+    for indices, skel_output in run_batches(worker_skel, pose, betas_list):
+        for b, i in enumerate(indices):
+            # the formats of earlier runs are kept in the record, as their files are still there
+            formats = sorted(set(get_generated_formats(names[i])) | set(get_formats(export_format)))
+            export_variant(worker_skel, skel_output, b, names[i])
+            f = open(get_betas_path(names[i]), 'w')
+            json.dump({'gender': gender, 'betas': betas[i], 'pose': pose_hash, 'skel': skel_version, 'formats': formats}, f)
+            f.close()
+            print('Generated ' + names[i])
+    return skel_output.bone_names, skel_output.joint_names
+
+# generate a sweep of morphologies for both sexes in a process pool, skipping the morphologies that have already been generated
+def run_sweep(pose):
+    global batch_size
+    if batch_size is None:
+        batch_size = 16
+    pose_hash = hash_file(bsm_pose_path)
+    skel_version = get_skel_version()
+    sweep_betas = get_sweep_betas()
+    os.makedirs(path_output, exist_ok=True)
+
+    tasks = []
+    for gender in ['male', 'female']:
+        todo = []
+        for betas in sweep_betas:
+            name = get_variant_name(gender, betas, pose_hash, skel_version)
+            # a morphology is only skipped if it has been generated in every format that is exported now, so changing --format generates the missing files
+            if set(get_formats(export_format)) <= set(get_generated_formats(name)):
+                print('Skipping ' + name + ', which has already been generated')
+            else:
+                todo.append((betas, name))
+        # tasks are grouped by sex so that each worker rarely has to switch models
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start+batch_size]
+            tasks.append((gender, [betas for betas, name in chunk], [name for betas, name in chunk]))
+    print(str(len(sweep_betas)) + " morphologies per sex, " + str(sum(len(task[1]) for task in tasks)) + " to generate")
+
+    names = None
+    n_threads = max(1, (os.cpu_count() or 1) // n_processes)
+    with ProcessPoolExecutor(max_workers=n_processes, initializer=init_worker, initargs=((path_output, device, batch_size, export_format, n_threads),)) as executor:
+        futures = [executor.submit(generate_sweep_batch, gender, pose, betas, names_chunk, pose_hash, skel_version) for gender, betas, names_chunk in tasks]
+        for future in futures:
+            names = future.result()
+    return names
+
+# count the frames of a motion file
+def count_motion_frames(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r').shape[0]
+    n_frames = 0
+    f = open(path, 'r')
+    for line in f:
+        if line.strip():
+            n_frames += 1
+    f.close()
+    return n_frames
+
+# split a chunk of motion frames into (n, 46) poses and (n, 3) translations, which are zero if the frames have no translation
+def split_motion_frames(frames):
+    poses = np.ascontiguousarray(frames[:,:46], dtype=np.float32)
+    if frames.shape[1] >= 49:
+        trans = np.ascontiguousarray(frames[:,46:49], dtype=np.float32)
+    else:
+        trans = np.zeros((len(frames), 3), dtype=np.float32)
+    return poses, trans
+
+# read the frames of a motion file from frame start on in chunks of at most size frames, so that only one chunk is in memory at a time
+def read_motion_chunks(path, start, size):
+    if path.endswith('.npy'):
+        frames = np.load(path, mmap_mode='r')
+        for i in range(start, frames.shape[0], size):
+            yield split_motion_frames(frames[i:i+size])
+        return
+    f = open(path, 'r')
+    lines = (line for line in f if line.strip())
+    # skip the frames that are already done
+    for line in islice(lines, start):
+        pass
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            break
+        yield split_motion_frames(np.loadtxt(chunk, delimiter=',', ndmin=2, dtype=np.float32))
+    f.close()
+
+# write how many frames of a motion are done; the file is replaced in one step so that it is never left half-written
+def write_motion_progress(path, progress):
+    f = open(path + '.tmp', 'w')
+    json.dump(progress, f)
+    f.close()
+    os.replace(path + '.tmp', path)
+
+# pose a single morphology with every frame of a motion, writing the skin vertices and joints of each chunk of frames into memory-mapped arrays
+def run_motion():
+    size = MOTION_BATCH_SIZE if batch_size is None else batch_size
+    n_frames = count_motion_frames(motion_path)
+    skel_version = get_skel_version()
+    motion_hash = hash_file(motion_path)
+    name = get_variant_name(motion_gender, motion_betas, motion_hash, skel_version)
+    path_motion = os.path.join(path_output, 'motion_' + name)
+    os.makedirs(path_motion, exist_ok=True)
+    path_skin_vertices = os.path.join(path_motion, 'skin_vertices.npy')
+    path_joints = os.path.join(path_motion, 'joints.npy')
+    path_progress = os.path.join(path_motion, 'progress.json')
+
+    # continue from the last chunk that was written completely; the arrays are only opened once SKEL has given their shapes if none are there yet
+    frames_done = 0
+    skin_vertices = None
+    joints = None
+    if os.path.exists(path_progress):
+        f = open(path_progress, 'r')
+        frames_done = json.load(f)['frames_done']
+        f.close()
+        if frames_done > 0:
+            skin_vertices = np.load(path_skin_vertices, mmap_mode='r+')
+            joints = np.load(path_joints, mmap_mode='r+')
+    print('Motion ' + name + ': ' + str(frames_done) + ' / ' + str(n_frames) + ' frames done')
+    progress = {'gender': motion_gender, 'betas': motion_betas, 'motion': motion_hash, 'skel': skel_version, 'n_frames': n_frames, 'frames_done': frames_done}
+    if frames_done == n_frames:
+        print("All frames of the motion have already been posed")
+        return
+
+    skel = SKEL(gender=motion_gender).to(device)
+    betas = torch.tensor(motion_betas, dtype=torch.float32).to(device) # (10,)
+    for poses, trans in read_motion_chunks(motion_path, frames_done, size):
+        n = len(poses)
+        # gradients are not needed, so autograd bookkeeping is skipped
+        with torch.no_grad():
+            skel_output = skel(torch.from_numpy(poses).to(device), betas.repeat(n, 1), torch.from_numpy(trans).to(device))
+        if skin_vertices is None:
+            skin_vertices = open_memmap(path_skin_vertices, mode='w+', dtype=np.float32, shape=(n_frames,) + tuple(skel_output.skin_verts.shape[1:]))
+            joints = open_memmap(path_joints, mode='w+', dtype=np.float32, shape=(n_frames,) + tuple(skel_output.joints.shape[1:]))
+            np.save(os.path.join(path_motion, 'skin_faces.npy'), skel.skin_f.cpu().numpy())
+            write_names(os.path.join(path_motion, 'bone_names.txt'), skel_output.bone_names)
+            write_names(os.path.join(path_motion, 'joint_names.txt'), skel_output.joint_names)
+        skin_vertices[frames_done:frames_done+n] = skel_output.skin_verts.cpu().numpy()
+        joints[frames_done:frames_done+n] = skel_output.joints.cpu().numpy()
+        frames_done += n
+        # the arrays are flushed before the progress is written, so the progress never counts frames that are not on disk
+        skin_vertices.flush()
+        joints.flush()
+        progress['frames_done'] = frames_done
+        write_motion_progress(path_progress, progress)
+        print('Posed ' + str(frames_done) + ' / ' + str(n_frames) + ' frames')
+    print('Posed vertices and joints saved to: {}'.format(path_motion))
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global n_samples, sigma, seed, betas_path, n_processes, batch_size, export_format, motion_path, motion_gender, motion_betas
+
+    argument_list = sys.argv[1:]
+    opts_short = ""
+    opts_long = ["samples=", "sigma=", "seed=", "betas=", "processes=", "batch-size=", "format=", "motion=", "gender=", "shape="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg == "--samples":
+                n_samples = int(current_val)
+            elif current_arg == "--sigma":
+                sigma = float(current_val)
+            elif current_arg == "--seed":
+                seed = int(current_val)
+            elif current_arg == "--betas":
+                betas_path = current_val
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+            elif current_arg == "--batch-size":
+                batch_size = int(current_val)
+            elif current_arg == "--format":
+                export_format = current_val
+            elif current_arg == "--motion":
+                motion_path = current_val
+            elif current_arg == "--gender":
+                motion_gender = current_val
+            elif current_arg == "--shape":
+                motion_betas = [round(float(value), BETA_DECIMALS) for value in current_val.split(',')]
+
+    except getopt.error as err:
+        print(str(err))
+
 if __name__ == '__main__':
-    
+
     args = sys.argv
     print("Arguments: ", args)
-    
-    
+    parse_arguments()
+
+    if motion_path is not None:
+        # pose a single morphology with every frame of a motion instead of generating morphologies in the initial pose
+        run_motion()
+        sys.exit()
+
     # read BSM initial pose
-    bsm_pose_path = os.path.join('PATH/TO/TEXT/FILE', 'bsm_body_pose.txt')
-    f = open(bsm_pose_path, 'r')
-    bsm_pose = f.readlines()
-    f.close()
-    
-    
-    # initialize settings for SKEL
-    device = 'cpu'
-    pose = torch.zeros(1, 46).to(device) # (1, 46)
-    betas = torch.zeros(1, 10).to(device) # (1, 10)
-    trans = torch.zeros(1, 3).to(device)
+    pose = read_pose(bsm_pose_path)
 
-    for i in range(46):
-        pose[0][i] = float(bsm_pose[i])
-        print(str(i) + ': ' + str(pose[0][i]))
+    if n_samples is not None or betas_path is not None:
+        # sweep over many morphologies with independent coefficients
+        names = run_sweep(pose)
+        if names is None:
+            print("All morphologies have already been generated")
+            sys.exit()
+        bone_names, joint_names = names
+    else:
+        # body morphology coefficients, applied to all 10 shape components
+        beta_values = [-2, -1, 0, 1, 2]
+        betas_list = [torch.full((10,), float(i_beta)) for i_beta in beta_values]
+
+        # loop through sexes; each SKEL model is initialized once and all its morphologies are generated in batched forward passes
+        for i_gender in ['male', 'female']:
+
+            print("Gender: " + i_gender + ", betas: " + str(beta_values))
 
-    # loop through permutations of sex and morphology and generate SKEL output
-    for i_gender in ['male', 'female']:
-        for i_beta in [-2, -1, 0, 1, 2]:
-    
-            print("Gender: " + i_gender + ", betas: " + str(i_beta))
-    
-            # rewrite the body morphology coefficients according to current iteration
-            for i in range(len(betas)):
-                betas[i] = i_beta
-    
-            
             # initialize SKEL
             skel = SKEL(gender=i_gender).to(device)
 
-            
-            # SKEL forward pass
-            skel_output = skel(pose, betas, trans)
-            
-            if i_beta == -2:
-                beta_string = "minus2"
-            elif i_beta == -1:
-                beta_string = "minus1"
-            elif i_beta == 0:
-                beta_string = "zero"
-            elif i_beta == 1:
-                beta_string = "plus1"
-            elif i_beta == 2:
-                beta_string = "plus2"
-            
-            filename_identifier = i_gender + "_" + beta_string
-            
-            # Export meshes    
-            os.makedirs('PATH/TO/OUTPUT', exist_ok=True)
-            
-            filename_skin_mesh = "skin_mesh_" + filename_identifier + ".obj"
-            filename_skeleton_mesh = "skeleton_mesh_" + filename_identifier + ".obj"
-            
-            skin_mesh_path = os.path.join('PATH/TO/OUTPUT', filename_skin_mesh)
-            skeleton_mesh_path = os.path.join('PATH/TO/PUTPUT', filename_skeleton_mesh)
-            
-            trimesh.Trimesh(vertices=skel_output.skin_verts.detach().cpu().numpy()[0], 
-                            faces=skel.skin_f.cpu()).export(skin_mesh_path)
-            print('Skin mesh saved to: {}'.format(skin_mesh_path))
-            
-            trimesh.Trimesh(vertices=skel_output.skel_verts.detach().cpu().numpy()[0],
-                            faces=skel.skel_f.cpu()).export(skeleton_mesh_path)
-            print('Skeleton mesh saved to: {}'.format(skeleton_mesh_path))
-            
-            
-            # write joint translations (positions of joints) to file
-            
-            joint_translations = (skel_output.joints[0]).tolist()
-            #print(joint_translations)
-            
-            filename_joint_translations = "joint_translations_" + filename_identifier + ".txt"
-            joint_path = os.path.join('PATH/TO/OUTPUT', filename_joint_translations)
-            
-            f = open(joint_path, 'w')
-            for joint in joint_translations:
-                f.write(str(joint[0]) + "," + str(joint[1]) + "," + str(joint[2]) + "\n")
-            f.close()
-            #print("Joints:",skel_output.joints)
-    
-    
-            # write bone scales to file
-            bone_scales = (skel_output.bone_scales[0]).tolist()
-            
-            filename_bone_scales = "bone_scales_" + filename_identifier + ".txt"
-            bone_scales_path = os.path.join('PATH/TO/OUTPUT', filename_bone_scales)
-            
-            f = open(bone_scales_path, 'w')
-            for scale_factors in bone_scales:
-                f.write(str(scale_factors[0]) + "," + str(scale_factors[1]) + "," + str(scale_factors[2]) + "\n")
-            f.close()
-            
+            # SKEL forward passes
+            for indices, skel_output in run_batches(skel, pose, betas_list):
+                # split the batched output into the individual morphologies
+                for b, i in enumerate(indices):
+                    filename_identifier = i_gender + "_" + beta_strings[beta_values[i]]
+                    export_variant(skel, skel_output, b, filename_identifier)
+
+        bone_names = skel_output.bone_names
+        joint_names = skel_output.joint_names
+
     # note that bones_names and joint_names are the names of bones and joints in SKEL, not necessarily in BSM!
-    bone_names = skel_output.bone_names
-    joint_names = skel_output.joint_names
     print(bone_names)
     print(joint_names)
     print("SKEL pipeline finished!")
-    
+
     # write bone names to file
-    bone_names_path = os.path.join('PATH/TO/OUTPUT', 'bone_names.txt')
-    joint_names_path = os.path.join('PATH/TO/OUTPUT', 'joint_names.txt')
-    f = open(bone_names_path, 'w')
-    for name in bone_names:
-        f.write(name + "\n")
-    f.close()
-    
+    bone_names_path = os.path.join(path_output, 'bone_names.txt')
+    joint_names_path = os.path.join(path_output, 'joint_names.txt')
+    write_names(bone_names_path, bone_names)
+
     # write joint names to file
-    f = open(joint_names_path, 'w')
-    for name in joint_names:
-        f.write(name + "\n")
-    f.close()
\ No newline at end of file
+    write_names(joint_names_path, joint_names)
@@ -0,0 +1,123 @@
+"""
+This Python module provides helpers for loading the images generated by Godosim in the scripts of this directory.
+ImagePrefetcher decodes the images around the currently viewed image in background threads and keeps the decoded images in a bounded least-recently-used cache, so that browsing does not have to wait for decoding or slow storage.
+Basic usage:
+    prefetcher = ImagePrefetcher(lambda idx: path_to_image(idx), n_images, n_ahead=4, max_bytes=512*2**20)
+    img = prefetcher.get(idx, direction=1) # returns the decoded image and starts decoding the next and previous images
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.image import imread
+from PIL import Image
+
+
+# get the (width, height) of an image file by reading only its header, without decoding the image
+def read_image_size(path):
+    with Image.open(path) as img:
+        return img.size
+
+
+class ImagePrefetcher:
+    def __init__(self, get_path, n_images, n_ahead=4, max_bytes=512*2**20, n_workers=4, load=imread):
+        # function that returns the path of the image at an index
+        self.get_path = get_path
+        self.n_images = n_images
+        # how many images are decoded ahead of and behind the current image
+        self.n_ahead = n_ahead
+        # the cache evicts images once the decoded images take more memory than this
+        self.max_bytes = max_bytes
+        # function that decodes an image file into an array
+        self.load = load
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        # the window of indices that is currently wanted; background decodes outside of it are dropped as stale
+        self.idx = 0
+        self.direction = 1
+
+    # get the decoded image at idx and prefetch the images around it in the direction of browsing (1 forwards, -1 backwards)
+    def get(self, idx, direction=1):
+        with self.lock:
+            self.idx = idx
+            self.direction = direction
+            img = self.cache.get(idx)
+            if img is not None:
+                self.cache.move_to_end(idx)
+            future = self.pending.get(idx)
+        if img is None:
+            # wait for a decode that is already running, or decode synchronously
+            img = future.result() if future is not None else None
+            if img is None:
+                img = self.load(self.get_path(idx))
+                self._insert(idx, img)
+        self.prefetch()
+        return img
+
+    # indices that should be cached around the current index, ordered by priority (first in the direction of browsing)
+    def window(self):
+        ahead = [self.idx + self.direction*i for i in range(1, self.n_ahead+1)]
+        behind = [self.idx - self.direction*i for i in range(1, self.n_ahead+1)]
+        return [i for i in ahead + behind if 0 <= i < self.n_images]
+
+    # queue decoding of the images in the window that are neither cached nor already being decoded, and cancel queued decodes that have become stale
+    def prefetch(self):
+        with self.lock:
+            wanted = self.window()
+            for i in list(self.pending):
+                if i not in wanted and i != self.idx and self.pending[i].cancel():
+                    del self.pending[i]
+            for i in wanted:
+                if i not in self.cache and i not in self.pending:
+                    self.pending[i] = self.executor.submit(self._decode, i)
+
+    def _decode(self, i):
+        # skip images that the user has already browsed away from
+        with self.lock:
+            stale = i != self.idx and i not in self.window()
+        if stale:
+            with self.lock:
+                self.pending.pop(i, None)
+            return None
+        try:
+            img = self.load(self.get_path(i))
+        except (OSError, SyntaxError, ValueError):
+            # the image may not have been written yet; get() loads it again when it's needed
+            img = None
+        if img is not None:
+            self._insert(i, img)
+        with self.lock:
+            self.pending.pop(i, None)
+        return img
+
+    def _insert(self, i, img):
+        with self.lock:
+            if i in self.cache:
+                return
+            self.cache[i] = img
+            self.cache_bytes += img.nbytes
+            self._evict()
+
+    # evict images until the cache fits in max_bytes; images outside the window go first in least-recently-used order, then images behind the direction of browsing, furthest first
+    def _evict(self):
+        wanted = self.window()
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            def badness(item):
+                order, i = item
+                if i == self.idx:
+                    return -1
+                if i not in wanted:
+                    return 3*self.n_images - order
+                offset = (i - self.idx)*self.direction
+                return 2*self.n_images + abs(offset) if offset < 0 else abs(offset)
+            order, i = max(enumerate(self.cache), key=badness)
+            if i == self.idx:
+                break
+            self.cache_bytes -= self.cache.pop(i).nbytes
+
+    # stop the background threads
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
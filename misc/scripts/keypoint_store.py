@@ -0,0 +1,300 @@
+"""
+This Python module parses the annotations generated by Godosim into dense NumPy arrays that can be shared by the scripts in this directory.
+The column names of "annotations.csv" are parsed once into a keypoint schema (the names of the keypoints in each group), after which the keypoints of each group are held in a (n_images, n_keypoints, 3) float32 array of x, y and z (depth) values and the bounding boxes in a (n_images, 4) float32 array of x, y, width and height.
+Basic usage:
+    store = load_keypoint_store("PATH/TO/ROOT/FOLDER/annotations/annotations.csv")
+    store.keypoints['joints'][idx] # (n_joints, 3) array of the joint positions in image idx
+    store.boxes[idx] # bounding box in image idx
+    store.visibility['markers'][idx] # visibility values of the virtual markers in image idx (NaN if the file has no visibility column for a keypoint)
+On the first load, the arrays are written to a binary cache folder next to the CSV file ("annotations/annotations_cache"), which holds one .npy file per array and a small JSON schema.
+Later loads memory-map the cached arrays instead of parsing the CSV file, so only the rows that are accessed are read from disk.
+The cache is rebuilt automatically if the size or modification time of the CSV file changes.
+While Godosim is still writing the CSV file, CsvTail can be used instead to parse only the rows appended since the last read and KeypointStore.append to add them to the store.
+"""
+
+import io, json, os
+from pathlib import Path
+import numpy as np
+from pandas import read_csv
+
+# prefixes of the columns of each keypoint group: positions of bodies, joints, and virtual markers of the musculoskeletal model
+KEYPOINT_GROUPS = {'bodies': 'bp_', 'joints': 'jp_', 'markers': 'vm_'}
+# suffixes of the coordinate columns of each keypoint
+AXES = ('x', 'y', 'z')
+# columns of the bounding box around the person
+BOX_COLUMNS = ['bb_x', 'bb_y', 'bb_w', 'bb_h']
+# prefix of the visibility columns, which are named after the keypoint without the prefix of its group
+VISIBILITY_PREFIX = 'visibility_'
+# increment when the layout of the cache changes so that old caches are rebuilt
+CACHE_VERSION = 2
+# how many rows of the CSV file are parsed at a time when building the cache
+CHUNK_SIZE = 50000
+
+
+# parse column names such as "jp_knee_r_x" into the names of the keypoints in each group, in the order they first appear in the file
+def parse_schema(columns):
+    schema = {}
+    for group, prefix in KEYPOINT_GROUPS.items():
+        # a dict is used as an ordered set so that each name is only added once even though it has three coordinate columns
+        names = {}
+        for col in columns:
+            if col.startswith(prefix) and col[-2:] in ('_x', '_y', '_z'):
+                names[col[len(prefix):-2]] = None
+        schema[group] = list(names)
+    return schema
+
+# get the column names of the keypoints of a group in (keypoint, axis) order, which matches the memory layout of the keypoint arrays
+def keypoint_columns(group, names):
+    prefix = KEYPOINT_GROUPS[group]
+    return [prefix + name + '_' + axis for name in names for axis in AXES]
+
+# get the names of the visibility columns of keypoints
+def visibility_columns(names):
+    return [VISIBILITY_PREFIX + name for name in names]
+
+
+class KeypointStore:
+    def __init__(self, file_names, schema, keypoints, boxes, visibility):
+        # names of the image files (without extension) in the order of the rows in the annotations
+        self.file_names = file_names
+        # names of the keypoints in each group
+        self.schema = schema
+        # (n_images, n_keypoints, 3) arrays of each group
+        self.keypoints = keypoints
+        # (n_images, 4) array of bounding boxes
+        self.boxes = boxes
+        # (n_images, n_keypoints) arrays of the visibility values of each group
+        self.visibility = visibility
+
+    def __len__(self):
+        return len(self.file_names)
+
+    # append the rows of another store with the same schema; the arrays grow geometrically so that appending is cheap on average, and the attributes are views of the filled part
+    def append(self, other):
+        n_old = len(self)
+        n_new = n_old + len(other)
+        if not hasattr(self, 'capacity') or n_new > self.capacity:
+            self.capacity = max(2*n_new, 1024)
+            self.buffers = {'boxes': self._grow(self.boxes, n_old)}
+            for group in self.schema:
+                self.buffers[group] = self._grow(self.keypoints[group], n_old)
+                self.buffers[VISIBILITY_PREFIX + group] = self._grow(self.visibility[group], n_old)
+            self.file_names = list(self.file_names)
+        self.buffers['boxes'][n_old:n_new] = other.boxes
+        self.boxes = self.buffers['boxes'][:n_new]
+        for group in self.schema:
+            self.buffers[group][n_old:n_new] = other.keypoints[group]
+            self.keypoints[group] = self.buffers[group][:n_new]
+            self.buffers[VISIBILITY_PREFIX + group][n_old:n_new] = other.visibility[group]
+            self.visibility[group] = self.buffers[VISIBILITY_PREFIX + group][:n_new]
+        self.file_names.extend(other.file_names)
+
+    def _grow(self, array, n_rows):
+        buffer = np.empty((self.capacity,) + array.shape[1:], dtype=np.float32)
+        buffer[:n_rows] = array[:n_rows]
+        return buffer
+
+    # build the store from an annotations table that has already been read into a pandas DataFrame
+    @classmethod
+    def from_dataframe(cls, annotations, schema=None):
+        if schema is None:
+            schema = parse_schema(annotations.columns)
+        n_images = len(annotations.index)
+        keypoints = {}
+        visibility = {}
+        for group, names in schema.items():
+            # reindex fills coordinate columns that are missing from the file with NaN instead of failing
+            values = annotations.reindex(columns=keypoint_columns(group, names)).to_numpy(dtype=np.float32)
+            keypoints[group] = values.reshape(n_images, len(names), len(AXES))
+            visibility[group] = annotations.reindex(columns=visibility_columns(names)).to_numpy(dtype=np.float32)
+        boxes = annotations.reindex(columns=BOX_COLUMNS).to_numpy(dtype=np.float32)
+        file_names = annotations['file_names'].to_numpy(dtype=str)
+        return cls(file_names, schema, keypoints, boxes, visibility)
+
+
+# follows a CSV file that is still being written and parses only the complete rows that have been appended since the previous read
+class CsvTail:
+    def __init__(self, path, max_bytes=1 << 26):
+        self.path = path
+        # byte offset of the first row that has not been parsed yet
+        self.offset = 0
+        # at most this many bytes are parsed per read to keep memory bounded
+        self.max_bytes = max_bytes
+        self.columns = None
+        self.schema = None
+
+    # return a KeypointStore of the new rows, or None if no complete rows have been appended
+    def read_new_rows(self):
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            return None
+        if size < self.offset:
+            raise ValueError(str(self.path) + ' was truncated while it was being followed')
+        if size == self.offset:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(min(size - self.offset, self.max_bytes))
+            # a line can be longer than max_bytes, so the window is doubled until it holds a line break or reaches the end of the file; otherwise, such a line would never be parsed
+            while data.rfind(b'\n') < 0 and len(data) < size - self.offset:
+                more = f.read(min(size - self.offset - len(data), max(len(data), 1)))
+                if not more:
+                    break
+                data += more
+        # the last line may still be being written, so only parse up to the last line break
+        end = data.rfind(b'\n')
+        if end < 0:
+            return None
+        data = data[:end+1]
+        self.offset += end+1
+        if self.columns is None:
+            header_end = data.index(b'\n')
+            self.columns = read_csv(io.BytesIO(data[:header_end+1]), nrows=0).columns
+            self.schema = parse_schema(self.columns)
+            data = data[header_end+1:]
+            # the window may have only held the header, so the rows after it are read again right away instead of on the next poll
+            if not data:
+                return self.read_new_rows()
+        annotations = read_csv(io.BytesIO(data), header=None, names=self.columns)
+        return KeypointStore.from_dataframe(annotations, self.schema)
+
+# get the folder of the binary cache of an annotations CSV file
+def get_cache_path(csv_path):
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + '_cache')
+
+# get the size and modification time of the CSV file, which are used to check if the cache is up to date
+def get_csv_signature(csv_path):
+    stat = Path(csv_path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# count the data rows of the CSV file by counting line breaks in binary blocks, which is much faster than parsing the file
+# this is only an estimate, as blank lines and line breaks in quoted values are counted too, and lines that only end with a carriage return are not
+def count_csv_rows(csv_path):
+    n_lines = 0
+    last = b'\n'
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    # the last line may not end with a line break
+    if last != b'\n':
+        n_lines += 1
+    # the first line is the header
+    return max(n_lines - 1, 0)
+
+# open a cached store by memory-mapping its arrays; returns None if there is no cache or it does not match the CSV file
+def open_keypoint_store(cache_path, signature=None):
+    cache_path = Path(cache_path)
+    try:
+        with open(cache_path / 'schema.json', 'r') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('version') != CACHE_VERSION:
+        return None
+    if signature is not None and info.get('csv') != signature:
+        return None
+    file_names = np.load(cache_path / 'file_names.npy', mmap_mode='r')
+    boxes = np.load(cache_path / 'boxes.npy', mmap_mode='r')
+    keypoints = {}
+    visibility = {}
+    for group in info['schema']:
+        keypoints[group] = np.load(cache_path / ('keypoints_' + group + '.npy'), mmap_mode='r')
+        visibility[group] = np.load(cache_path / ('visibility_' + group + '.npy'), mmap_mode='r')
+    return KeypointStore(file_names, info['schema'], keypoints, boxes, visibility)
+
+# change the number of rows of an array in the cache by copying its rows into a new .npy file in chunks; returns the new array memory-mapped for writing
+def resize_cache_array(path, n_rows):
+    path = Path(path)
+    path_resized = path.with_name(path.stem + '_resized.npy')
+    old = np.load(path, mmap_mode='r')
+    new = np.lib.format.open_memmap(path_resized, mode='w+', dtype=old.dtype, shape=(n_rows,) + old.shape[1:])
+    n_copied = min(n_rows, len(old))
+    for start in range(0, n_copied, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, n_copied)
+        new[start:end] = old[start:end]
+    new.flush()
+    # the memory maps are closed before the file is replaced, which Windows requires
+    del old, new
+    os.replace(path_resized, path)
+    return np.load(path, mmap_mode='r+')
+
+# parse the CSV file in chunks and write the arrays directly into .npy files in the cache folder, so that the whole file never has to be held in memory
+def build_keypoint_cache(csv_path, cache_path):
+    cache_path = Path(cache_path)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    # remove the schema first so that a partially written cache is never considered valid
+    (cache_path / 'schema.json').unlink(missing_ok=True)
+
+    signature = get_csv_signature(csv_path)
+    columns = read_csv(csv_path, nrows=0).columns
+    schema = parse_schema(columns)
+    n_images = count_csv_rows(csv_path)
+
+    # only parse the columns that are stored
+    usecols = ['file_names'] + [col for col in BOX_COLUMNS if col in columns]
+    for group, names in schema.items():
+        usecols += [col for col in keypoint_columns(group, names) + visibility_columns(names) if col in columns]
+    # a visibility column can be shared by keypoints of different groups that have the same name
+    usecols = list(dict.fromkeys(usecols))
+
+    # the arrays are named after their files and allocated with the counted rows, and they are resized if the parsed rows turn out to be more or fewer
+    shapes = {'boxes': (len(BOX_COLUMNS),)}
+    for group, names in schema.items():
+        shapes['keypoints_' + group] = (len(names), len(AXES))
+        shapes['visibility_' + group] = (len(names),)
+    arrays = {name: np.lib.format.open_memmap(cache_path / (name + '.npy'), mode='w+', dtype=np.float32, shape=(n_images,) + shape) for name, shape in shapes.items()}
+    file_names = []
+
+    def resize(n_rows):
+        for name in list(arrays):
+            arrays[name].flush()
+            # the dict holds the only reference to the memory map, so it is closed before the file is resized
+            del arrays[name]
+            arrays[name] = resize_cache_array(cache_path / (name + '.npy'), n_rows)
+
+    row = 0
+    for chunk in read_csv(csv_path, usecols=usecols, chunksize=CHUNK_SIZE):
+        part = KeypointStore.from_dataframe(chunk, schema)
+        end = row + len(part)
+        if end > len(arrays['boxes']):
+            resize(max(end, 2*len(arrays['boxes'])))
+        arrays['boxes'][row:end] = part.boxes
+        for group in schema:
+            arrays['keypoints_' + group][row:end] = part.keypoints[group]
+            arrays['visibility_' + group][row:end] = part.visibility[group]
+        file_names.extend(part.file_names)
+        row = end
+    if row != len(arrays['boxes']):
+        print('Parsed', row, 'rows from', n_images, 'counted lines in', csv_path)
+        resize(row)
+
+    for array in arrays.values():
+        array.flush()
+    # the cache is only completed if every array has one row per image
+    if any(len(array) != len(file_names) for array in arrays.values()):
+        raise ValueError('Unexpected number of rows in the cache of ' + str(csv_path))
+    np.save(cache_path / 'file_names.npy', np.array(file_names, dtype=str))
+    del arrays
+
+    # the schema is written last and marks the cache as complete
+    with open(cache_path / 'schema.json', 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'csv': signature, 'schema': schema}, f, indent=1)
+    return signature
+
+# read annotations.csv and parse it into a KeypointStore; by default, the store is memory-mapped from a binary cache that is (re)built when needed
+def load_keypoint_store(path, cache=True):
+    if not cache:
+        print('Reading ', path)
+        return KeypointStore.from_dataframe(read_csv(path))
+    cache_path = get_cache_path(path)
+    store = open_keypoint_store(cache_path, get_csv_signature(path))
+    if store is None:
+        print('Reading ', path, 'and writing cache to', cache_path)
+        signature = build_keypoint_cache(path, cache_path)
+        store = open_keypoint_store(cache_path, signature)
+    else:
+        print('Reading cache ', cache_path)
+    return store
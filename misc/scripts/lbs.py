@@ -0,0 +1,138 @@
+"""
+This Python module poses the skin meshes rigged by Blender_skin_and_rig.py with linear blend skinning (LBS) in NumPy, without Blender or Godot, and projects them to images to get the bounding boxes of the person.
+Blender_skin_and_rig.py saves the rig of each morphology next to its .glb file as "human_<variant>_rig.npz", with the rest pose of the skin mesh, the bones, the sparse skinning weights and the default transforms of the OpenSim bodies that the armature was built from.
+The mesh is posed with the transforms of the OpenSim bodies in the ground frame of OpenSim, i.e., 4x4 matrices that rotate and translate points from the frame of each body to the ground frame, as (n_frames, n_bodies, 4, 4) arrays in the order of mesh.body_names.
+Each bone follows its body rigidly relative to the default pose, and the posed vertices are in the ground frame of OpenSim too.
+Like the glTF export that Godot uses, each vertex keeps the 4 largest weights by default, normalized to a sum of 1; use max_influences=None to keep all weights like Blender's armature modifier does.
+Cameras are pinhole cameras in the OpenCV convention (x right, y down, z forward) with a 3x3 intrinsic matrix and a 4x4 or 3x4 matrix from the ground frame to the camera frame; use opengl_to_opencv to convert cameras in the OpenGL convention of Godot.
+Basic usage:
+    mesh = SkinnedMesh.from_rig_file("PATH/TO/human_female_zero_rig.npz")
+    body_matrices = get_body_matrices(rotations, translations) # (n_frames, n_bodies, 4, 4) from (n_frames, n_bodies, 3, 3) rotations and (n_frames, n_bodies, 3) translations
+    vertices = mesh.pose(body_matrices) # (n_frames, n_verts, 3)
+    boxes = mesh.get_boxes(body_matrices, intrinsics, world_to_camera, width=1920, height=1080) # (n_frames, 4) bounding boxes of x, y, width and height in pixels
+Frames are posed in chunks of chunk_size, so get_boxes works on any number of frames in bounded memory; split the frames between processes to use many cores.
+"""
+
+import numpy as np
+
+# how many weights each vertex keeps by default, as in the glTF export
+MAX_INFLUENCES = 4
+# how many frames are posed at a time
+CHUNK_SIZE = 64
+# flips the y and z axes of the camera frame between the OpenGL and OpenCV conventions
+OPENGL_TO_OPENCV = np.diag([1.0, -1.0, -1.0, 1.0])
+
+
+# assemble (..., 4, 4) transforms from (..., 3, 3) rotations and (..., 3) translations
+def get_body_matrices(rotations, translations):
+    rotations = np.asarray(rotations)
+    matrices = np.zeros(rotations.shape[:-2] + (4, 4), dtype=np.float64)
+    matrices[..., :3, :3] = rotations
+    matrices[..., :3, 3] = translations
+    matrices[..., 3, 3] = 1
+    return matrices
+
+# convert a matrix from the ground frame to the camera frame in the OpenGL convention (x right, y up, -z forward) to the OpenCV convention
+def opengl_to_opencv(world_to_camera):
+    world_to_camera = np.asarray(world_to_camera, dtype=np.float64)
+    return OPENGL_TO_OPENCV[:world_to_camera.shape[-2], :world_to_camera.shape[-2]] @ world_to_camera
+
+# keep the largest max_influences weights of each vertex in a dense (n_verts, n_bodies) array and normalize them to a sum of 1; returns (n_verts, k) body indices and weights and a mask of vertices without weights
+def get_influences(weights, max_influences=MAX_INFLUENCES):
+    n_bodies = weights.shape[1]
+    k = n_bodies if max_influences is None else min(max_influences, n_bodies)
+    indices = np.argpartition(-weights, k-1, axis=1)[:,:k] if k < n_bodies else np.tile(np.arange(n_bodies), (len(weights), 1))
+    influence_weights = np.take_along_axis(weights, indices, axis=1)
+    totals = influence_weights.sum(axis=1, keepdims=True)
+    influence_weights = np.divide(influence_weights, totals, out=np.zeros_like(influence_weights), where=totals > 0)
+    return indices.astype(np.int32), influence_weights.astype(np.float32), totals[:,0] <= 0
+
+# project (..., n_points, 3) points in the ground frame to pixels with (3, 3) or (..., 3, 3) intrinsics and (4, 4), (3, 4) or (..., 4, 4), (..., 3, 4) ground-to-camera matrices; points behind the camera get NaN
+def project_points(points, intrinsics, world_to_camera):
+    world_to_camera = np.asarray(world_to_camera, dtype=np.float32)
+    intrinsics = np.asarray(intrinsics, dtype=np.float32)
+    camera_points = points @ np.swapaxes(world_to_camera[..., :3, :3], -1, -2) + world_to_camera[..., None, :3, 3]
+    projected = camera_points @ np.swapaxes(intrinsics, -1, -2)
+    depths = projected[..., 2:3]
+    pixels = projected[..., :2] / np.where(depths > 0, depths, np.nan)
+    return pixels
+
+# get the (..., 4) bounding boxes of x, y, width and height of (..., n_points, 2) pixels, ignoring NaN; with width and height, the boxes are clipped to the image, and boxes of points that are all outside the image or behind the camera are NaN
+def get_bounding_boxes(pixels, width=None, height=None):
+    # fmin and fmax ignore NaN unless all values are NaN
+    lower = np.fmin.reduce(pixels, axis=-2)
+    upper = np.fmax.reduce(pixels, axis=-2)
+    if width is not None and height is not None:
+        size = np.array([width, height], dtype=pixels.dtype)
+        outside = np.any((upper < 0) | (lower > size), axis=-1)
+        lower = np.clip(lower, 0, size)
+        upper = np.clip(upper, 0, size)
+        lower[outside] = np.nan
+        upper[outside] = np.nan
+    return np.concatenate([lower, upper - lower], axis=-1)
+
+class SkinnedMesh:
+    def __init__(self, rest_vertices, faces, body_names, default_body_matrices, influence_bodies, influence_weights, unweighted, bone_names=None, bone_parents=None, bone_bodies=None, rest_matrices=None):
+        # (n_verts, 3) vertices and (n_faces, 3) triangles of the mesh in the default pose, in the ground frame of OpenSim
+        self.rest_vertices = rest_vertices
+        self.rest_homogeneous = np.concatenate([rest_vertices, np.ones((len(rest_vertices), 1), dtype=rest_vertices.dtype)], axis=1)
+        self.faces = faces
+        self.body_names = list(body_names)
+        # (n_bodies, 4, 4) transforms of the bodies in the default pose
+        self.default_body_matrices = default_body_matrices
+        self.inverse_default_body_matrices = np.linalg.inv(default_body_matrices)
+        # (n_verts, k) bodies and normalized weights of the influences of each vertex; vertices without weights stay in the default pose
+        self.influence_bodies = influence_bodies
+        self.influence_weights = influence_weights
+        self.unweighted = unweighted
+        # the armature as exported from Blender: names, parent indices (-1 for the root), the body that each bone follows, and (n_bones, 4, 4) rest matrices in the Blender frame
+        self.bone_names = bone_names
+        self.bone_parents = bone_parents
+        self.bone_bodies = bone_bodies
+        self.rest_matrices = rest_matrices
+
+    def __len__(self):
+        return len(self.rest_vertices)
+
+    # get the (n_frames, n_bodies, 3, 4) skinning matrices that move vertices from the default pose to the pose of each frame
+    def get_skinning_matrices(self, body_matrices):
+        return (np.asarray(body_matrices) @ self.inverse_default_body_matrices)[..., :3, :].astype(np.float32)
+
+    # pose the mesh with (n_frames, n_bodies, 4, 4) body transforms; returns (n_frames, n_verts, 3) vertices in the ground frame of OpenSim
+    def pose(self, body_matrices):
+        # (n_bodies, n_frames, 3, 4), so that the matrices of a body in all frames are next to each other in memory when they are gathered for each vertex
+        skinning_matrices = np.ascontiguousarray(np.swapaxes(self.get_skinning_matrices(body_matrices), 0, 1))
+        vertices = np.zeros((len(self), skinning_matrices.shape[1], 3), dtype=np.float32)
+        # transform each vertex with the matrices of its k-th influence in all frames at once and add them up by weight
+        for k in range(self.influence_bodies.shape[1]):
+            vertices += self.influence_weights[:,k,None,None] * np.einsum('vfij,vj->vfi', skinning_matrices[self.influence_bodies[:,k]], self.rest_homogeneous)
+        vertices[self.unweighted] = self.rest_vertices[self.unweighted,None]
+        return vertices.transpose(1, 0, 2)
+
+    # get the (n_frames, 4) bounding boxes of the posed mesh in the images of a camera; the intrinsics and ground-to-camera matrices can be the same for all frames or given per frame
+    def get_boxes(self, body_matrices, intrinsics, world_to_camera, width=None, height=None, chunk_size=CHUNK_SIZE):
+        n_frames = len(body_matrices)
+        intrinsics = np.asarray(intrinsics)
+        world_to_camera = np.asarray(world_to_camera)
+        boxes = np.zeros((n_frames, 4), dtype=np.float32)
+        for start in range(0, n_frames, chunk_size):
+            end = min(start + chunk_size, n_frames)
+            chunk_intrinsics = intrinsics[start:end] if intrinsics.ndim == 3 else intrinsics
+            chunk_world_to_camera = world_to_camera[start:end] if world_to_camera.ndim == 3 else world_to_camera
+            pixels = project_points(self.pose(body_matrices[start:end]), chunk_intrinsics, chunk_world_to_camera)
+            boxes[start:end] = get_bounding_boxes(pixels, width, height)
+        return boxes
+
+    # load a rig saved by Blender_skin_and_rig.py, converting its vertices from the Blender frame to the ground frame of OpenSim
+    @classmethod
+    def from_rig_file(cls, path, max_influences=MAX_INFLUENCES):
+        rig = np.load(path)
+        blender_to_opensim = np.linalg.inv(rig['axis_matrix'])
+        rest_vertices = rig['rest_vertices'] @ blender_to_opensim[:3,:3].T + blender_to_opensim[:3,3]
+        # gather the weights of the bones into the bodies they follow
+        body_names = rig['body_names'].tolist()
+        weights = np.zeros((len(rest_vertices), len(body_names)), dtype=np.float32)
+        np.add.at(weights, (rig['weight_vertices'], rig['bone_bodies'][rig['weight_bones']]), rig['weight_values'])
+        influence_bodies, influence_weights, unweighted = get_influences(weights, max_influences)
+        return cls(rest_vertices.astype(np.float32), rig['faces'], body_names, rig['default_body_matrices'], influence_bodies, influence_weights, unweighted,
+                   rig['bone_names'].tolist(), rig['bone_parents'], rig['bone_bodies'], rig['rest_matrices'])
@@ -0,0 +1,85 @@
+"""
+This Python module provides helpers for the silhouette and segment mask images generated by Godosim.
+Silhouette masks are converted to binary masks of the visualized human avatar, and segment masks are split into one binary mask per segment color.
+Binary masks can be encoded with COCO-style run-length encoding (RLE), and their tight bounding boxes can be computed, with array operations.
+"""
+
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+# pixels whose brightest color channel is above this are foreground in silhouette masks
+THRESHOLD = 127
+
+
+# get the path of the mask image of an RGB image
+def get_mask_path(path_masks, file_name, extension='.png'):
+    return Path(path_masks) / (str(file_name) + extension)
+
+# read a mask image as a uint8 array of shape (height, width) or (height, width, 3), dropping any alpha channel
+def load_mask(path):
+    with Image.open(path) as img:
+        mask = np.asarray(img.convert('RGB') if img.mode not in ('L', 'RGB') else img)
+    return mask
+
+# convert a silhouette mask into a boolean array that is true for the pixels of the avatar
+def get_binary_mask(mask, threshold=THRESHOLD):
+    if mask.ndim == 3:
+        mask = mask.max(axis=2)
+    return mask > threshold
+
+# split a segment mask into segments by color; returns an array of segment labels per pixel (-1 for the black background), the colors of the segments and their areas in pixels
+def get_segment_labels(mask):
+    if mask.ndim == 2:
+        mask = mask[:,:,np.newaxis].repeat(3, axis=2)
+    # pack the color channels into a single integer per pixel so that colors can be compared at once
+    keys = (mask[:,:,0].astype(np.int32) << 16) | (mask[:,:,1].astype(np.int32) << 8) | mask[:,:,2].astype(np.int32)
+    unique_keys, labels, areas = np.unique(keys, return_inverse=True, return_counts=True)
+    labels = labels.reshape(keys.shape).astype(np.int32)
+    # black is the background
+    if unique_keys[0] == 0:
+        labels -= 1
+        unique_keys = unique_keys[1:]
+        areas = areas[1:]
+    colors = np.stack([(unique_keys >> 16) & 255, (unique_keys >> 8) & 255, unique_keys & 255], axis=1)
+    return labels, colors, areas
+
+# encode a binary mask with COCO-style uncompressed run-length encoding: the lengths of alternating runs of background and foreground pixels in column-major order, starting with background
+def encode_rle(binary):
+    flat = binary.ravel(order='F')
+    if flat.size == 0:
+        return []
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+# compress run lengths into the string format used by the COCO API (pycocotools), which is much smaller than the list of run lengths
+def rle_to_string(counts):
+    chars = []
+    for i, x in enumerate(counts):
+        # after the first two runs, the difference to the run two steps back is stored, which is usually small
+        if i > 2:
+            x -= counts[i-2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+# encode a binary mask as a COCO RLE segmentation with a compressed counts string
+def get_rle_segmentation(binary):
+    return {'size': [binary.shape[0], binary.shape[1]], 'counts': rle_to_string(encode_rle(binary))}
+
+# get the tight bounding box [x, y, width, height] of the foreground pixels of a binary mask from its row and column reductions, or None if there are none
+def get_mask_box(binary):
+    cols = np.flatnonzero(binary.any(axis=0))
+    if cols.size == 0:
+        return None
+    rows = np.flatnonzero(binary.any(axis=1))
+    return [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
@@ -0,0 +1,53 @@
+"""
+This Python module saves and loads the outputs of generate_meshes.py as a single binary archive per body morphology, as an alternative to OBJ and text files.
+The archive is an uncompressed NumPy .npz file that holds the vertices and faces of the skin and skeleton meshes, the joint translations, the bone scales, and the names of bones and joints as typed arrays at full precision.
+Because the arrays are stored uncompressed, load_mesh_archive can memory-map them directly from the archive instead of reading them into memory.
+The archive can also be read with numpy.load() (e.g., in Blender) or with read_mesh_archive.m in MATLAB.
+Basic usage:
+    save_mesh_archive("mesh_male_zero.npz", skin_vertices=..., skin_faces=..., joints=..., bone_names=[...])
+    archive = load_mesh_archive("mesh_male_zero.npz")
+    archive['joints'] # (n_joints, 3) array of joint translations
+"""
+
+import struct, zipfile
+import numpy as np
+
+# size of the fixed part of the local file header of a member in a zip file
+LOCAL_HEADER_SIZE = 30
+
+
+# get the path of the archive of a body morphology
+def get_archive_name(filename_identifier):
+    return "mesh_" + filename_identifier + ".npz"
+
+# save arrays to an uncompressed archive; lists of names are stored as unicode arrays so that they can be loaded without pickle
+def save_mesh_archive(path, **arrays):
+    np.savez(path, **{key: np.asarray(value) for key, value in arrays.items()})
+
+# load the arrays of an archive into a dict; with mmap=True, the arrays are memory-mapped from the archive file
+def load_mesh_archive(path, mmap=True):
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            key = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[key] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            # the data of a stored member starts after its local header, whose variable-length fields are read from the header itself
+            f.seek(info.header_offset)
+            header = f.read(LOCAL_HEADER_SIZE)
+            name_length, extra_length = struct.unpack('<2H', header[26:30])
+            f.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError('Cannot memory-map object array ' + key + ' in ' + str(path))
+            if np.prod(shape) == 0:
+                arrays[key] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[key] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
+    return arrays
@@ -0,0 +1,298 @@
+"""
+This Python script chooses a small set of skin mesh vertices for "vertices" under [bounding_box] in the config file, so that the bounding box of only these vertices matches the bounding box of the whole mesh in the images.
+The vertices are chosen from posed skin meshes seen from random camera views: for each frame, view and side of the box, the vertices that project within a pixel tolerance of the extreme of the whole mesh on that side can stand in for it, and the smallest set that stands in for all of them is found greedily (set cover).
+Basic usage: "python optimize_bbox_vertices.py --vertices PATH/TO/FILE,PATH/TO/FILE,..."
+The files are .npy arrays of posed vertices of shape (n_frames, n_verts, 3) with the y axis up, e.g., "skin_vertices.npy" saved by generate_meshes.py with "--motion", or vertices posed with lbs.py and saved with numpy.save; use files of several motions and morphologies for vertices that work for all of them.
+The chosen indices are indices of the SKEL/SMPL mesh, which do not match the indices of the mesh once it's imported to Godot Engine. Add "--glb PATH/TO/human_<variant>.glb", which needs the rig "human_<variant>_rig.npz" saved next to it by Blender_skin_and_rig.py, to print the indices of the vertices in the .glb file instead.
+Options:
+    "--tolerance PIXELS" sets how far the box of the chosen vertices may be inside the box of the whole mesh on each side (1 by default)
+    "--frames N" sets how many frames of each file are used, evenly spaced (200 by default), and "--views N" sets how many random camera views each frame is seen from (8 by default)
+    "--width PIXELS", "--height PIXELS" and "--fov DEGREES" set the image size and vertical field of view of the cameras (1024, 1024 and 75 by default); the tolerance is in pixels of these images
+    "--holdout FRACTION" sets the fraction of the frames that are not used to choose the vertices but only to report the error on unseen poses (0.2 by default)
+    "--seed N" sets the seed of the random frame split and camera views (0 by default)
+    "--output PATH/TO/FILE" saves the vertices and the coverage report as a JSON file
+The report gives the error of the box of the chosen vertices on each side of the box in pixels, which can be covered with "padding" under [bounding_box].
+"""
+
+import sys, getopt, os, json, struct
+import numpy as np
+from lbs import project_points, get_bounding_boxes
+
+# the y axis is up in the frames of SKEL and OpenSim
+UP = np.array([0.0, 1.0, 0.0])
+# range of elevation angles of the cameras in degrees
+ELEVATION_RANGE = (-20, 45)
+# range of camera distances as multiples of the distance at which the mesh fills the image vertically
+DISTANCE_RANGE = (1.2, 4)
+# how far the cameras may aim from the center of the mesh, as a fraction of its radius
+AIM_JITTER = 0.3
+# how many images are searched for the vertices near the sides of their boxes at a time
+CHUNK_SIZE = 256
+# how many rows of the distance matrix are computed at a time when the .glb vertices are matched to the mesh
+MATCH_CHUNK_SIZE = 1024
+# how far in meters a vertex of a .glb file may be from the rig vertex it is matched to
+GLB_MATCH_TOLERANCE = 1e-4
+# the glTF component type of 32-bit floats
+GLTF_FLOAT = 5126
+
+
+# get the (n_views, 4, 4) ground-to-camera matrices (OpenCV convention) of random cameras that look at a mesh with the given center and radius
+def get_random_cameras(rng, n_views, center, radius, fov):
+    yaws = rng.uniform(0, 2*np.pi, n_views)
+    elevations = np.radians(rng.uniform(*ELEVATION_RANGE, n_views))
+    distances = radius / np.tan(np.radians(fov) / 2) * rng.uniform(*DISTANCE_RANGE, n_views)
+    targets = center + rng.uniform(-AIM_JITTER, AIM_JITTER, (n_views, 3)) * radius
+    directions = np.stack([np.cos(elevations)*np.sin(yaws), np.sin(elevations), np.cos(elevations)*np.cos(yaws)], axis=1)
+    positions = targets + distances[:,None] * directions
+    # x right, y down and z forward
+    forward = -directions
+    right = np.cross(forward, UP)
+    right /= np.linalg.norm(right, axis=1, keepdims=True)
+    down = np.cross(forward, right)
+    world_to_camera = np.zeros((n_views, 4, 4))
+    world_to_camera[:,:3,:3] = np.stack([right, down, forward], axis=1)
+    world_to_camera[:,:3,3] = -np.einsum('vij,vj->vi', world_to_camera[:,:3,:3], positions)
+    world_to_camera[:,3,3] = 1
+    return world_to_camera
+
+# get the intrinsic matrix of a camera with a vertical field of view in degrees
+def get_intrinsics(width, height, fov):
+    focal = height / 2 / np.tan(np.radians(fov) / 2)
+    return np.array([[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]])
+
+# project the frames of a file from random camera views; returns (n_frames, n_views, n_verts, 2) pixels
+def project_frames(vertices, rng, n_views, intrinsics, fov):
+    pixels = np.zeros((len(vertices), n_views, vertices.shape[1], 2), dtype=np.float32)
+    for i, frame in enumerate(vertices):
+        lower, upper = frame.min(axis=0), frame.max(axis=0)
+        pixels[i] = project_points(frame, intrinsics, get_random_cameras(rng, n_views, (lower + upper) / 2, np.linalg.norm(upper - lower) / 2, fov))
+    return pixels
+
+# find which vertices can stand in for each side of the box of each image: x min, y min, x max and y max, in this order; returns the side indices and vertex indices of all pairs
+def get_candidates(pixels, tolerance):
+    all_sides, all_vertices = [], []
+    for start in range(0, len(pixels), CHUNK_SIZE):
+        chunk = pixels[start:start+CHUNK_SIZE]
+        # (n_images, n_verts, 4) distances of the vertices inside the box from each side
+        distances = np.concatenate([chunk - chunk.min(axis=1, keepdims=True), chunk.max(axis=1, keepdims=True) - chunk], axis=2)
+        sides, vertices = np.nonzero((distances <= tolerance).transpose(0, 2, 1).reshape(-1, chunk.shape[1]))
+        all_sides.append(sides + 4*start)
+        all_vertices.append(vertices)
+    return np.concatenate(all_sides), np.concatenate(all_vertices)
+
+# choose a small set of vertices that covers all sides greedily: always take the vertex that covers the most sides that are not yet covered, and then drop the vertices that the others make redundant
+def choose_vertices(sides, vertices, n_sides, n_verts):
+    covered = np.zeros(n_sides, dtype=bool)
+    chosen = []
+    while not covered.all():
+        counts = np.bincount(vertices[~covered[sides]], minlength=n_verts)
+        # sides that no vertex is near, e.g., of images where the mesh has NaN pixels, can never be covered
+        if counts.max() == 0:
+            print('Warning:', int((~covered).sum()), 'sides of boxes cannot be covered by any vertex and are left out')
+            break
+        best = int(np.argmax(counts))
+        chosen.append(best)
+        covered[sides[vertices == best]] = True
+    # a vertex is redundant if every side it covers is covered by another chosen vertex
+    n_covers = np.zeros(n_sides, dtype=np.int32)
+    for vertex in chosen:
+        n_covers[sides[vertices == vertex]] += 1
+    for vertex in reversed(list(chosen)):
+        vertex_sides = sides[vertices == vertex]
+        if np.all(n_covers[vertex_sides] > 1):
+            n_covers[vertex_sides] -= 1
+            chosen.remove(vertex)
+    return sorted(chosen)
+
+# measure how far inside the box of the whole mesh the box of the chosen vertices is on each side, in pixels
+def get_errors(pixels, chosen):
+    pixels = pixels.reshape(-1, pixels.shape[-2], 2)
+    full = get_bounding_boxes(pixels)
+    subset = get_bounding_boxes(pixels[:,chosen])
+    full_corners = np.concatenate([full[:,:2], full[:,:2] + full[:,2:]], axis=1)
+    subset_corners = np.concatenate([subset[:,:2], subset[:,:2] + subset[:,2:]], axis=1)
+    return np.abs(subset_corners - full_corners)
+
+# summarize the errors of the sides of the boxes
+def get_report(errors, tolerance):
+    if len(errors) == 0:
+        return None
+    return {'images': len(errors),
+            'mean_error': round(float(errors.mean()), 3),
+            'p99_error': round(float(np.percentile(errors, 99)), 3),
+            'max_error': round(float(errors.max()), 3),
+            'sides_within_tolerance': round(float((errors <= tolerance).mean()), 5),
+            'boxes_within_tolerance': round(float((errors <= tolerance).all(axis=1).mean()), 5)}
+
+# get the 4x4 matrix of a glTF node from its column-major matrix or from its translation, rotation (quaternion x, y, z, w) and scale
+def get_node_matrix(node):
+    if 'matrix' in node:
+        return np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+    x, y, z, w = node.get('rotation', [0, 0, 0, 1])
+    rotation = np.array([[1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+                         [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+                         [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)]])
+    matrix = np.eye(4)
+    matrix[:3,:3] = rotation * np.array(node.get('scale', [1, 1, 1]))
+    matrix[:3,3] = node.get('translation', [0, 0, 0])
+    return matrix
+
+# get the matrix from the frame of a mesh to the frame of the scene by multiplying the matrices of the first node that uses the mesh and of its parents
+def get_mesh_matrix(gltf, mesh):
+    nodes = gltf.get('nodes', [])
+    parents = {child: i for i, node in enumerate(nodes) for child in node.get('children', [])}
+    node = next((i for i, node in enumerate(nodes) if node.get('mesh') == mesh), None)
+    matrix = np.eye(4)
+    while node is not None:
+        matrix = get_node_matrix(nodes[node]) @ matrix
+        node = parents.get(node)
+    return matrix
+
+# read the POSITION attribute of the first mesh of a .glb file; the positions are in the frame of the mesh node, so they are transformed to the frame of the scene
+def read_glb_positions(path_glb):
+    with open(path_glb, 'rb') as f:
+        data = f.read()
+    # a 12-byte header, then a JSON chunk and a binary chunk, each with its length and type first
+    json_length = struct.unpack_from('<I', data, 12)[0]
+    gltf = json.loads(data[20:20+json_length])
+    binary = data[28+json_length:]
+    accessor = gltf['accessors'][gltf['meshes'][0]['primitives'][0]['attributes']['POSITION']]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    if accessor['componentType'] != GLTF_FLOAT or accessor['type'] != 'VEC3' or view.get('byteStride', 12) != 12:
+        raise ValueError('Unsupported vertex positions in ' + path_glb)
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    positions = np.frombuffer(binary, dtype=np.float32, count=3*accessor['count'], offset=offset).reshape(-1, 3)
+    matrix = get_mesh_matrix(gltf, 0)
+    return (positions @ matrix[:3,:3].T + matrix[:3,3]).astype(np.float32)
+
+# map each vertex of the rigged mesh to the first vertex of the .glb file at the same position; the glTF export splits vertices on UV seams, so one vertex can have several copies, which all move together
+def get_glb_indices(path_glb):
+    rig = np.load(os.path.splitext(path_glb)[0] + '_rig.npz')
+    # the rest vertices are in the world frame of Blender, and the glTF export turns its z-up frame into the y-up frame of the scene
+    rest = rig['rest_vertices'][:,[0, 2, 1]] * np.array([1, 1, -1], dtype=np.float32)
+    positions = read_glb_positions(path_glb)
+    nearest = np.zeros(len(positions), dtype=np.int64)
+    distances = np.zeros(len(positions), dtype=np.float32)
+    for start in range(0, len(positions), MATCH_CHUNK_SIZE):
+        chunk = positions[start:start+MATCH_CHUNK_SIZE]
+        squared = ((chunk[:,None] - rest[None])**2).sum(axis=2)
+        nearest[start:start+len(chunk)] = np.argmin(squared, axis=1)
+        distances[start:start+len(chunk)] = np.sqrt(squared.min(axis=1))
+    # every .glb vertex is a copy of a rig vertex, so a larger distance means that the frames of the files do not match and the indices would be wrong
+    if len(distances) > 0 and distances.max() > GLB_MATCH_TOLERANCE:
+        raise ValueError('The vertices of ' + path_glb + ' are up to ' + str(float(distances.max())) + ' m from the vertices of its rig, so they cannot be matched')
+    indices = np.full(len(rest), -1, dtype=np.int64)
+    # the first copy of each vertex is the one with the lowest index
+    order = np.argsort(nearest, kind='stable')
+    first = np.unique(nearest[order], return_index=True)
+    indices[first[0]] = order[first[1]]
+    if (indices < 0).any():
+        raise ValueError(str(int((indices < 0).sum())) + ' vertices of the rig have no copy in ' + path_glb)
+    return indices
+
+# globals
+paths_vertices = None
+path_glb = None
+path_output = None
+tolerance = 1.0
+n_frames = 200
+n_views = 8
+width = 1024
+height = 1024
+fov = 75.0
+holdout = 0.2
+seed = 0
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global paths_vertices, path_glb, path_output, tolerance, n_frames, n_views, width, height, fov, holdout, seed
+
+    argument_list = sys.argv[1:]
+    # o for output
+    opts_short = "o:"
+    opts_long = ["vertices=", "glb=", "output=", "tolerance=", "frames=", "views=", "width=", "height=", "fov=", "holdout=", "seed="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg == "--vertices":
+                paths_vertices = current_val.split(',')
+            elif current_arg == "--glb":
+                path_glb = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--tolerance":
+                tolerance = float(current_val)
+            elif current_arg == "--frames":
+                n_frames = int(current_val)
+            elif current_arg == "--views":
+                n_views = int(current_val)
+            elif current_arg == "--width":
+                width = int(current_val)
+            elif current_arg == "--height":
+                height = int(current_val)
+            elif current_arg == "--fov":
+                fov = float(current_val)
+            elif current_arg == "--holdout":
+                holdout = float(current_val)
+            elif current_arg == "--seed":
+                seed = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    parse_arguments()
+
+    if paths_vertices is None:
+        print('Specify the posed vertices with --vertices path/to/file.npy,path/to/file.npy,...')
+        return
+
+    rng = np.random.default_rng(seed)
+    intrinsics = get_intrinsics(width, height, fov)
+    pixels_train, pixels_holdout = [], []
+    for path in paths_vertices:
+        vertices = np.load(path, mmap_mode='r')
+        frames = np.unique(np.linspace(0, len(vertices) - 1, min(n_frames, len(vertices))).round().astype(int))
+        is_holdout = rng.random(len(frames)) < holdout
+        # fancy indexing reads only the chosen frames from the memory-mapped file
+        pixels = project_frames(np.asarray(vertices[frames], dtype=np.float32), rng, n_views, intrinsics, fov)
+        pixels_train.append(pixels[~is_holdout].reshape(-1, vertices.shape[1], 2))
+        pixels_holdout.append(pixels[is_holdout].reshape(-1, vertices.shape[1], 2))
+    pixels_train = np.concatenate(pixels_train)
+    pixels_holdout = np.concatenate(pixels_holdout)
+    n_verts = pixels_train.shape[1]
+    print('Choosing vertices from', len(pixels_train), 'images, with', len(pixels_holdout), 'images held out')
+
+    sides, vertices = get_candidates(pixels_train, tolerance)
+    chosen = choose_vertices(sides, vertices, 4*len(pixels_train), n_verts)
+    report = {'vertices': chosen, 'tolerance': tolerance, 'frames': n_frames, 'views': n_views, 'width': width, 'height': height, 'fov': fov, 'seed': seed, 'files': paths_vertices,
+              'train': get_report(get_errors(pixels_train, chosen), tolerance),
+              'holdout': get_report(get_errors(pixels_holdout, chosen), tolerance)}
+    print('Chose', len(chosen), 'of', n_verts, 'vertices')
+    for split in ('train', 'holdout'):
+        if report[split] is not None:
+            print(split + ':', ', '.join(key + ' ' + str(value) for key, value in report[split].items()))
+
+    if path_glb is not None:
+        glb_indices = get_glb_indices(path_glb)
+        if len(glb_indices) != n_verts:
+            print('The rig of', path_glb, 'has', len(glb_indices), 'vertices, but the posed meshes have', n_verts)
+            return
+        report['glb'] = path_glb
+        report['glb_vertices'] = glb_indices[chosen].tolist()
+        print('Indices of the vertices in', path_glb + ':')
+        print('vertices=' + str(report['glb_vertices']))
+    else:
+        print('Indices of the vertices in the SKEL/SMPL mesh (use --glb to get the indices in Godot):')
+        print('vertices=' + str(chosen))
+
+    if path_output is not None:
+        with open(path_output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Saved the vertices and the report to', path_output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+This Python script packs a dataset generated by Godosim into shards (see shards.py), so that data loaders read a few large files instead of hundreds of thousands of small image files.
+Each sample holds the RGB image, the silhouette and segment masks if their folders are given, and the keypoints and bounding box of its row in the annotations as JSON.
+Basic usage: "python pack_shards.py --path PATH/TO/ROOT/FOLDER --silhouettes PATH/TO/SILHOUETTE/MASKS --segments PATH/TO/SEGMENT/MASKS"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim. The mask folders are the folders set with path_output_images_silhouette_masks and path_output_images_segment_masks in the config file; either one or both can be left out.
+The masks are expected to have the same file names as the RGB images; use "--extension" to set their file extension (".png" by default).
+The shards are saved to the folder "shards" in the root folder, unless another folder is given with "--output PATH/TO/FOLDER". Use the shard folder with "--shards PATH/TO/SHARDS" in annotation_viewer.py and render_overlays.py instead of the root folder, and in place of the mask folders given with "--silhouettes" and "--segments" in encode_masks.py and fit_boxes.py.
+Other options:
+    "--shard-mb MB" sets the size at which a new shard is started (1024 by default); samples are never split between shards
+    "--threads N" sets how many threads read the image files ahead of the writer (8 by default), which helps on network storage
+The tar files are plain WebDataset shards, so they can also be streamed with the webdataset package or unpacked with tar.
+"""
+
+import sys, getopt, os, json, io, tarfile, shutil
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from keypoint_store import load_keypoint_store, get_cache_path
+from masks import get_mask_path
+from shards import FIELD_EXTENSIONS, SHARDS_VERSION, get_shard_path, get_shard_store_path, get_sample_annotation
+
+# how many samples are read ahead by the threads at a time
+CHUNK_SIZE = 256
+# tar files are written in blocks of this many bytes
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+# read the files of a sample, with masks of the given file extension; returns the bytes of each field, or None if a mask file is missing
+def read_sample(store, idx, paths, extension):
+    file_name = str(store.file_names[idx])
+    files = {}
+    for field, path in paths.items():
+        if field == 'annotation':
+            files[field] = json.dumps(get_sample_annotation(store, idx)).encode()
+        else:
+            path = Path(path) / (file_name + FIELD_EXTENSIONS['image']) if field == 'image' else get_mask_path(path, file_name, extension)
+            try:
+                files[field] = path.read_bytes()
+            except FileNotFoundError:
+                if field == 'image':
+                    raise
+                files[field] = None
+    return files
+
+# add a file to a tar file; returns the offset of its data in the tar file
+def add_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+    # the data ends at the current offset, padded to whole blocks, and the header before it can take several blocks for long names
+    return tar.offset - -(-len(data) // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+# write all samples into shards of about shard_bytes bytes each and fill the global index; n_threads threads read the files of the samples ahead of the writer
+def pack_shards(store, paths, path_shards, extension, shard_bytes, n_threads):
+    fields = list(paths)
+    extensions = [FIELD_EXTENSIONS[field] + (extension if field in ('silhouette', 'segments') else '') for field in fields]
+    n_samples = len(store)
+    index_shards = np.lib.format.open_memmap(Path(path_shards) / 'index_shards.npy', mode='w+', dtype=np.int32, shape=(n_samples,))
+    index_offsets = np.lib.format.open_memmap(Path(path_shards) / 'index_offsets.npy', mode='w+', dtype=np.int64, shape=(n_samples, len(fields)))
+    index_sizes = np.lib.format.open_memmap(Path(path_shards) / 'index_sizes.npy', mode='w+', dtype=np.int64, shape=(n_samples, len(fields)))
+    n_missing = 0
+
+    shard = 0
+    tar = tarfile.open(get_shard_path(path_shards, shard), 'w', format=tarfile.GNU_FORMAT)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for start in range(0, n_samples, CHUNK_SIZE):
+            rows = range(start, min(start + CHUNK_SIZE, n_samples))
+            # map returns the samples in order while the threads read the following ones
+            for idx, files in zip(rows, executor.map(lambda idx: read_sample(store, idx, paths, extension), rows)):
+                if tar.offset >= shard_bytes:
+                    tar.close()
+                    shard += 1
+                    tar = tarfile.open(get_shard_path(path_shards, shard), 'w', format=tarfile.GNU_FORMAT)
+                index_shards[idx] = shard
+                for column, (field, file_extension) in enumerate(zip(fields, extensions)):
+                    data = files[field]
+                    if data is None:
+                        index_offsets[idx, column] = 0
+                        index_sizes[idx, column] = -1
+                        n_missing += 1
+                        continue
+                    index_offsets[idx, column] = add_file(tar, str(store.file_names[idx]) + file_extension, data)
+                    index_sizes[idx, column] = len(data)
+            print('Packed', rows.stop, '/', n_samples, 'samples into', shard + 1, 'shards')
+    tar.close()
+
+    for array in (index_shards, index_offsets, index_sizes):
+        array.flush()
+    if n_missing > 0:
+        print('Missing masks:', n_missing)
+    return fields, extensions, shard + 1
+
+# globals
+path_root = None
+path_output = None
+path_silhouettes = None
+path_segments = None
+extension = '.png'
+shard_bytes = 1024*2**20
+n_threads = 8
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, path_silhouettes, path_segments, extension, shard_bytes, n_threads
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "silhouettes=", "segments=", "extension=", "shard-mb=", "threads="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--silhouettes":
+                path_silhouettes = current_val
+            elif current_arg == "--segments":
+                path_segments = current_val
+            elif current_arg == "--extension":
+                extension = current_val
+            elif current_arg == "--shard-mb":
+                shard_bytes = int(float(current_val)*2**20)
+            elif current_arg == "--threads":
+                n_threads = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    if path_output is None:
+        path_output = Path(path_root) / 'shards'
+    os.makedirs(path_output, exist_ok=True)
+    # remove the info file first so that partially written shards are never considered complete
+    (Path(path_output) / 'shards.json').unlink(missing_ok=True)
+    for path in Path(path_output).glob('shard_*.tar'):
+        path.unlink()
+
+    paths = {'image': Path(path_root) / 'images'}
+    if path_silhouettes is not None:
+        paths['silhouette'] = path_silhouettes
+    if path_segments is not None:
+        paths['segments'] = path_segments
+    paths['annotation'] = None
+    fields, extensions, n_shards = pack_shards(store, paths, path_output, extension, shard_bytes, n_threads)
+
+    # the annotations are copied as a keypoint store, which the readers memory-map
+    shutil.copytree(get_cache_path(path_csv), get_shard_store_path(path_output), dirs_exist_ok=True)
+    # the info file is written last and marks the shards as complete
+    with open(Path(path_output) / 'shards.json', 'w') as f:
+        json.dump({'version': SHARDS_VERSION, 'n_samples': len(store), 'n_shards': n_shards, 'fields': fields, 'extensions': extensions}, f, indent=1)
+    print('Saved', len(store), 'samples in', n_shards, 'shards to', path_output)
+
+if __name__ == '__main__':
+    main()
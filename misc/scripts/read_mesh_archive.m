@@ -0,0 +1,71 @@
+function archive = read_mesh_archive(path_archive)
+% reads a binary archive saved by generate_meshes.py with "--format archive" (see mesh_archive.py) into a struct with one field per array
+% e.g., archive = read_mesh_archive('mesh_male_zero.npz'); joint_translations = archive.joints;
+% arrays keep their types (e.g., single for vertices) and shapes, and arrays of names are returned as cell arrays of char
+
+% the archive is a zip file of .npy files, so we unzip it to a temporary folder and read each file
+path_temp = tempname;
+files = unzip(path_archive, path_temp);
+archive = struct;
+for i = 1:numel(files)
+    [~, name, ~] = fileparts(files{i});
+    archive.(name) = read_npy(files{i});
+end
+rmdir(path_temp, 's');
+
+end
+
+
+% reads a single .npy file
+function data = read_npy(path_npy)
+
+fid = fopen(path_npy, 'r', 'l');
+% the file begins with a magic string and the format version, after which the length of the header follows
+fread(fid, 6, 'uint8');
+version = fread(fid, 2, 'uint8');
+if version(1) == 1
+    header_length = fread(fid, 1, 'uint16');
+else
+    header_length = fread(fid, 1, 'uint32');
+end
+% the header is a Python dict literal such as {'descr': '<f4', 'fortran_order': False, 'shape': (6890, 3), }
+header = fread(fid, header_length, 'uint8=>char')';
+descr = regexp(header, '''descr'':\s*''([^'']*)''', 'tokens', 'once');
+descr = descr{1};
+fortran_order = contains(header, '''fortran_order'': True');
+shape = regexp(header, '''shape'':\s*\(([^\)]*)\)', 'tokens', 'once');
+shape = sscanf(shape{1}, '%d,')';
+n = prod(shape);
+
+if descr(2) == 'U'
+    % unicode strings are stored as fixed-length UTF-32 code points padded with zeros
+    n_chars = str2double(descr(3:end));
+    codes = fread(fid, [n_chars, n], 'uint32=>uint32');
+    data = cell(n, 1);
+    for k = 1:n
+        c = codes(:, k);
+        data{k} = char(c(c > 0)');
+    end
+    if isempty(shape)
+        data = data{1};
+    end
+else
+    types = containers.Map({'f4', 'f8', 'i1', 'i2', 'i4', 'i8', 'u1', 'u2', 'u4', 'u8', 'b1'}, ...
+        {'single', 'double', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'uint8'});
+    precision = types(descr(2:end));
+    data = fread(fid, n, [precision '=>' precision]);
+    if strcmp(descr(2:end), 'b1')
+        data = logical(data);
+    end
+    % MATLAB is column-major, so arrays in C order are read with reversed dimensions and then permuted
+    if numel(shape) > 1
+        if fortran_order
+            data = reshape(data, shape);
+        else
+            data = permute(reshape(data, fliplr(shape)), numel(shape):-1:1);
+        end
+    end
+end
+fclose(fid);
+
+end
@@ -0,0 +1,214 @@
+"""
+This Python script renders generated images with their annotations overlaid and saves them to files, without opening any windows.
+It is meant for checking large numbers of generated images at once; use annotation_viewer.py to browse images interactively.
+Basic usage: "python render_overlays.py --path PATH/TO/ROOT/FOLDER"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim.
+Like in annotation_viewer.py, add flags like "--bodies", "--joints", "--markers" (or "-b", "-j", "-m") to choose which annotations are drawn. The bounding box is always drawn.
+Other options:
+    "--first N" and "--last M" select the range of rows (inclusive) in the annotations that are rendered; by default, all rows are rendered
+    "--output PATH/TO/FOLDER" sets where the overlays are saved; by default, they are saved to the folder "overlays" in the root folder
+    "--processes N" sets the number of worker processes; by default, all CPU cores are used
+    "--shards PATH/TO/SHARDS" reads the images and annotations from a dataset packed with pack_shards.py instead of the root folder; the overlays are then saved to the folder "overlays" next to the shard folder by default
+    "--montage N" additionally saves contact sheets with N rows and N columns of downscaled overlays, and "--thumb PX" sets the size of each downscaled overlay (256 by default)
+"""
+
+import sys, getopt, os
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+# the Agg backend renders without a display, so the script also works on servers
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imread
+from matplotlib.patches import Rectangle
+from PIL import Image
+from keypoint_store import load_keypoint_store, open_keypoint_store, get_cache_path
+from annotation_plotting import BOX_COLOR, add_keypoint_collection, update_keypoint_collection
+from shards import open_shards, get_shard_store_path
+
+# at most this many rows are rendered by a worker at a time, which bounds the downscaled overlays that a range returns for contact sheets
+MAX_RANGE_SIZE = 1024
+# how many ranges per worker are submitted ahead of the one whose results are being saved
+RANGES_IN_FLIGHT = 2
+
+# the store and the shards are opened once in each worker process; they are memory-mapped, so opening them is cheap
+worker_store = None
+worker_shards = None
+
+def init_worker(cache_path, path_shards=None):
+    global worker_store, worker_shards
+    worker_store = open_keypoint_store(cache_path)
+    if path_shards is not None:
+        worker_shards = open_shards(path_shards)
+
+# create a figure whose pixels match the image resolution and the persistent artists that are updated for each image
+def prepare_figure(height, width, groups):
+    dpi = 100
+    fig = Figure(figsize=(width/dpi, height/dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.axis('off')
+    artists = {}
+    artists['image'] = ax.imshow(np.zeros((height, width, 3), dtype=np.uint8))
+    artists['title'] = ax.text(5, 5, '', color='w', backgroundcolor='k', ha='left', va='top')
+    for group in groups:
+        artists[group] = add_keypoint_collection(ax, group)
+    artists['box'] = ax.add_patch(Rectangle(xy=(0,0), width=0, height=0, facecolor='none', edgecolor=BOX_COLOR, linestyle='-', linewidth=2))
+    return canvas, artists
+
+# draw the overlay of one image and return it as an RGB array
+def render_overlay(canvas, artists, store, idx, img, groups, radius=10):
+    artists['image'].set_data(img)
+    artists['title'].set_text(store.file_names[idx])
+    for group in groups:
+        update_keypoint_collection(artists[group], store.keypoints[group][idx], radius)
+    x,y,w,h = store.boxes[idx]
+    artists['box'].set_bounds(x, y, w, h)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:,:,:3].copy()
+
+# render the overlays of a range of rows in a worker process; returns downscaled overlays if they are needed for contact sheets
+def render_range(first, last, path_root, path_output, groups, thumb_size):
+    canvas = None
+    shape = None
+    thumbs = []
+    for idx in range(first, last):
+        file_name = str(worker_store.file_names[idx])
+        img = worker_shards.load_image(idx) if worker_shards is not None else imread(Path(path_root) / 'images' / (file_name + '.jpg'))
+        # the figure is only created again if the image resolution changes
+        if img.shape[:2] != shape:
+            shape = img.shape[:2]
+            canvas, artists = prepare_figure(shape[0], shape[1], groups)
+        overlay = Image.fromarray(render_overlay(canvas, artists, worker_store, idx, img, groups))
+        overlay.save(Path(path_output) / (file_name + '.png'))
+        if thumb_size is not None:
+            overlay.thumbnail((thumb_size, thumb_size))
+            thumbs.append(np.asarray(overlay))
+    return first, thumbs
+
+# arrange downscaled overlays into a grid on a black background
+def make_montage(thumbs, n_grid, thumb_size):
+    sheet = np.zeros((n_grid*thumb_size, n_grid*thumb_size, 3), dtype=np.uint8)
+    for i, thumb in enumerate(thumbs):
+        row = i // n_grid
+        col = i % n_grid
+        sheet[row*thumb_size:row*thumb_size+thumb.shape[0], col*thumb_size:col*thumb_size+thumb.shape[1]] = thumb
+    return sheet
+
+# globals
+path_root = None
+path_shards = None
+path_output = None
+display_bodies = False
+display_joints = False
+display_markers = False
+first = 0
+last = None
+n_processes = None
+n_montage = None
+thumb_size = 256
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_shards, path_output, display_bodies, display_joints, display_markers, first, last, n_processes, n_montage, thumb_size
+
+    argument_list = sys.argv[1:]
+    # b for bodies, j for joints, m for markers, p for path, o for output
+    opts_short = "bjmp:o:"
+    opts_long = ["bodies", "joints", "markers", "path=", "shards=", "output=", "first=", "last=", "processes=", "montage=", "thumb="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-b", "--bodies"):
+                display_bodies = True
+            elif current_arg in ("-j", "--joints"):
+                display_joints = True
+            elif current_arg in ("-m", "--markers"):
+                display_markers = True
+            elif current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg == "--shards":
+                path_shards = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--first":
+                first = int(current_val)
+            elif current_arg == "--last":
+                last = int(current_val)
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+            elif current_arg == "--montage":
+                n_montage = int(current_val)
+            elif current_arg == "--thumb":
+                thumb_size = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output, last
+
+    parse_arguments()
+
+    if path_root is None and path_shards is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder or the folder of packed shards with --shards path/to/folder')
+        return
+
+    if path_shards is not None:
+        cache_path = get_shard_store_path(path_shards)
+        store = open_keypoint_store(cache_path)
+    else:
+        # loading the store once in the main process makes sure that the cache exists before the workers memory-map it
+        path_csv = Path(path_root) / 'annotations/annotations.csv'
+        store = load_keypoint_store(path_csv)
+        cache_path = get_cache_path(path_csv)
+
+    if path_output is None:
+        path_output = (Path(path_shards).parent if path_shards is not None else Path(path_root)) / 'overlays'
+    os.makedirs(path_output, exist_ok=True)
+
+    last = len(store)-1 if last is None else min(last, len(store)-1)
+    if last < first:
+        print('No rows to render')
+        return
+    groups = [group for group, enabled in [('joints', display_joints), ('bodies', display_bodies), ('markers', display_markers)] if enabled]
+
+    # split the rows into ranges so that each worker gets several ranges and the load stays balanced; with contact sheets, each range fills whole sheets
+    n_workers = n_processes if n_processes is not None else os.cpu_count()
+    n_rows = last - first + 1
+    range_size = min(max(1, -(-n_rows // (4*n_workers))), MAX_RANGE_SIZE)
+    if n_montage is not None:
+        per_sheet = n_montage*n_montage
+        range_size = -(-range_size // per_sheet)*per_sheet
+    ranges = [(start, min(start + range_size, last + 1)) for start in range(first, last + 1, range_size)]
+
+    print('Rendering', n_rows, 'overlays to', path_output, 'with', n_workers, 'processes')
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(cache_path, path_shards)) as executor:
+        # only a few ranges per worker are in flight at a time and each is dropped once its sheets are saved, so the thumbnails in memory do not grow with the dataset
+        futures = deque()
+        next_range = 0
+        while next_range < len(ranges) or len(futures) > 0:
+            while next_range < len(ranges) and len(futures) < RANGES_IN_FLIGHT*n_workers:
+                start, end = ranges[next_range]
+                futures.append((end, executor.submit(render_range, start, end, path_root, path_output, groups, thumb_size if n_montage is not None else None)))
+                next_range += 1
+            end, future = futures.popleft()
+            start, thumbs = future.result()
+            del future
+            n_done += end - start
+            print('Rendered', n_done, '/', n_rows)
+            if n_montage is not None:
+                for i in range(0, len(thumbs), per_sheet):
+                    sheet_idx = (start - first + i) // per_sheet
+                    sheet = make_montage(thumbs[i:i+per_sheet], n_montage, thumb_size)
+                    Image.fromarray(sheet).save(Path(path_output) / ('montage_' + str(sheet_idx).zfill(5) + '.png'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+This Python module records which inputs each "human_<variant>.glb" file rigged by Blender_skin_and_rig.py was built from, so that only the morphologies whose inputs have changed are rigged again.
+The manifest of "human_<variant>.glb" is saved next to it as "human_<variant>.manifest.json" and holds the SHA-1 hashes of the files that rigging the morphology read, by role, and the rig settings.
+The files are the hierarchy, bone endpoints, bone rotations and generalized coordinates from MATLAB, the skin mesh (the archive "mesh_<variant>.npz", or the OBJ file with the bone names and joint translations), the SMPL UV map, the saved weights of the reference morphology if they are reused, and Blender_skin_and_rig.py itself, whose settings (e.g., the deforming bones) are then covered too.
+It does not use Blender, so it can also be used by rig_morphologies.py.
+Basic usage:
+    inputs = get_rig_inputs(variant, path_matlab_outputs, path_skel_outputs, path_smpl_uv)
+    hashes = hash_inputs(inputs)
+    if not is_up_to_date(path_glb, hashes): ... rig and export the morphology ..., then write_manifest(path_glb, variant, hashes, settings)
+"""
+
+import os, json, hashlib
+
+# the Blender script that rigs the morphologies, which is one of the inputs of each morphology
+RIG_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Blender_skin_and_rig.py')
+# how many bytes of a file are hashed at a time
+BLOCK_SIZE = 1 << 20
+
+
+# hash the contents of a file
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# get the files that rigging a morphology reads, by role; this follows the choices that Blender_skin_and_rig.py makes, e.g., it reads the mesh archive instead of the OBJ file if there is one
+def get_rig_inputs(variant, path_matlab_outputs, path_skel_outputs, path_smpl_uv, reference_variant=None):
+    inputs = {'hierarchy': os.path.join(path_matlab_outputs, 'hierarchy.json'),
+              'bone_endpoints': os.path.join(path_matlab_outputs, 'bone_endpoints_' + variant + '.json'),
+              'bone_rotations': os.path.join(path_matlab_outputs, 'bone_rotations_' + variant + '.json'),
+              'generalized_coordinates': os.path.join(path_matlab_outputs, 'generalized_coordinates_' + variant + '.json')}
+    path_archive = os.path.join(path_skel_outputs, 'mesh_' + variant + '.npz')
+    if os.path.exists(path_archive):
+        inputs['skin_mesh'] = path_archive
+    else:
+        inputs['skin_mesh'] = os.path.join(path_skel_outputs, 'skin_mesh_' + variant + '.obj')
+        inputs['bone_names'] = os.path.join(path_skel_outputs, 'bone_names.txt')
+        inputs['joint_translations'] = os.path.join(path_skel_outputs, 'joint_translations_' + variant + '.txt')
+    inputs['smpl_uv'] = path_smpl_uv
+    if reference_variant is not None and variant != reference_variant:
+        path_weights = os.path.join(path_skel_outputs, 'skinning_weights_' + reference_variant + '.npz')
+        if os.path.exists(path_weights):
+            inputs['reference_weights'] = path_weights
+    inputs['script'] = RIG_SCRIPT
+    return inputs
+
+# hash the input files by role; missing files get None
+def hash_inputs(inputs):
+    return {role: hash_file(path) if os.path.exists(path) else None for role, path in inputs.items()}
+
+# get the path of the manifest of a rigged .glb file
+def get_manifest_path(path_glb):
+    return os.path.splitext(path_glb)[0] + '.manifest.json'
+
+# check whether a rigged .glb file exists and was built from inputs with the same hashes and, if given, with the same settings
+def is_up_to_date(path_glb, hashes, settings=None):
+    path_manifest = get_manifest_path(path_glb)
+    if None in hashes.values() or not os.path.exists(path_glb) or not os.path.exists(path_manifest):
+        return False
+    with open(path_manifest, 'r') as f:
+        manifest = json.load(f)
+    if settings is not None and manifest.get('settings') != settings:
+        return False
+    return manifest.get('inputs') == hashes
+
+# write the manifest of a rigged .glb file after it has been exported; the file is replaced in one step so that it is never left half-written
+def write_manifest(path_glb, variant, hashes, settings):
+    path_manifest = get_manifest_path(path_glb)
+    with open(path_manifest + '.tmp', 'w') as f:
+        json.dump({'variant': variant, 'inputs': hashes, 'settings': settings}, f, indent=1)
+    os.replace(path_manifest + '.tmp', path_manifest)
@@ -0,0 +1,161 @@
+"""
+This Python script rigs many SKEL body morphologies in parallel by running Blender_skin_and_rig.py in several headless Blender instances at once.
+Basic usage: "python rig_morphologies.py --matlab-outputs PATH/TO/FOLDER --skel-outputs PATH/TO/FOLDER --smpl-uv PATH/TO/FILE --output PATH/TO/FOLDER"
+By default, all morphologies that have a bone_endpoints_<variant>.json file in the MATLAB outputs folder are rigged; use "--variants A,B,..." to rig only some of them.
+Options:
+    "--workers N" sets how many Blender instances run at once (all CPU cores by default); the cores are split between them
+    "--chunk N" sets how many morphologies each Blender instance rigs one after the other (1 by default), which saves Blender startups when there are many morphologies
+    "--blender PATH/TO/BLENDER" sets the Blender executable ("blender" by default)
+    "--reference VARIANT" rigs this morphology first and reuses its skinning weights for all others (see reference_variant in Blender_skin_and_rig.py)
+    "--logs PATH/TO/FOLDER" sets the folder where the output of each Blender instance and a summary are saved ("rig_logs" by default)
+    "--force" rigs all morphologies; otherwise, morphologies whose .glb file was built from the same inputs are skipped (see rig_manifest.py), without even starting Blender for them if all paths are given
+The exit code is 1 if any Blender instance failed; their logs show why.
+"""
+
+import sys, getopt, os, json, time, subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from rig_manifest import RIG_SCRIPT, get_rig_inputs, hash_inputs, is_up_to_date
+
+
+# find the morphologies that have bone endpoints in the MATLAB outputs folder
+def find_variants(path_matlab_outputs):
+    return sorted(path.stem[len('bone_endpoints_'):] for path in Path(path_matlab_outputs).glob('bone_endpoints_*.json'))
+
+# keep the morphologies whose inputs have changed since their .glb file was rigged; the settings of the Blender script are covered by the hash of the script itself
+def get_outdated_variants(variants):
+    outdated = []
+    for variant in variants:
+        hashes = hash_inputs(get_rig_inputs(variant, path_matlab_outputs, path_skel_outputs, path_smpl_uv, reference_variant))
+        # the rig saved for lbs.py must exist too
+        if is_up_to_date(os.path.join(path_output, 'human_' + variant + '.glb'), hashes) and os.path.exists(os.path.join(path_output, 'human_' + variant + '_rig.npz')):
+            print('Skipping ' + variant + ', whose inputs have not changed')
+        else:
+            outdated.append(variant)
+    return outdated
+
+# get the Blender command line that rigs a list of morphologies
+def get_blender_command(variants, n_threads):
+    # Blender exits with code 0 even if the script fails unless --python-exit-code is given
+    command = [blender, '--background', '--threads', str(n_threads), '--python-exit-code', '1', '--python', RIG_SCRIPT, '--', '--variants', ','.join(variants)]
+    for option, value in [('--matlab-outputs', path_matlab_outputs), ('--skel-outputs', path_skel_outputs), ('--smpl-uv', path_smpl_uv), ('--output', path_output), ('--reference', reference_variant)]:
+        if value is not None:
+            command += [option, value]
+    if force:
+        command.append('--force')
+    return command
+
+# rig a list of morphologies in one Blender instance, writing its output to a log file; returns the exit code and the duration in seconds
+def run_worker(variants, n_threads, path_log):
+    start = time.time()
+    with open(path_log, 'w') as log:
+        exit_code = subprocess.run(get_blender_command(variants, n_threads), stdout=log, stderr=subprocess.STDOUT).returncode
+    print('Rigged' if exit_code == 0 else 'FAILED', ','.join(variants), 'in', round(time.time() - start, 1), 's, log:', path_log)
+    return exit_code, time.time() - start
+
+# run the workers with at most n_workers at once; returns one summary entry per worker
+def run_workers(chunks, n_workers, n_threads):
+    summary = []
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        paths_log = [Path(path_logs) / ('rig_' + chunk[0] + '.log') for chunk in chunks]
+        futures = [executor.submit(run_worker, chunk, n_threads, path_log) for chunk, path_log in zip(chunks, paths_log)]
+        for chunk, path_log, future in zip(chunks, paths_log, futures):
+            exit_code, duration = future.result()
+            summary.append({'variants': chunk, 'exit_code': exit_code, 'seconds': round(duration, 1), 'log': str(path_log)})
+    return summary
+
+# globals
+blender = 'blender'
+variants = None
+path_matlab_outputs = None
+path_skel_outputs = None
+path_smpl_uv = None
+path_output = None
+reference_variant = None
+path_logs = 'rig_logs'
+n_workers = None
+chunk_size = 1
+force = False
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global blender, variants, path_matlab_outputs, path_skel_outputs, path_smpl_uv, path_output, reference_variant, path_logs, n_workers, chunk_size, force
+
+    argument_list = sys.argv[1:]
+    # o for output
+    opts_short = "o:"
+    opts_long = ["blender=", "variants=", "matlab-outputs=", "skel-outputs=", "smpl-uv=", "output=", "reference=", "logs=", "workers=", "chunk=", "force"]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg == "--blender":
+                blender = current_val
+            elif current_arg == "--variants":
+                variants = current_val.split(',')
+            elif current_arg == "--matlab-outputs":
+                path_matlab_outputs = current_val
+            elif current_arg == "--skel-outputs":
+                path_skel_outputs = current_val
+            elif current_arg == "--smpl-uv":
+                path_smpl_uv = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--reference":
+                reference_variant = current_val
+            elif current_arg == "--logs":
+                path_logs = current_val
+            elif current_arg == "--workers":
+                n_workers = int(current_val)
+            elif current_arg == "--chunk":
+                chunk_size = int(current_val)
+            elif current_arg == "--force":
+                force = True
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global variants
+
+    parse_arguments()
+
+    if variants is None:
+        if path_matlab_outputs is None:
+            print('Specify the morphologies with --variants A,B,... or the folder with their bone endpoints with --matlab-outputs path/to/folder')
+            return
+        variants = find_variants(path_matlab_outputs)
+    os.makedirs(path_logs, exist_ok=True)
+    workers = n_workers if n_workers is not None else os.cpu_count()
+    n_threads = max(1, os.cpu_count() // workers)
+    start = time.time()
+
+    summary = []
+    if reference_variant is not None:
+        # the reference is rigged on its own first, so that its weights are saved before the other workers need them
+        summary += run_workers([[reference_variant]], 1, os.cpu_count())
+        variants = [variant for variant in variants if variant != reference_variant]
+        if summary[0]['exit_code'] != 0:
+            print('Rigging the reference failed, so the other morphologies are not rigged')
+            variants = []
+    # the morphologies can only be checked here if all their input and output paths are known; otherwise Blender checks them
+    if not force and None not in (path_matlab_outputs, path_skel_outputs, path_smpl_uv, path_output):
+        variants = get_outdated_variants(variants)
+    chunks = [variants[i:i+chunk_size] for i in range(0, len(variants), chunk_size)]
+    print('Rigging', len(variants), 'morphologies in', len(chunks), 'Blender instances,', workers, 'at a time')
+    summary += run_workers(chunks, workers, n_threads)
+
+    n_failed = sum(entry['exit_code'] != 0 for entry in summary)
+    with open(Path(path_logs) / 'rig_summary.json', 'w') as f:
+        json.dump(summary, f, indent=1)
+    print('Rigged', len(summary) - n_failed, '/', len(summary), 'Blender instances successfully in', round(time.time() - start, 1), 's')
+    if n_failed > 0:
+        for entry in summary:
+            if entry['exit_code'] != 0:
+                print('Failed:', ','.join(entry['variants']), '(exit code ' + str(entry['exit_code']) + '), see', entry['log'])
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+This Python script selects a diverse subset of the images generated by Godosim and drops near-duplicates, such as the many similar frames of neighboring motion samples that the "poses" and "full" iteration modes generate.
+Basic usage: "python select_diverse_frames.py --path PATH/TO/ROOT/FOLDER --target N" or "python select_diverse_frames.py --path PATH/TO/ROOT/FOLDER --eps E"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim.
+Each row of the annotations is embedded by the positions of its keypoints relative to a root keypoint: the x and y offsets in pixels are divided by their root mean square, which removes the position and size of the person in the image, and the depth offsets are divided by a typical body size in meters, so that both are in similar units.
+The embeddings are reduced to a few principal components. Rows are then visited in a random order, and a row is kept only if no kept row is within the distance eps of it, so the kept rows cover all rows within eps and are at least eps apart. The kept rows are indexed with KD-trees (scipy.spatial.cKDTree), and each row only looks up its nearest kept row.
+With "--eps E", rows within E of a kept row are dropped. With "--target N", eps is first estimated from the distances of a sample of rows to their nearest neighbors and then adjusted by bisection so that about N rows are kept, and the kept rows are cut to N if there are more.
+Unlike the other scripts, this script needs scipy, which is not needed for anything else in this folder.
+Options:
+    "--groups A,B,..." sets the keypoint groups of the embedding ("joints,bodies" by default; the groups are "bodies", "joints" and "markers")
+    "--root NAME" sets the root keypoint ("pelvis" by default); if no keypoint of the groups has this name, the mean of the keypoints is used
+    "--depth-weight W" scales the depth offsets relative to the image offsets (1 by default; 0 ignores depth)
+    "--dims N" sets the number of principal components (16 by default)
+    "--seed N" sets the seed of the random order of the rows (0 by default)
+    "--output PATH/TO/FILE" sets the filtered CSV file ("annotations/annotations_diverse.csv" by default), and "--manifest PATH/TO/FILE" the image manifest, which lists the paths of the images of the kept rows relative to the root folder, one per line ("annotations/manifest_diverse.txt" by default)
+The embeddings are computed in chunks of rows from the memory-mapped keypoint store, and only the reduced embeddings and the trees of the kept rows are held in memory, so millions of rows can be processed.
+"""
+
+import sys, getopt
+from pathlib import Path
+import numpy as np
+from pandas import read_csv
+from scipy.spatial import cKDTree
+from keypoint_store import load_keypoint_store
+
+# how many rows are embedded at a time
+CHUNK_SIZE = 50000
+# how many rows are checked against the kept rows at a time
+QUERY_SIZE = 1024
+# how many rows of the CSV file are rewritten at a time
+CSV_CHUNK_SIZE = 50000
+# root mean square distance of the keypoints from the root in meters, which is roughly the same for all adults and makes depth offsets comparable to the normalized image offsets
+DEPTH_SCALE = 0.4
+# eps for a target is estimated from the neighbors of this many rows, counting at most this many neighbors
+EPS_SAMPLE_SIZE = 1000
+MAX_NEIGHBORS = 1000
+# the bisection stops when the number of kept rows is within this fraction of the target, or after this many steps
+TARGET_TOLERANCE = 0.01
+MAX_BISECTIONS = 30
+
+
+# get the names of the keypoints of the embedding, in the order of the groups, and the index of the root among them, or None if there is no root keypoint
+def select_keypoints(schema, groups, root):
+    names = [name for group in groups for name in schema[group]]
+    return names, names.index(root) if root in names else None
+
+# embed a range of rows by the root-relative positions of their keypoints; returns (n_rows, 3*n_keypoints) float32 features, with 0 for missing keypoints
+def embed_rows(store, groups, root_index, depth_weight, start, end):
+    points = np.concatenate([store.keypoints[group][start:end] for group in groups], axis=1).astype(np.float32)
+    with np.errstate(invalid='ignore'):
+        root = points[:,root_index] if root_index is not None else np.nanmean(points, axis=1)
+        offsets = points - root[:,None]
+        scale = np.sqrt(np.nanmean((offsets[...,:2]**2).sum(axis=2), axis=1))
+    scale = np.where(scale > 0, scale, 1)
+    offsets[...,:2] /= scale[:,None,None]
+    offsets[...,2] *= depth_weight / DEPTH_SCALE
+    return np.nan_to_num(offsets, nan=0.0, posinf=0.0, neginf=0.0).reshape(end-start, -1)
+
+# reduce the embeddings of all rows to their principal components in two passes over the store; returns (n_rows, dims) float32 components and the fraction of the variance that they explain
+def embed_store(store, groups, root_index, depth_weight, dims):
+    n_rows = len(store)
+    n_features = 3*sum(len(store.schema[group]) for group in groups)
+    # the mean and covariance are accumulated in float64 one chunk at a time
+    total = np.zeros(n_features)
+    products = np.zeros((n_features, n_features))
+    for start in range(0, n_rows, CHUNK_SIZE):
+        features = embed_rows(store, groups, root_index, depth_weight, start, min(start + CHUNK_SIZE, n_rows)).astype(np.float64)
+        total += features.sum(axis=0)
+        products += features.T @ features
+    mean = total / n_rows
+    covariance = products / n_rows - np.outer(mean, mean)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    # eigh sorts the eigenvalues in ascending order
+    dims = min(dims, n_features)
+    basis = eigenvectors[:,::-1][:,:dims].astype(np.float32)
+    explained = float(eigenvalues[::-1][:dims].sum() / max(eigenvalues.sum(), 1e-12))
+    components = np.zeros((n_rows, dims), dtype=np.float32)
+    for start in range(0, n_rows, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, n_rows)
+        components[start:end] = (embed_rows(store, groups, root_index, depth_weight, start, end) - mean.astype(np.float32)) @ basis
+    return components, explained
+
+# index a new batch of kept rows; the kept rows are split between KD-trees of decreasing size, and trees of no more rows than the new batch are merged into it like the digits of a binary counter, so each kept row is only indexed again a logarithmic number of times
+def add_kept_rows(trees, rows, components):
+    while len(trees) > 0 and len(trees[-1][0]) <= len(rows):
+        rows = np.concatenate([trees.pop()[0], rows])
+    trees.append((rows, cKDTree(components[rows])))
+
+# visit the rows in order and keep each row that is not within eps of a kept row; returns the kept rows in the order they were kept
+def prune(components, order, eps):
+    trees = []
+    kept = []
+    # the trees only return neighbors closer than the bound, and rows at exactly eps are dropped as well
+    bound = np.nextafter(eps, np.inf)
+    for start in range(0, len(order), QUERY_SIZE):
+        batch = order[start:start+QUERY_SIZE]
+        points = components[batch]
+        # only the nearest kept row of each row is queried, so the memory used does not depend on eps or on how many rows are near each other
+        free = np.ones(len(batch), dtype=bool)
+        for _, tree in trees:
+            candidates = np.flatnonzero(free)
+            if len(candidates) == 0:
+                break
+            distances, _ = tree.query(points[candidates], k=1, distance_upper_bound=bound, workers=-1)
+            free[candidates[np.isfinite(distances)]] = False
+        # the rows of the batch that are not near an earlier kept row are then resolved in order, since keeping a row drops the rows near it later in the batch
+        candidates = np.flatnonzero(free)
+        points = points[candidates]
+        removed = np.zeros(len(candidates), dtype=bool)
+        new = []
+        for i in range(len(candidates)):
+            if removed[i]:
+                continue
+            new.append(i)
+            removed[i+1:] |= ((points[i+1:] - points[i])**2).sum(axis=1) <= eps**2
+        if len(new) > 0:
+            rows = batch[candidates[new]]
+            kept.append(rows)
+            add_kept_rows(trees, rows, components)
+    return np.concatenate(kept) if len(kept) > 0 else np.zeros(0, dtype=np.int64)
+
+# estimate the eps that keeps about target rows: each kept row stands for about n_rows/target rows, so eps is about the median distance of a row to its (n_rows/target)-th nearest neighbor, which is measured on a sample of rows
+def estimate_eps(components, target, rng):
+    n_rows = len(components)
+    k = int(min(max(round(n_rows / target), 1), MAX_NEIGHBORS, n_rows - 1))
+    sample = rng.choice(n_rows, min(EPS_SAMPLE_SIZE, n_rows), replace=False)
+    distances, _ = cKDTree(components).query(components[sample], k=k+1, workers=-1)
+    # the nearest neighbor of each row is the row itself
+    distances = np.asarray(distances).reshape(len(sample), -1)[:,-1]
+    estimate = float(np.median(distances))
+    if estimate > 0:
+        return estimate
+    # most rows are exact duplicates, so the largest distance is used instead, or the diagonal of the bounding box of the components if all rows are duplicates
+    return float(distances.max()) or float(np.linalg.norm(components.max(axis=0) - components.min(axis=0))) / 2
+
+# find eps so that about target rows are kept, starting from an estimate that is doubled until too few rows are kept and then bisected; returns the kept rows, cut to the target, and eps
+def prune_to_target(components, order, target, rng):
+    if target >= len(components):
+        return order, 0.0
+    eps = estimate_eps(components, target, rng)
+    # the largest eps that keeps at least target rows, and the smallest eps that keeps fewer, if found
+    low = 0.0
+    high = None
+    best = order
+    best_eps = low
+    for step in range(MAX_BISECTIONS):
+        kept = prune(components, order, eps)
+        print('eps', round(eps, 5), 'keeps', len(kept), 'rows')
+        if len(kept) >= target:
+            best = kept
+            best_eps = eps
+            low = eps
+        else:
+            high = eps
+        if abs(len(kept) - target) <= TARGET_TOLERANCE*target:
+            break
+        eps = 2*eps if high is None else (low + high) / 2
+    # rows are kept in random order, so cutting the surplus keeps a random part of an eps-separated set
+    return best[:target], best_eps
+
+# copy the CSV file one chunk of rows at a time, keeping only the selected rows
+def write_rows(path_csv, path_output, keep):
+    row = 0
+    # round_trip parsing keeps the values exactly as they were written
+    for chunk in read_csv(path_csv, chunksize=CSV_CHUNK_SIZE, float_precision='round_trip'):
+        chunk_keep = keep[row:row+len(chunk.index)]
+        chunk[chunk_keep].to_csv(path_output, mode='w' if row == 0 else 'a', header=row == 0, index=False)
+        row += len(chunk.index)
+
+# globals
+path_root = None
+path_output = None
+path_manifest = None
+groups = ['joints', 'bodies']
+root = 'pelvis'
+depth_weight = 1.0
+dims = 16
+eps = None
+target = None
+seed = 0
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, path_manifest, groups, root, depth_weight, dims, eps, target, seed
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "manifest=", "groups=", "root=", "depth-weight=", "dims=", "eps=", "target=", "seed="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--manifest":
+                path_manifest = current_val
+            elif current_arg == "--groups":
+                groups = current_val.split(',')
+            elif current_arg == "--root":
+                root = current_val
+            elif current_arg == "--depth-weight":
+                depth_weight = float(current_val)
+            elif current_arg == "--dims":
+                dims = int(current_val)
+            elif current_arg == "--eps":
+                eps = float(current_val)
+            elif current_arg == "--target":
+                target = int(current_val)
+            elif current_arg == "--seed":
+                seed = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output, path_manifest
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+        return
+    if (eps is None) == (target is None):
+        print('Specify either the number of rows to keep with --target N or the distance of near-duplicates with --eps E')
+        return
+    if target is not None and target < 1:
+        print('The number of rows to keep with --target N must be at least 1')
+        return
+    if eps is not None and eps < 0:
+        print('The distance of near-duplicates with --eps E must not be negative')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    keypoints, root_index = select_keypoints(store.schema, groups, root)
+    if len(keypoints) == 0:
+        print('No keypoints in the groups', ','.join(groups))
+        return
+    if root_index is None:
+        print('No keypoint named', root, 'in the groups', ','.join(groups) + '; using the mean of the keypoints as the root')
+
+    components, explained = embed_store(store, groups, root_index, depth_weight, dims)
+    print('Embedded', len(store), 'rows with', components.shape[1], 'principal components, which explain', round(100*explained, 1), '% of the variance')
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(store))
+    if target is not None:
+        kept, used_eps = prune_to_target(components, order, target, rng)
+    else:
+        kept, used_eps = prune(components, order, eps), eps
+    keep = np.zeros(len(store), dtype=bool)
+    keep[kept] = True
+    print('Keeping', int(keep.sum()), '/', len(store), 'rows with eps', round(used_eps, 5))
+
+    if path_output is None:
+        path_output = Path(path_root) / 'annotations/annotations_diverse.csv'
+    if path_manifest is None:
+        path_manifest = Path(path_root) / 'annotations/manifest_diverse.txt'
+    write_rows(path_csv, path_output, keep)
+    with open(path_manifest, 'w') as f:
+        for row in np.flatnonzero(keep):
+            f.write('images/' + str(store.file_names[row]) + '.jpg\n')
+    print('Saved the kept rows to', path_output, 'and their images to', path_manifest)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+This Python module reads datasets generated by Godosim that have been packed into shards by pack_shards.py, as a replacement for the folders of loose image files.
+A shard folder holds tar files of a fixed maximum size ("shard_00000.tar", ...) in the WebDataset layout: the files of each sample follow each other and are named after the image, e.g., "<file_name>.jpg", "<file_name>.silhouette.png", "<file_name>.segments.png" and "<file_name>.json" with the keypoints and bounding box of its row in the annotations.
+Samples are in the order of the rows in the annotations, and a global index of the shard, offset and size of each file of each sample gives random access to any file with a single read from the memory-mapped shard, without scanning the tar files.
+The index is saved as .npy files next to the shards, and the annotations are saved as a keypoint store (see keypoint_store.py) in "annotations_cache" in the shard folder, so that the shard folder is all that is needed.
+Basic usage:
+    shards = ShardReader("PATH/TO/SHARDS")
+    shards.store.keypoints['joints'][idx] # the annotations of the packed dataset, like load_keypoint_store
+    img = shards.load_image(idx) # decoded RGB image of row idx
+    mask = shards.load_mask(idx, 'silhouette') # mask image of row idx, like masks.load_mask
+    mask = read_mask("PATH/TO/MASKS/OR/SHARDS", file_name, '.png', 'silhouette') # mask image of an image from a mask folder or a shard folder
+    data = shards.read(idx, 'image') # raw bytes of a file of row idx, or None if the sample has no such file
+"""
+
+import io, json, mmap, threading
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from keypoint_store import open_keypoint_store
+from masks import load_mask, get_mask_path
+
+# the files that a sample can hold and their extensions in the tar files; the masks get the extension of their image files after these
+FIELD_EXTENSIONS = {'image': '.jpg', 'silhouette': '.silhouette', 'segments': '.segments', 'annotation': '.json'}
+# increment when the layout of the shards changes
+SHARDS_VERSION = 1
+
+
+# get the path of a shard in a shard folder
+def get_shard_path(path_shards, shard):
+    return Path(path_shards) / ('shard_' + str(shard).zfill(5) + '.tar')
+
+# get the folder of the annotations of a shard folder, which is a keypoint store cache
+def get_shard_store_path(path_shards):
+    return Path(path_shards) / 'annotations_cache'
+
+# get the JSON object of a row of the annotations that each sample holds; missing values (NaN) become null
+def get_sample_annotation(store, idx):
+    def values(array):
+        return [None if np.isnan(x) else float(x) for x in np.ravel(array)]
+    annotation = {'file_name': str(store.file_names[idx]), 'box': values(store.boxes[idx]), 'keypoints': {}, 'visibility': {}}
+    for group, names in store.schema.items():
+        annotation['keypoints'][group] = dict(zip(names, [values(keypoint) for keypoint in store.keypoints[group][idx]]))
+        annotation['visibility'][group] = dict(zip(names, values(store.visibility[group][idx])))
+    return annotation
+
+
+class ShardReader:
+    def __init__(self, path_shards):
+        self.path = Path(path_shards)
+        # the info file is written last and marks the shards as complete
+        with open(self.path / 'shards.json', 'r') as f:
+            info = json.load(f)
+        if info.get('version') != SHARDS_VERSION:
+            raise ValueError('Unsupported shards in ' + str(self.path))
+        self.fields = info['fields']
+        self.extensions = info['extensions']
+        self.n_shards = info['n_shards']
+        # (n_samples,) shard of each sample and (n_samples, n_fields) offsets and sizes of its files in the shard; files that a sample does not have get size -1
+        self.shards = np.load(self.path / 'index_shards.npy', mmap_mode='r')
+        self.offsets = np.load(self.path / 'index_offsets.npy', mmap_mode='r')
+        self.sizes = np.load(self.path / 'index_sizes.npy', mmap_mode='r')
+        self.store = open_keypoint_store(get_shard_store_path(self.path))
+        # shards are memory-mapped when they are first read
+        self.maps = {}
+        # rows of the file names, which are only looked up when samples are found by name
+        self.rows = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.shards)
+
+    def _get_map(self, shard):
+        with self.lock:
+            shard_map = self.maps.get(shard)
+            if shard_map is None:
+                with open(get_shard_path(self.path, shard), 'rb') as f:
+                    shard_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[shard] = shard_map
+        return shard_map
+
+    # get the row of an image by its file name
+    def find(self, file_name):
+        if self.rows is None:
+            self.rows = {str(name): i for i, name in enumerate(self.store.file_names)}
+        return self.rows[str(file_name)]
+
+    # read the bytes of a file of a sample, or None if the sample does not have it
+    def read(self, idx, field):
+        column = self.fields.index(field)
+        size = int(self.sizes[idx, column])
+        if size < 0:
+            return None
+        offset = int(self.offsets[idx, column])
+        return self._get_map(int(self.shards[idx]))[offset:offset+size]
+
+    # decode the RGB image of a sample into an array
+    def load_image(self, idx):
+        with Image.open(io.BytesIO(self.read(idx, 'image'))) as img:
+            return np.asarray(img)
+
+    # decode a mask image ('silhouette' or 'segments') of a sample into an array
+    def load_mask(self, idx, field):
+        data = self.read(idx, field)
+        if data is None:
+            raise ValueError('Sample ' + str(idx) + ' in ' + str(self.path) + ' has no ' + field + ' mask')
+        return load_mask(io.BytesIO(data))
+
+    # get the annotations of a sample as they were written into its JSON file
+    def load_annotation(self, idx):
+        return json.loads(self.read(idx, 'annotation'))
+
+    def close(self):
+        with self.lock:
+            for shard_map in self.maps.values():
+                shard_map.close()
+            self.maps = {}
+
+# the readers of the shard folders that have been opened in this process, so that worker processes open each folder only once
+readers = {}
+
+# open a shard folder, reusing the reader if it has already been opened in this process
+def open_shards(path_shards):
+    reader = readers.get(str(path_shards))
+    if reader is None:
+        reader = ShardReader(path_shards)
+        readers[str(path_shards)] = reader
+    return reader
+
+# check whether a folder holds shards packed by pack_shards.py
+def is_shard_folder(path):
+    return str(path) in readers or (Path(path) / 'shards.json').exists()
+
+# read the mask image ('silhouette' or 'segments') of an image from a mask folder or, if the folder is a shard folder, from the shards
+def read_mask(path_masks, file_name, extension, field):
+    if is_shard_folder(path_masks):
+        shards = open_shards(path_masks)
+        return shards.load_mask(shards.find(file_name), field)
+    return load_mask(get_mask_path(path_masks, file_name, extension))
@@ -0,0 +1,154 @@
+"""
+This Python script checks all annotations generated by Godosim for broken values, so that they do not have to be found by eye in annotation_viewer.py.
+Basic usage: "python validate_annotations.py --path PATH/TO/ROOT/FOLDER"
+The root folder should contain the folders "annotations" and "images", as generated by Godosim.
+The checks, which are counted per row over the keypoints of all groups (bodies, joints and virtual markers):
+    "nan_position": keypoints whose x or y is missing (NaN)
+    "nan_depth": keypoints whose depth (z) is missing (NaN)
+    "out_of_bounds": keypoints outside the image
+    "outside_box": keypoints outside the bounding box by more than a tolerance ("--tolerance PIXELS", 1 by default)
+    "flat_depth": keypoint groups whose depths all have the same value, which e.g. makes the keypoint symbols of the viewer meaningless
+    "bad_box": 1 if the bounding box is missing, has no area, or is outside the image
+The rows that fail any check are saved with their counts to "annotations/annotation_issues.csv", unless another file is given with "--output PATH/TO/FILE", and the number of failing rows of each check is printed and saved next to it as a JSON file.
+Use "python annotation_viewer.py --path PATH/TO/ROOT/FOLDER --issues PATH/TO/annotation_issues.csv" to browse only the failing rows.
+The image size is read from the first image; use "--width" and "--height" to set it manually.
+The checks are array operations over chunks of rows of the memory-mapped keypoint store, which are split between worker processes; use "--processes N" to set their number (all CPU cores by default).
+"""
+
+import sys, getopt, os, json
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pandas import DataFrame
+from keypoint_store import load_keypoint_store, open_keypoint_store, get_cache_path
+from image_loading import read_image_size
+
+# how many rows each task handed to a worker process checks
+CHUNK_SIZE = 20000
+# names of the checks, which are the columns of the issue table
+CHECKS = ['nan_position', 'nan_depth', 'out_of_bounds', 'outside_box', 'flat_depth', 'bad_box']
+
+
+# run all checks on the keypoints and boxes of a range of rows; returns (n_rows, n_checks) counts in the order of CHECKS
+def check_rows(store, start, end, width, height, tolerance):
+    counts = np.zeros((end-start, len(CHECKS)), dtype=np.int32)
+    boxes = np.asarray(store.boxes[start:end])
+    lower = boxes[:,None,:2]
+    upper = boxes[:,None,:2] + boxes[:,None,2:]
+    for group in store.schema:
+        keypoints = np.asarray(store.keypoints[group][start:end])
+        if keypoints.shape[1] == 0:
+            continue
+        xy = keypoints[...,:2]
+        z = keypoints[...,2]
+        # comparisons with NaN are false, so missing values are only counted by the NaN checks
+        missing = np.isnan(xy).any(axis=2)
+        counts[:,0] += missing.sum(axis=1)
+        counts[:,1] += np.isnan(z).sum(axis=1)
+        counts[:,2] += ((xy[...,0] < 0) | (xy[...,1] < 0) | (xy[...,0] > width) | (xy[...,1] > height)).sum(axis=1)
+        counts[:,3] += ((xy < lower - tolerance) | (xy > upper + tolerance)).any(axis=2).sum(axis=1)
+        if keypoints.shape[1] > 1:
+            # fmax and fmin ignore NaN unless all values are NaN
+            counts[:,4] += np.fmax.reduce(z, axis=1) - np.fmin.reduce(z, axis=1) == 0
+    with np.errstate(invalid='ignore'):
+        counts[:,5] = np.isnan(boxes).any(axis=1) | (boxes[:,2] <= 0) | (boxes[:,3] <= 0) | (boxes[:,0] > width) | (boxes[:,1] > height) | (upper[:,0,0] < 0) | (upper[:,0,1] < 0)
+    return counts
+
+# the store is opened once in each worker process; it is memory-mapped from the cache, so opening it is cheap
+worker_store = None
+
+def init_worker(cache_path):
+    global worker_store
+    worker_store = open_keypoint_store(cache_path)
+
+# check a range of rows in a worker process; returns the rows that failed any check and their counts
+def check_chunk(start, width, height, tolerance):
+    end = min(start + CHUNK_SIZE, len(worker_store))
+    counts = check_rows(worker_store, start, end, width, height, tolerance)
+    failed = np.flatnonzero(counts.any(axis=1))
+    return start + failed, counts[failed]
+
+# globals
+path_root = None
+path_output = None
+width = None
+height = None
+tolerance = 1.0
+n_processes = None
+
+# parse cmd line args and set globals accordingly
+def parse_arguments():
+    global path_root, path_output, width, height, tolerance, n_processes
+
+    argument_list = sys.argv[1:]
+    # p for path, o for output
+    opts_short = "p:o:"
+    opts_long = ["path=", "output=", "width=", "height=", "tolerance=", "processes="]
+
+    try:
+        # parse arguments and values
+        arguments, values = getopt.getopt(argument_list, opts_short, opts_long)
+
+        for current_arg, current_val in arguments:
+            if current_arg in ("-p", "--path"):
+                path_root = current_val
+            elif current_arg in ("-o", "--output"):
+                path_output = current_val
+            elif current_arg == "--width":
+                width = int(current_val)
+            elif current_arg == "--height":
+                height = int(current_val)
+            elif current_arg == "--tolerance":
+                tolerance = float(current_val)
+            elif current_arg == "--processes":
+                n_processes = int(current_val)
+
+    except getopt.error as err:
+        print(str(err))
+
+def main():
+    global path_output, width, height
+
+    parse_arguments()
+
+    if path_root is None:
+        print('Specify path to the folder with the images and annotations folder with --path path/to/folder')
+        return
+
+    path_csv = Path(path_root) / 'annotations/annotations.csv'
+    store = load_keypoint_store(path_csv)
+    if len(store) == 0:
+        print('No annotations in', path_csv)
+        return
+
+    # the image size is read from the header of the first image, as all images of a dataset have the same resolution
+    if width is None or height is None:
+        size = read_image_size(Path(path_root) / 'images' / (str(store.file_names[0]) + '.jpg'))
+        width = size[0] if width is None else width
+        height = size[1] if height is None else height
+    print('Image size:', width, 'x', height)
+
+    starts = list(range(0, len(store), CHUNK_SIZE))
+    n_workers = n_processes if n_processes is not None else os.cpu_count()
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(starts)), initializer=init_worker, initargs=(get_cache_path(path_csv),)) as executor:
+        results = list(executor.map(check_chunk, starts, [width]*len(starts), [height]*len(starts), [tolerance]*len(starts)))
+    rows = np.concatenate([rows for rows, _ in results])
+    counts = np.concatenate([counts for _, counts in results])
+
+    if path_output is None:
+        path_output = Path(path_root) / 'annotations/annotation_issues.csv'
+    issues = DataFrame(counts, columns=CHECKS)
+    issues.insert(0, 'file_names', np.asarray(store.file_names)[rows])
+    issues.insert(0, 'row', rows)
+    issues.to_csv(path_output, index=False)
+    summary = {'rows': len(store), 'failed_rows': len(rows), 'checks': {check: int((counts[:,i] > 0).sum()) for i, check in enumerate(CHECKS)}}
+    with open(Path(path_output).with_suffix('.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+
+    print('Rows that failed any check:', len(rows), '/', len(store))
+    for check, n_rows in summary['checks'].items():
+        print(' ', check + ':', n_rows)
+    print('Saved the issues to', path_output)
+
+if __name__ == '__main__':
+    main()